@@ -0,0 +1,189 @@
+"""
+Callback Profiler Module for AppDaemon
+Misura durata e chiamate di servizio dei callback, per callback e per luce
+"""
+
+import functools
+import threading
+import time
+
+
+class CallbackProfiler:
+    """
+    Profiler leggero dei callback per AppDaemon.
+
+    Questa classe fornisce una superficie di profiling che:
+    - Avvolge i callback dei listener registrati tramite un unico punto di registrazione
+    - Registra numero di chiamate, tempo totale e massimo per callback e per luce
+    - Conta le chiamate a get_state/turn_on/turn_off eseguite durante ogni callback
+    - Si attiva e disattiva a runtime: da spento costa un solo controllo per chiamata
+    - Pubblica le statistiche come sensori e produce un dump su richiesta
+    """
+
+    COUNTERS = ("get_state", "turn_on", "turn_off")
+
+    def __init__(self, hass_instance, enabled=False, sensor_prefix="sensor.light_presence_profile"):
+        """
+        Inizializza il profiler.
+
+        Args:
+            hass_instance: Istanza dell'app AppDaemon (log e set_state)
+            enabled: Stato iniziale del profiling
+            sensor_prefix: Prefisso dei sensori pubblicati
+        """
+        self.hass = hass_instance
+        self.enabled = enabled
+        self.sensor_prefix = sensor_prefix
+        self.by_callback = {}  # {callback: statistiche}
+        self.by_light = {}     # {luce: {callback: statistiche}}
+        self.started = time.monotonic()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def wrap(self, callback):
+        """
+        Avvolge un callback di listen_state (entity, attribute, old, new, kwargs).
+        La luce viene letta da kwargs["config"]["light_entity"] solo a profiling attivo.
+        """
+        @functools.wraps(callback)
+        def profiled(entity, attribute, old, new, kwargs):
+            if not self.enabled:
+                return callback(entity, attribute, old, new, kwargs)
+
+            config = kwargs.get("config") or {}
+            light_entity = config.get("light_entity", "unknown")
+            return self.run(callback.__name__, light_entity, callback, entity, attribute, old, new, kwargs)
+
+        return profiled
+
+    def run(self, name, light_entity, callback, *args):
+        """Esegue il callback misurandone durata e chiamate di servizio"""
+        frame = dict.fromkeys(self.COUNTERS, 0)
+        previous = getattr(self._local, "frame", None)
+        self._local.frame = frame
+        started = time.perf_counter()
+        try:
+            return callback(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._local.frame = previous
+            self.record(name, light_entity, elapsed, frame)
+
+    def count(self, operation):
+        """Conta un'operazione (get_state/turn_on/turn_off) nel callback in esecuzione"""
+        if not self.enabled:
+            return
+        frame = getattr(self._local, "frame", None)
+        if frame is not None:
+            frame[operation] += 1
+
+    def record(self, name, light_entity, elapsed, frame):
+        """Aggiorna le statistiche del callback e della luce"""
+        with self._lock:
+            for stats in (
+                self.by_callback.setdefault(name, self._new_stats()),
+                self.by_light.setdefault(light_entity, {}).setdefault(name, self._new_stats())
+            ):
+                stats["calls"] += 1
+                stats["total"] += elapsed
+                stats["max"] = max(stats["max"], elapsed)
+                for operation in self.COUNTERS:
+                    stats[operation] += frame[operation]
+
+    def _new_stats(self):
+        stats = {"calls": 0, "total": 0.0, "max": 0.0}
+        stats.update(dict.fromkeys(self.COUNTERS, 0))
+        return stats
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+        self.hass.log(f"📈 Profiling callback {'attivato' if self.enabled else 'disattivato'}", level="INFO")
+
+    def reset(self):
+        with self._lock:
+            self.by_callback.clear()
+            self.by_light.clear()
+            self.started = time.monotonic()
+
+    def summarize(self, stats_by_callback):
+        """Aggrega le statistiche di più callback in un totale"""
+        total = self._new_stats()
+        for stats in stats_by_callback.values():
+            total["calls"] += stats["calls"]
+            total["total"] += stats["total"]
+            total["max"] = max(total["max"], stats["max"])
+            for operation in self.COUNTERS:
+                total[operation] += stats[operation]
+        return total
+
+    def format_stats(self, stats):
+        """Converte le statistiche in attributi leggibili (tempi in ms)"""
+        calls = stats["calls"]
+        attributes = {
+            "calls": calls,
+            "total_ms": round(stats["total"] * 1000, 2),
+            "avg_ms": round(stats["total"] * 1000 / calls, 3) if calls else 0.0,
+            "max_ms": round(stats["max"] * 1000, 2)
+        }
+        for operation in self.COUNTERS:
+            attributes[operation] = stats[operation]
+        return attributes
+
+    def publish(self):
+        """Pubblica un sensore per luce e un sensore riepilogativo"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            snapshot = {light: {name: dict(stats) for name, stats in callbacks.items()}
+                        for light, callbacks in self.by_light.items()}
+            by_callback = {name: dict(stats) for name, stats in self.by_callback.items()}
+
+        window = round(time.monotonic() - self.started, 1)
+        for light_entity, callbacks in snapshot.items():
+            total = self.format_stats(self.summarize(callbacks))
+            object_id = light_entity.split(".")[-1]
+            self.hass.set_state(
+                f"{self.sensor_prefix}_{object_id}",
+                state=total["total_ms"],
+                attributes={
+                    **total,
+                    "light_entity": light_entity,
+                    "window_seconds": window,
+                    "callbacks": {name: self.format_stats(stats) for name, stats in callbacks.items()},
+                    "unit_of_measurement": "ms",
+                    "friendly_name": f"Profilo callback {object_id}"
+                }
+            )
+
+        total = self.format_stats(self.summarize(by_callback))
+        self.hass.set_state(
+            self.sensor_prefix,
+            state=total["total_ms"],
+            attributes={
+                **total,
+                "window_seconds": window,
+                "lights": len(snapshot),
+                "callbacks": {name: self.format_stats(stats) for name, stats in by_callback.items()},
+                "unit_of_measurement": "ms",
+                "friendly_name": "Profilo callback LightPresenceControl"
+            }
+        )
+
+    def dump(self):
+        """Scrive nel log le statistiche, ordinate per tempo totale"""
+        with self._lock:
+            lights = {light: self.summarize(callbacks) for light, callbacks in self.by_light.items()}
+            by_callback = {name: dict(stats) for name, stats in self.by_callback.items()}
+
+        self.hass.log(f"📈 PROFILO CALLBACK ({time.monotonic() - self.started:.0f}s, profiling {'attivo' if self.enabled else 'spento'})", level="INFO")
+        for title, table in (("Per callback", by_callback), ("Per luce", lights)):
+            self.hass.log(f"  {title}:", level="INFO")
+            for name, stats in sorted(table.items(), key=lambda item: item[1]["total"], reverse=True):
+                values = self.format_stats(stats)
+                self.hass.log(
+                    f"  - {name}: {values['calls']} chiamate, totale {values['total_ms']}ms, "
+                    f"medio {values['avg_ms']}ms, max {values['max_ms']}ms, "
+                    f"get_state {values['get_state']}, turn_on {values['turn_on']}, turn_off {values['turn_off']}",
+                    level="INFO"
+                )
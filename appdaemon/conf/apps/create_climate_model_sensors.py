@@ -1,17 +1,24 @@
 import appdaemon.plugins.hass.hassapi as hass
 import re
+from temperature_cache import TemperatureCache
 
 class CreateClimateModelSensors(hass.Hass):
 
     def initialize(self):
         self.log("Inizializzazione dell'app CreateClimateModelSensors...", level="INFO")
         
-        # Cache per ottimizzare le richieste di stato
-        self.temperature_cache = {}
+        # Cache LRU con scadenza per ottimizzare le richieste di stato
+        self.temperature_cache = TemperatureCache(
+            max_size=self.args.get("temperature_cache_size", 64),
+            ttl=self.args.get("temperature_cache_ttl", 900)
+        )
         self.climate_sensors_created = {}  # Traccia i sensori creati per evitare duplicati
+        # Indice di fan-out: un solo listener per sensore sorgente, che aggiorna tutti i sensori collegati
+        self.source_targets = {}  # {source: [climate_sensor_id]}
+        self.source_handles = {}  # {source: handle del listener}
 
-        # Ascolta l'evento homeassistant_start per l'inizializzazione
-        self.listen_event(self.create_climate_sensors, "homeassistant_start")
+        # Ascolta l'evento homeassistant_start: HA non conserva i sensori creati con set_state
+        self.listen_event(self.on_homeassistant_start, "homeassistant_start")
         
         # Ascolta i cambiamenti del registry per aggiornamenti dinamici
         self.listen_event(self.create_climate_sensors, "area_registry_updated")
@@ -53,10 +60,17 @@ class CreateClimateModelSensors(hass.Hass):
         
         return area_climate_entities
 
+    def on_homeassistant_start(self, event_name, data, kwargs):
+        """Ripubblica tutti i sensori: dopo il riavvio di HA i sensori creati con set_state non esistono più"""
+        self.log("♻️ Home Assistant avviato, ripubblico tutti i sensori climate...", level="INFO")
+        # Le temperature in cache precedono il riavvio: rileggile dalle sorgenti
+        self.temperature_cache.clear()
+        self.create_climate_sensors(force=True)
+
     def on_environment_sensors_ready(self, event_name, data, kwargs):
         """Ri-crea i sensori quando gli aggregati ambientali sono pronti"""
         self.log("♻️ Sensori ambientali pronti, ri-creo i sensori climate...", level="INFO")
-        self.create_climate_sensors()
+        self.create_climate_sensors(force=True)
 
     def find_temperature_sensors_for_area(self, area_name):
         """
@@ -73,7 +87,7 @@ class CreateClimateModelSensors(hass.Hass):
         # PRIORITÀ 1: Cerca il sensore aggregato (sia medio che singolo hanno lo stesso nome)
         aggregated_sensor = f"sensor.{safe_area_name}_temperature"
         if self.entity_exists(aggregated_sensor):
-            self.log(f"✅ Trovato sensore aggregato: {aggregated_sensor}", level="INFO")
+            self.log(f"✅ Trovato sensore aggregato: {aggregated_sensor}", level="DEBUG")
             return [aggregated_sensor]
         
         # PRIORITÀ 3: Fallback ai sensori fisici (se non esistono aggregati)
@@ -108,124 +122,227 @@ class CreateClimateModelSensors(hass.Hass):
         self.log(f"Trovati {len(temperature_sensors)} sensori fisici per l'area {area_name}: {temperature_sensors}", level="DEBUG")
         return temperature_sensors
 
-    def create_climate_sensors(self, *args, **kwargs):
+    def create_climate_sensors(self, *args, force=False, **kwargs):
+        """
+        Crea/aggiorna i sensori modello climate.
+        Con force=True ripubblica anche i sensori invariati (riavvio di HA, aggregati pronti);
+        gli aggiornamenti del registry applicano solo le differenze.
+        """
         self.log("Avvio creazione sensori modello per le entità climate...", level="DEBUG")
 
         try:
-            # Ottieni le entità climate raggruppate per area
-            area_climate_entities = self.get_climate_entities_by_area()
-            
-            if not area_climate_entities:
-                self.log("Nessuna entità climate trovata con area assegnata.", level="WARNING")
-                return
-
-            # Per ogni area con entità climate
-            for area_name, climate_entities in area_climate_entities.items():
-                self.log(f"🏠 Processando area: {area_name} con {len(climate_entities)} entità climate: {climate_entities}", level="INFO")
-                
-                # Trova il sensore di temperatura (priorità agli aggregati)
-                temperature_sensors = self.find_temperature_sensors_for_area(area_name)
-                
-                if not temperature_sensors:
-                    self.log(f"⚠️ Nessun sensore di temperatura trovato per l'area '{area_name}'. Saltata.", level="WARNING")
-                    continue
-
-                # Usa il primo sensore (che sarà l'aggregato se esiste, grazie alla priorità)
-                primary_temp_sensor = temperature_sensors[0]
-                
-                self.log(f"📍 Sensore temperatura selezionato per '{area_name}': {primary_temp_sensor}", level="INFO")
-                
-                # Cerca l'entità climate con numeri nell'ID (ignora wrapper senza numeri)
-                climate_with_numbers = None
-                for climate_entity in climate_entities:
-                    digits = re.findall(r'\d+', climate_entity)
-                    if digits:
-                        climate_with_numbers = climate_entity
-                        self.log(f"🔢 Trovata entità climate con numeri: {climate_entity} (numeri: {digits})", level="DEBUG")
-                        break
-                    else:
-                        self.log(f"⏭️ Saltata entità senza numeri: {climate_entity}", level="DEBUG")
-                
-                # Se nessuna entità ha numeri, salta questa area
-                if not climate_with_numbers:
-                    self.log(f"⚠️ Nessuna entità climate con numeri trovata in '{area_name}'. Entità presenti: {climate_entities}", level="WARNING")
-                    continue
-                
-                # Estrai i numeri dall'entità climate
-                digits = re.findall(r'\d+', climate_with_numbers)
-                
-                # --- LOGICA PER ID E NOME ---
-                # ID del sensore: es. "sensor.temperature_01_06"
-                climate_sensor_id = f"sensor.temperature_{'_'.join(digits)}"
-
-                # Nome del sensore: recupera il friendly_name dell'entità climate e aggiunge l'area
-                # es. "Temperatura Relay 06 in Ingresso"
-                climate_friendly_name = self.friendly_name(climate_with_numbers)
-                sensor_name = f"Temperatura {climate_friendly_name} in {area_name}"
-                
-                # --- FINE LOGICA ---
-
-                temperature_state = self.get_validated_temperature(primary_temp_sensor)
-
-                # Crea il sensore e inizia ad ascoltare i cambiamenti di stato
-                self.create_sensor(climate_sensor_id, sensor_name, temperature_state)
-                
-                # Rimuovi eventuali listener precedenti per evitare duplicati
-                if climate_sensor_id in self.climate_sensors_created:
-                    old_handle = self.climate_sensors_created[climate_sensor_id].get('handle')
-                    if old_handle:
-                        self.cancel_listen_state(old_handle)
-                
-                # Crea un nuovo listener e salva l'handle con la sorgente
-                handle = self.listen_state(
-                    self.update_climate_sensor, 
-                    primary_temp_sensor,
-                    name=sensor_name,
-                    climate_sensor_id=climate_sensor_id
-                )
-                
+            # Calcola la mappa desiderata {climate_sensor_id: (sorgente, nome)}
+            desired_sensors = self.build_desired_climate_sensors()
+
+            # Applica solo le differenze rispetto ai sensori già creati
+            # (con la mappa vuota vengono rimossi tutti i sensori esistenti)
+            self.reconcile_climate_sensors(desired_sensors, force=force)
+
+        except Exception as e:
+            self.log(f"Errore durante la creazione dei sensori climate: {str(e)}", level="ERROR")
+
+    def build_desired_climate_sensors(self):
+        """
+        Calcola la mappa desiderata dei sensori modello climate.
+        Restituisce un dizionario: {climate_sensor_id: (primary_temp_sensor, sensor_name)},
+        vuoto se non ci sono entità climate con area assegnata.
+        """
+        # Ottieni le entità climate raggruppate per area
+        area_climate_entities = self.get_climate_entities_by_area()
+
+        if not area_climate_entities:
+            self.log("Nessuna entità climate trovata con area assegnata.", level="WARNING")
+            return {}
+
+        desired_sensors = {}
+
+        # Per ogni area con entità climate
+        for area_name, climate_entities in area_climate_entities.items():
+            self.log(f"🏠 Processando area: {area_name} con {len(climate_entities)} entità climate: {climate_entities}", level="DEBUG")
+
+            # Trova il sensore di temperatura (priorità agli aggregati)
+            temperature_sensors = self.find_temperature_sensors_for_area(area_name)
+
+            if not temperature_sensors:
+                self.log(f"⚠️ Nessun sensore di temperatura trovato per l'area '{area_name}'. Saltata.", level="WARNING")
+                continue
+
+            # Usa il primo sensore (che sarà l'aggregato se esiste, grazie alla priorità)
+            primary_temp_sensor = temperature_sensors[0]
+
+            self.log(f"📍 Sensore temperatura selezionato per '{area_name}': {primary_temp_sensor}", level="DEBUG")
+
+            # Cerca l'entità climate con numeri nell'ID (ignora wrapper senza numeri)
+            climate_with_numbers = None
+            for climate_entity in climate_entities:
+                digits = re.findall(r'\d+', climate_entity)
+                if digits:
+                    climate_with_numbers = climate_entity
+                    self.log(f"🔢 Trovata entità climate con numeri: {climate_entity} (numeri: {digits})", level="DEBUG")
+                    break
+                else:
+                    self.log(f"⏭️ Saltata entità senza numeri: {climate_entity}", level="DEBUG")
+
+            # Se nessuna entità ha numeri, salta questa area
+            if not climate_with_numbers:
+                self.log(f"⚠️ Nessuna entità climate con numeri trovata in '{area_name}'. Entità presenti: {climate_entities}", level="WARNING")
+                continue
+
+            # Estrai i numeri dall'entità climate
+            digits = re.findall(r'\d+', climate_with_numbers)
+
+            # --- LOGICA PER ID E NOME ---
+            # ID del sensore: es. "sensor.temperature_01_06"
+            climate_sensor_id = f"sensor.temperature_{'_'.join(digits)}"
+
+            # Nome del sensore: recupera il friendly_name dell'entità climate e aggiunge l'area
+            # es. "Temperatura Relay 06 in Ingresso"
+            climate_friendly_name = self.friendly_name(climate_with_numbers)
+            sensor_name = f"Temperatura {climate_friendly_name} in {area_name}"
+
+            # --- FINE LOGICA ---
+
+            desired_sensors[climate_sensor_id] = (primary_temp_sensor, sensor_name)
+
+        return desired_sensors
+
+    def reconcile_climate_sensors(self, desired_sensors, force=False):
+        """
+        Confronta la mappa desiderata con climate_sensors_created e tocca solo le voci cambiate:
+        - sensori nuovi: crea il sensore e lo collega all'indice della sorgente
+        - sorgente cambiata: sposta il sensore sull'indice della nuova sorgente e lo aggiorna
+        - solo nome cambiato: aggiorna il sensore senza toccare i listener
+        - sensori non più presenti: li scollega dalla sorgente e li marca come non disponibili
+        Il listener di una sorgente esiste finché almeno un sensore climate la usa.
+        I sensori invariati non generano né listener né scritture, salvo force=True:
+        in quel caso vengono ripubblicati (set_state) senza toccare i listener.
+        """
+        added = changed = removed = republished = 0
+
+        # Rimuovi i sensori che non sono più desiderati
+        for climate_sensor_id in list(self.climate_sensors_created):
+            if climate_sensor_id not in desired_sensors:
+                self.remove_climate_sensor(climate_sensor_id)
+                removed += 1
+
+        for climate_sensor_id, (primary_temp_sensor, sensor_name) in desired_sensors.items():
+            current = self.climate_sensors_created.get(climate_sensor_id)
+
+            # Nessuna modifica: niente listener né set_state (salvo ripubblicazione forzata)
+            if current and current['source'] == primary_temp_sensor and current['name'] == sensor_name:
+                if force:
+                    self.create_sensor(climate_sensor_id, sensor_name, self.get_validated_temperature(primary_temp_sensor))
+                    republished += 1
+                continue
+
+            if current and current['source'] == primary_temp_sensor:
+                # Cambia solo il nome: il listener legge il nome da climate_sensors_created
+                current['name'] = sensor_name
+                self.log(f"✏️ Rinominato sensore climate '{climate_sensor_id}' in '{sensor_name}'", level="INFO")
+            else:
+                # Sensore nuovo o sorgente cambiata: sposta il sensore nell'indice della nuova sorgente
+                if current:
+                    self.detach_from_source(climate_sensor_id, current['source'])
+                self.attach_to_source(climate_sensor_id, primary_temp_sensor)
+
                 self.climate_sensors_created[climate_sensor_id] = {
                     'source': primary_temp_sensor,
-                    'handle': handle
+                    'name': sensor_name
                 }
-                
                 self.log(f"✅ Creato sensore climate '{climate_sensor_id}' collegato a '{primary_temp_sensor}'", level="INFO")
-        
-        except Exception as e:
-            self.log(f"Errore durante la creazione dei sensori climate: {str(e)}", level="ERROR")
+
+            if current:
+                changed += 1
+            else:
+                added += 1
+
+            temperature_state = self.get_validated_temperature(primary_temp_sensor)
+            self.create_sensor(climate_sensor_id, sensor_name, temperature_state)
+
+        if added or changed or removed or republished:
+            self.log(f"♻️ Sensori climate riconciliati: {added} aggiunti, {changed} modificati, {removed} rimossi, {republished} ripubblicati", level="INFO")
+        else:
+            self.log("Sensori climate già allineati, nessuna modifica", level="DEBUG")
+
+        self.log(f"📊 Cache temperature: {self.temperature_cache.get_stats()}", level="DEBUG")
+
+    def remove_climate_sensor(self, climate_sensor_id):
+        """Rimuove il listener di un sensore climate non più necessario e lo marca come non disponibile"""
+        entry = self.climate_sensors_created.pop(climate_sensor_id)
+        self.detach_from_source(climate_sensor_id, entry['source'])
+
+        self.set_state(climate_sensor_id, state="unavailable", attributes={"friendly_name": f"{entry['name']} (rimosso)"})
+        self.log(f"🗑️ Sensore climate '{climate_sensor_id}' rimosso (sorgente: {entry['source']})", level="INFO")
+
+    def attach_to_source(self, climate_sensor_id, source):
+        """Collega un sensore climate alla sua sorgente, creando il listener solo per la prima destinazione"""
+        targets = self.source_targets.setdefault(source, [])
+        if climate_sensor_id not in targets:
+            targets.append(climate_sensor_id)
+
+        if source not in self.source_handles:
+            self.source_handles[source] = self.listen_state(self.update_climate_sensor, source)
+            self.log(f"👂 Listener creato per la sorgente {source}", level="DEBUG")
+
+    def detach_from_source(self, climate_sensor_id, source):
+        """Scollega un sensore climate dalla sorgente, rimuovendo il listener quando non ha più destinazioni"""
+        targets = self.source_targets.get(source, [])
+        if climate_sensor_id in targets:
+            targets.remove(climate_sensor_id)
+
+        if not targets:
+            self.source_targets.pop(source, None)
+            handle = self.source_handles.pop(source, None)
+            if handle:
+                self.cancel_listen_state(handle)
+                self.log(f"🔇 Listener rimosso per la sorgente {source}", level="DEBUG")
 
     def get_validated_temperature(self, sensor_id: str):
         """Ottiene e valida lo stato del sensore di temperatura"""
-        if sensor_id in self.temperature_cache:
-            self.log(f"Recuperato stato del sensore {sensor_id} dalla cache: {self.temperature_cache[sensor_id]}", level="DEBUG")
-            return self.temperature_cache[sensor_id]
+        cached_state = self.temperature_cache.get(sensor_id)
+        if cached_state is not None:
+            self.log(f"Recuperato stato del sensore {sensor_id} dalla cache: {cached_state}", level="DEBUG")
+            return cached_state
 
         state = self.get_state(sensor_id)
+        if state in ["unknown", "unavailable", "null", None]:
+            # Non mettere in cache stati non validi: la prossima lettura interroga di nuovo il sensore
+            self.temperature_cache.invalidate(sensor_id)
+            self.log(f"Stato del sensore {sensor_id} non disponibile: {state}", level="DEBUG")
+            return "unknown"
+
         try:
-            validated_state = float(state) if state not in ["unknown", "unavailable", "null", None] else "unknown"
-            self.temperature_cache[sensor_id] = validated_state
+            validated_state = float(state)
+            self.temperature_cache.set(sensor_id, validated_state)
             self.log(f"Stato del sensore {sensor_id} convalidato: {validated_state}", level="DEBUG")
             return validated_state
         except (ValueError, TypeError):
+            self.temperature_cache.invalidate(sensor_id)
             self.log(f"Stato del sensore {sensor_id} non valido: {state}. Impostato a 'unknown'.", level="WARNING")
             return "unknown"
 
     def update_climate_sensor(self, entity, attribute, old, new, kwargs):
-        """Aggiorna il sensore climate quando cambia lo stato del sensore della temperatura"""
-        name = kwargs['name']
-        climate_sensor_id = kwargs['climate_sensor_id']
+        """
+        Aggiorna tutti i sensori climate collegati alla sorgente quando cambia la temperatura.
+        Il valore viene validato una sola volta e scritto su tutte le destinazioni.
+        """
+        targets = self.source_targets.get(entity)
+        if not targets:
+            return
 
         try:
             new_state = float(new)
-            self.temperature_cache[entity] = new_state  # Aggiorna la cache
-            self.log(f"Aggiornamento sensore {climate_sensor_id}: nuovo stato {new_state}°C", level="DEBUG")
+            self.temperature_cache.set(entity, new_state)  # Aggiorna la cache
+            self.log(f"Aggiornamento {len(targets)} sensori da {entity}: nuovo stato {new_state}°C", level="DEBUG")
         except (ValueError, TypeError):
             self.log(f"Nuovo stato non valido per {entity}: {new}. Impostato a 'unknown'.", level="WARNING")
             new_state = "unknown"
-            if entity in self.temperature_cache:
-                del self.temperature_cache[entity]  # Rimuovi dalla cache se lo stato non è valido
+            self.temperature_cache.invalidate(entity)  # Rimuovi dalla cache se lo stato non è valido
 
-        self.create_sensor(climate_sensor_id, name, new_state)
+        for climate_sensor_id in list(targets):
+            entry = self.climate_sensors_created.get(climate_sensor_id)
+            if entry:
+                self.create_sensor(climate_sensor_id, entry['name'], new_state)
 
     def create_sensor(self, object_id: str, name: str, state):
         """Crea o aggiorna un sensore di temperatura"""
@@ -0,0 +1,107 @@
+"""
+Generation Dry-Run Module for AppDaemon
+Dry-run dei generatori fuori da AppDaemon (es. in CI): diff dei file generati, exit code 1 se ci sono modifiche
+
+Uso:
+    python generation_dry_run.py [--apps apps.yaml] [--config-path DIR] [--generator NOME ...]
+
+Richiede il pacchetto appdaemon installato (import dei moduli dei generatori) e PyYAML,
+ma nessuna istanza di AppDaemon o Home Assistant in esecuzione.
+"""
+
+import argparse
+import copy
+import os
+import sys
+
+import yaml
+
+# Generatori supportati: {nome dell'app in apps.yaml: (modulo, classe)}
+GENERATORS = {
+    "light_presence_entity_generator": ("light_presence_entity_generator", "LightPresenceEntityGenerator"),
+    "light_template_generator": ("light_template_generator", "LightTemplateGenerator"),
+}
+
+
+class ConsoleLog:
+    """Sostituisce hass.log: scrive su stdout (diff e riepiloghi) o stderr (avvisi ed errori)"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def __call__(self, message, level="INFO"):
+        if level == "DEBUG" and not self.verbose:
+            return
+        stream = sys.stderr if level in ("WARNING", "ERROR") else sys.stdout
+        print(f"{level}: {message}", file=stream)
+
+
+def load_generator(app_name, apps, config_path=None, log=None):
+    """
+    Crea il generatore senza AppDaemon: solo args, nome e log, che bastano al dry-run.
+
+    Returns:
+        tuple: (generatore, lista delle configurazioni sorgente)
+    """
+    module_name, class_name = GENERATORS[app_name]
+    module = __import__(module_name)
+    generator_class = getattr(module, class_name)
+
+    args = copy.deepcopy(apps.get(app_name) or {})
+    args["dry_run"] = True
+    if config_path:
+        args["config_path"] = config_path
+
+    # Stesse chiavi lette dal generatore in AppDaemon (source_app, source_key)
+    source_args = apps.get(args.get("source_app")) or {}
+    configs = source_args.get(args.get("source_key")) or []
+
+    generator = generator_class.__new__(generator_class)
+    generator.args = args
+    generator.name = app_name
+    generator.log = log or ConsoleLog()
+    return generator, configs
+
+
+def run(apps, names=None, config_path=None, log=None):
+    """
+    Esegue il dry-run dei generatori indicati.
+
+    Returns:
+        int: 0 se i file generati sono allineati, 1 se ci sono modifiche, 2 in caso di errore
+    """
+    log = log or ConsoleLog()
+    status = 0
+    for app_name in names or [name for name in GENERATORS if name in apps]:
+        generator, configs = load_generator(app_name, apps, config_path, log)
+        if not configs:
+            # Come in AppDaemon: una lista vuota svuoterebbe le sezioni, il dry-run non la usa
+            log(f"❌ {app_name}: nessuna configurazione in '{generator.args.get('source_key')}' "
+                f"di {generator.args.get('source_app')}", "ERROR")
+            status = 2
+            continue
+
+        results = generator.generate_files(configs) or []
+        if any(result["diff"] for result in results):
+            status = max(status, 1)
+    return status
+
+
+def main(argv=None):
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Dry-run dei generatori YAML di AppDaemon")
+    parser.add_argument("--apps", default=os.path.join(here, "apps.yaml"), help="File apps.yaml da cui leggere gli args")
+    parser.add_argument("--config-path", help="Sostituisce config_path dei generatori (cartella dei file generati)")
+    parser.add_argument("--generator", action="append", choices=sorted(GENERATORS), help="Generatore da eseguire (ripetibile)")
+    parser.add_argument("--verbose", action="store_true", help="Mostra anche i log DEBUG")
+    options = parser.parse_args(argv)
+
+    sys.path.insert(0, here)
+    with open(options.apps, "r", encoding="utf-8") as apps_file:
+        apps = yaml.safe_load(apps_file) or {}
+
+    return run(apps, options.generator, options.config_path, ConsoleLog(options.verbose))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
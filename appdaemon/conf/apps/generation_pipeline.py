@@ -0,0 +1,271 @@
+"""
+Generation Pipeline Module for AppDaemon
+Pipeline condivisa dei generatori: una sola scrittura per file, file indipendenti in parallelo
+"""
+
+import difflib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from yaml_file_updater import YamlFileUpdater
+
+
+class SectionEdit:
+    """
+    Modifica calcolata da un generatore per la propria sezione in un file.
+
+    Attributi:
+        start, end: Offset in byte [start, end) sostituiti da text
+        text: Nuovo contenuto del tratto (sezione, oppure l'intero file se replaces_file)
+        section_text: Solo la sezione generata (usata se un altro contributo riscrive il file)
+        replaces_file: True se il file è vuoto e text contiene anche la struttura base
+        added, removed, changed: Conteggi delle entità modificate
+        after_write: Funzione opzionale chiamata con l'updater dopo la scrittura
+    """
+
+    def __init__(self, start, end, text, section_text=None, replaces_file=False,
+                 added=0, removed=0, changed=0, after_write=None):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.section_text = text if section_text is None else section_text
+        self.replaces_file = replaces_file
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.after_write = after_write
+
+
+class SectionContribution:
+    """
+    Contributo di un generatore alla pipeline: una sezione in un file di destinazione.
+
+    Attributi:
+        path: File di destinazione
+        name: Nome del contributo per i log (es. "light_template_generator:input_boolean")
+        compute: Funzione che riceve lo YamlFileUpdater aperto e restituisce SectionEdit o None
+    """
+
+    def __init__(self, path, name, compute):
+        self.path = path
+        self.name = name
+        self.compute = compute
+
+
+class GenerationPipeline:
+    """
+    Pipeline di generazione condivisa tra i generatori di AppDaemon.
+
+    Questa classe raccoglie i contributi di tutti i generatori e:
+    - Li raggruppa per file di destinazione
+    - Calcola tutte le sezioni di un file sulla stessa lettura, sotto un unico lock
+    - Scrive ogni file una sola volta, con un'unica sostituzione multi-sezione atomica
+    - Elabora in parallelo i file indipendenti con un pool di thread
+    - Registra i tempi di calcolo e scrittura di ogni file
+    - In modalità dry-run calcola contenuto e diff unificato di ogni file senza toccare il disco
+
+    I generatori elencati in pipeline_members vengono attesi: la pipeline parte quando
+    tutti hanno inviato i propri contributi, oppure con flush() allo scadere del timeout.
+    """
+
+    _instances = {}
+    _instances_guard = threading.Lock()
+
+    def __init__(self, max_workers=4):
+        """
+        Inizializza la pipeline.
+
+        Args:
+            max_workers: Numero massimo di file elaborati in parallelo
+        """
+        self.max_workers = max(1, int(max_workers))
+        self.expected = set()
+        self.pending = {}  # {contributore: [SectionContribution]}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, name="default", max_workers=4):
+        """Restituisce l'istanza condivisa della pipeline con il nome indicato"""
+        with cls._instances_guard:
+            if name not in cls._instances:
+                cls._instances[name] = cls(max_workers)
+            return cls._instances[name]
+
+    def submit(self, contributor, contributions, expected=None, hass_instance=None):
+        """
+        Registra i contributi di un generatore ed esegue la pipeline se non manca nessuno.
+
+        Args:
+            contributor: Nome del generatore
+            contributions: Lista di SectionContribution
+            expected: Nomi dei generatori da attendere (opzionale)
+            hass_instance: App usata per il logging
+
+        Returns:
+            list: Risultati per file se la pipeline è stata eseguita, None se in attesa
+        """
+        with self.lock:
+            if expected:
+                self.expected.update(expected)
+            self.pending[contributor] = list(contributions)
+            ready = self.expected.issubset(self.pending)
+
+        if ready:
+            return self.flush(hass_instance)
+        return None
+
+    def flush(self, hass_instance=None):
+        """
+        Esegue la pipeline con i contributi in attesa (nessuna operazione se non ce ne sono).
+        Chiude il lotto: i membri attesi vengono azzerati, un submit successivo (es. rigenerazione
+        dopo una modifica della configurazione) non attende più i generatori del lotto precedente.
+        """
+        with self.lock:
+            contributions = [c for items in self.pending.values() for c in items]
+            self.pending = {}
+            self.expected = set()
+
+        if not contributions:
+            return None
+        return self.run(contributions, hass_instance)
+
+    def run(self, contributions, hass_instance=None, dry_run=False):
+        """
+        Elabora i contributi raggruppati per file, in parallelo tra file diversi.
+
+        Args:
+            contributions: Lista di SectionContribution
+            hass_instance: App usata per il logging
+            dry_run: Se True calcola solo contenuto e diff, senza scrivere
+
+        Returns:
+            list: Un dizionario di risultato per file
+        """
+        groups = {}
+        for contribution in contributions:
+            groups.setdefault(contribution.path, []).append(contribution)
+
+        started = time.monotonic()
+        workers = min(self.max_workers, len(groups))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="generation") as executor:
+            results = list(executor.map(
+                lambda item: self._process_file(item[0], item[1], hass_instance, dry_run), groups.items()
+            ))
+
+        elapsed = time.monotonic() - started
+        if dry_run:
+            changed_files = [result for result in results if result["diff"]]
+            self._log(
+                hass_instance,
+                f"🧪 Dry-run: {len(changed_files)}/{len(groups)} file da modificare "
+                f"(+{sum(r['added'] for r in results)} -{sum(r['removed'] for r in results)} "
+                f"~{sum(r['changed'] for r in results)} entità) in {elapsed:.3f}s",
+                "INFO"
+            )
+            if not changed_files:
+                self._log(hass_instance, "✅ Dry-run: generazione già allineata, nessuna modifica", "INFO")
+        else:
+            written = sum(1 for result in results if result["written"])
+            self._log(
+                hass_instance,
+                f"⏱️ Pipeline: {len(groups)} file, {len(contributions)} sezioni, {written} scritti in {elapsed:.3f}s",
+                "INFO"
+            )
+        return results
+
+    def _process_file(self, path, contributions, hass_instance, dry_run=False):
+        """Calcola tutte le sezioni di un file e lo scrive una sola volta (o ne produce il diff)"""
+        result = {
+            "path": path, "sections": len(contributions), "written": False, "dry_run": dry_run,
+            "added": 0, "removed": 0, "changed": 0, "diff": "",
+            "compute_ms": 0.0, "render_ms": 0.0, "diff_ms": 0.0, "write_ms": 0.0
+        }
+        started = time.monotonic()
+
+        try:
+            with YamlFileUpdater(path, hass_instance, read_only=dry_run) as updater:
+                edits = []
+                for contribution in contributions:
+                    edit = contribution.compute(updater)
+                    if edit is not None:
+                        edits.append(edit)
+                        result["added"] += edit.added
+                        result["removed"] += edit.removed
+                        result["changed"] += edit.changed
+
+                computed = time.monotonic()
+                result["compute_ms"] = (computed - started) * 1000
+
+                if dry_run:
+                    self._dry_run_file(updater, edits, result)
+                elif edits:
+                    result["written"] = updater.splice(self.merge_edits(edits, updater.size))
+                    if result["written"]:
+                        for edit in edits:
+                            if edit.after_write is not None:
+                                edit.after_write(updater)
+
+                if not dry_run:
+                    result["write_ms"] = (time.monotonic() - computed) * 1000
+
+        except Exception as e:
+            self._log(hass_instance, f"❌ Errore durante l'elaborazione di {path}: {str(e)}", "ERROR")
+            return result
+
+        if dry_run:
+            if result["diff"]:
+                self._log(hass_instance, f"🧪 Diff {path}:\n{result['diff']}", "INFO")
+            self._log(
+                hass_instance,
+                f"⏱️ {path} (dry-run): +{result['added']} -{result['removed']} ~{result['changed']}, "
+                f"calcolo {result['compute_ms']:.1f}ms, rendering {result['render_ms']:.1f}ms, diff {result['diff_ms']:.1f}ms",
+                "INFO"
+            )
+            return result
+
+        if result["written"]:
+            self._log(hass_instance, f"📄 File {path} aggiornato correttamente", "INFO")
+        self._log(
+            hass_instance,
+            f"⏱️ {path}: {result['sections']} sezioni, calcolo {result['compute_ms']:.1f}ms, "
+            f"scrittura {result['write_ms']:.1f}ms",
+            "INFO"
+        )
+        return result
+
+    def _dry_run_file(self, updater, edits, result):
+        """Calcola in memoria il contenuto risultante e il diff unificato rispetto al file attuale"""
+        started = time.monotonic()
+        current = updater.read_bytes()
+        proposed = updater.render(self.merge_edits(edits, updater.size)) if edits else current
+        rendered = time.monotonic()
+        result["render_ms"] = (rendered - started) * 1000
+
+        if proposed != current:
+            result["diff"] = "".join(difflib.unified_diff(
+                current.decode(updater.encoding).splitlines(True),
+                proposed.decode(updater.encoding).splitlines(True),
+                fromfile=updater.path,
+                tofile=f"{updater.path} (dry-run)"
+            ))
+        result["diff_ms"] = (time.monotonic() - rendered) * 1000
+
+    def merge_edits(self, edits, size):
+        """
+        Converte le modifiche in sostituzioni per YamlFileUpdater.splice.
+
+        Se un contributo riscrive l'intero file (file vuoto), gli altri vi accodano la propria sezione.
+        """
+        replacing = next((edit for edit in edits if edit.replaces_file), None)
+        if replacing is None:
+            return [(edit.start, edit.end, edit.text) for edit in edits]
+
+        merged = [(0, size, replacing.text)]
+        for edit in edits:
+            if edit is not replacing and edit.section_text:
+                merged.append((size, size, edit.section_text))
+        return merged
+
+    def _log(self, hass_instance, message, level):
+        if hass_instance is not None:
+            hass_instance.log(message, level=level)
@@ -0,0 +1,93 @@
+"""
+Gesture Detector Module for AppDaemon
+Riconoscimento dei gesti manuali (doppio/triplo toggle) su un buffer circolare di transizioni, senza timer
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class GestureDetector:
+    """
+    Riconosce i gesti manuali sugli interruttori delle luci.
+
+    Questa classe mantiene per ogni luce un buffer circolare delle ultime transizioni e:
+    - Registra ogni fronte con timestamp monotonic (precisione ben sotto i 100 ms)
+    - Confronta la coda del buffer con i gesti configurati al momento della transizione,
+      senza timer né round-trip dello scheduler: una transizione isolata costa un append
+      e pochi confronti
+    - Verifica per ogni gesto la sequenza degli stati, lo stato di enable_sensor
+      e la finestra massima tra il primo e l'ultimo fronte
+    - Svuota il buffer della luce dopo un gesto riconosciuto (nessuna doppia attivazione)
+
+    Configurazione (argomento manual_gestures, default equivalente ai gesti a due fronti):
+        manual_gestures:
+          activate:
+            sequence: [on, off]     # stati dopo ogni fronte (triplo toggle: [on, off, on])
+            enable_sensor: "off"    # stato richiesto di enable_sensor
+            window: 1.0             # secondi massimi tra primo e ultimo fronte
+          deactivate:
+            sequence: [off, on]
+            enable_sensor: "on"
+            window: 1.0
+    """
+
+    DEFAULT_GESTURES = {
+        "activate": {"sequence": ["on", "off"], "enable_sensor": "off", "window": 1.0},
+        "deactivate": {"sequence": ["off", "on"], "enable_sensor": "on", "window": 1.0},
+    }
+
+    def __init__(self, gestures=None, buffer_size=8):
+        """
+        Inizializza il riconoscitore.
+
+        Args:
+            gestures: Dizionario {nome: {sequence, enable_sensor, window}} (None = default)
+            buffer_size: Transizioni conservate per luce
+        """
+        self.gestures = []
+        for name, gesture in (gestures or self.DEFAULT_GESTURES).items():
+            sequence = tuple(str(state) for state in gesture["sequence"])
+            self.gestures.append((name, sequence, str(gesture.get("enable_sensor", "off")),
+                                  float(gesture.get("window", 1.0))))
+        # Gesti più lunghi per primi: a parità di coda vince il gesto più specifico
+        self.gestures.sort(key=lambda gesture: -len(gesture[1]))
+        self.buffer_size = max(int(buffer_size), max((len(g[1]) for g in self.gestures), default=1))
+        self.buffers = {}  # {luce: deque di (timestamp, stato, enable_sensor)}
+        self._lock = threading.Lock()
+
+    def record(self, light_entity, new_state, enable_sensor, now=None):
+        """
+        Registra una transizione manuale e restituisce il gesto completato.
+
+        Args:
+            light_entity: Luce
+            new_state: Stato della luce dopo la transizione
+            enable_sensor: Stato di enable_sensor al momento della transizione
+            now: Timestamp monotonic (default: time.monotonic())
+
+        Returns:
+            tuple: (nome del gesto, durata in secondi) oppure None
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            buffer = self.buffers.get(light_entity)
+            if buffer is None:
+                buffer = self.buffers[light_entity] = deque(maxlen=self.buffer_size)
+            buffer.append((now, new_state, enable_sensor))
+
+            for name, sequence, armed, window in self.gestures:
+                length = len(sequence)
+                if len(buffer) < length:
+                    continue
+                tail = list(buffer)[-length:]
+                if (all(entry[1] == state and entry[2] == armed for entry, state in zip(tail, sequence))
+                        and now - tail[0][0] <= window):
+                    buffer.clear()
+                    return name, now - tail[0][0]
+        return None
+
+    def clear(self, light_entity):
+        with self._lock:
+            self.buffers.pop(light_entity, None)
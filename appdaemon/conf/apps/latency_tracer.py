@@ -0,0 +1,298 @@
+"""
+Latency Tracer Module for AppDaemon
+Traccia la latenza presenza -> accensione luce, suddivisa in span, con percentili per luce
+"""
+
+import functools
+import math
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+
+class LatencyTracer:
+    """
+    Tracciamento end-to-end delle attivazioni presenza -> luce.
+
+    Ogni attivazione (sensore di presenza che passa a "on") apre una traccia per la luce,
+    chiusa quando il turn_on viene davvero inviato (anche se passa dal batch o dalla coda
+    dei comandi). La traccia è suddivisa in span:
+    - receipt: dal last_changed del sensore in HA alla ricezione del callback
+    - gates: controlli di abilitazione (enable_sensor, enable_automation, light_sensor_config, timer)
+    - timer_wait: attesa del turn_on_light_offset (solo accensione ritardata)
+    - illuminance_filter: lettura e confronto dell'illuminanza
+    - service_call: dal turn_on all'invio effettivo (attesa nel batch/coda e chiamata di servizio)
+
+    Le tracce completate finiscono in un buffer circolare per luce; i percentili
+    vengono pubblicati come sensori insieme alle violazioni dello SLO, valutato sul tempo
+    di elaborazione (totale escluso timer_wait, che dipende dall'offset configurato).
+    """
+
+    SPANS = ("receipt", "gates", "timer_wait", "illuminance_filter", "service_call")
+
+    def __init__(self, hass_instance, enabled=False, buffer_size=200, slo_ms=300,
+                 sensor_prefix="sensor.light_presence_latency"):
+        """
+        Inizializza il tracer.
+
+        Args:
+            hass_instance: Istanza dell'app AppDaemon (log, get_state, set_state)
+            enabled: Stato iniziale del tracciamento
+            buffer_size: Numero di tracce conservate per luce
+            slo_ms: Obiettivo di latenza presenza -> accensione
+            sensor_prefix: Prefisso dei sensori pubblicati
+        """
+        self.hass = hass_instance
+        self.enabled = enabled
+        self.buffer_size = max(1, int(buffer_size))
+        self.slo_ms = float(slo_ms)
+        self.sensor_prefix = sensor_prefix
+        self.active = {}   # {luce: traccia in corso}
+        self.traces = {}   # {luce: deque di tracce completate}
+        self.outcomes = {}  # {luce: {esito: conteggio}}
+        self._lock = threading.Lock()
+
+    def wrap(self, callback):
+        """
+        Avvolge il callback di attivazione: apre la traccia all'ingresso e la scarta all'uscita
+        se l'attivazione è stata bloccata dai controlli (né accesa né in attesa del timer).
+        """
+        @functools.wraps(callback)
+        def traced(entity, attribute, old, new, kwargs):
+            if not self.enabled:
+                return callback(entity, attribute, old, new, kwargs)
+
+            light_entity = kwargs["config"]["light_entity"]
+            self.begin(light_entity, entity)
+            try:
+                return callback(entity, attribute, old, new, kwargs)
+            finally:
+                self.discard(light_entity, "gated")
+
+        return traced
+
+    def begin(self, light_entity, sensor_entity, receipt=None, mode="sync"):
+        """
+        Apre una traccia per la luce, misurando il ritardo di ricezione dell'evento.
+
+        Args:
+            receipt: Ritardo di ricezione già calcolato (percorso asyncio), altrimenti letto qui
+            mode: Modalità di esecuzione del callback ("sync" o "async"), per il confronto
+        """
+        now = time.monotonic()
+        trace = {"sensor": sensor_entity, "started": now, "last": now, "parked": False,
+                 "spans": dict.fromkeys(self.SPANS, 0.0)}
+        trace["spans"]["receipt"] = self._receipt_delay(sensor_entity) if receipt is None else receipt
+        trace["spans"]["mode"] = mode
+
+        with self._lock:
+            if light_entity in self.active:
+                self._count(light_entity, "superseded")
+            self.active[light_entity] = trace
+
+    def mark(self, light_entity, span):
+        """Chiude lo span indicato con il tempo trascorso dall'ultimo punto di misura"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            trace = self.active.get(light_entity)
+            if trace is not None:
+                trace["spans"][span] += (now - trace["last"]) * 1000
+                trace["last"] = now
+
+    def park(self, light_entity):
+        """Segnala che la traccia prosegue in un timer (accensione ritardata)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            trace = self.active.get(light_entity)
+            if trace is not None:
+                trace["parked"] = True
+
+    def await_dispatch(self, light_entity, outcome="on"):
+        """
+        Segnala che il turn_on sta per essere emesso: la traccia resta aperta finché
+        dispatched non ne riceve l'esito (batch o coda dei comandi possono rinviarlo).
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            trace = self.active.get(light_entity)
+            if trace is not None:
+                trace["parked"] = True
+                trace["dispatch"] = outcome
+
+    def dispatched(self, light_entity, when, result="sent"):
+        """
+        Chiude la traccia in attesa di invio: con result "sent" lo span service_call arriva
+        fino a when (time.monotonic()), altrimenti la traccia viene scartata con quell'esito.
+        """
+        if not self.active:
+            return
+        with self._lock:
+            trace = self.active.get(light_entity)
+            if trace is None or "dispatch" not in trace:
+                return
+            if result != "sent":
+                del self.active[light_entity]
+                self._count(light_entity, result)
+                return
+            trace["spans"]["service_call"] += max(0.0, when - trace["last"]) * 1000
+            del self.active[light_entity]
+            self._store(light_entity, trace, trace["dispatch"])
+
+    def finish(self, light_entity, outcome="on"):
+        """Completa la traccia e la salva nel buffer circolare della luce"""
+        if not self.enabled:
+            return
+        with self._lock:
+            trace = self.active.pop(light_entity, None)
+            if trace is not None:
+                self._store(light_entity, trace, outcome)
+
+    def discard(self, light_entity, outcome, force=False):
+        """
+        Scarta la traccia in corso se non è stata completata né affidata a un timer (o se force).
+        Una traccia in attesa di invio viene chiusa solo da dispatched.
+        """
+        if not self.active:
+            return
+        with self._lock:
+            trace = self.active.get(light_entity)
+            if trace is not None and "dispatch" not in trace and (force or not trace["parked"]):
+                del self.active[light_entity]
+                self._count(light_entity, outcome)
+
+    def _store(self, light_entity, trace, outcome):
+        """Salva (con il lock) gli span della traccia completata nel buffer della luce"""
+        spans = trace["spans"]
+        spans["total"] = sum(spans[name] for name in self.SPANS)
+        spans["processing"] = spans["total"] - spans["timer_wait"]
+        self.traces.setdefault(light_entity, deque(maxlen=self.buffer_size)).append(spans)
+        self._count(light_entity, outcome)
+
+    def _count(self, light_entity, outcome):
+        outcomes = self.outcomes.setdefault(light_entity, {})
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    def _receipt_delay(self, sensor_entity):
+        """Ritardo tra il last_changed in HA e la ricezione (0 se non disponibile)"""
+        return self.receipt_delay(self.hass.get_state(sensor_entity, attribute="last_changed"))
+
+    def receipt_delay(self, last_changed):
+        """Ritardo in ms da un valore last_changed (0 se non interpretabile)"""
+        try:
+            changed = datetime.fromisoformat(str(last_changed).replace("Z", "+00:00"))
+            if changed.tzinfo is None:
+                changed = changed.replace(tzinfo=timezone.utc)
+            return max(0.0, (datetime.now(timezone.utc) - changed).total_seconds() * 1000)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+        if not self.enabled:
+            with self._lock:
+                self.active.clear()
+        self.hass.log(f"⏱️ Tracciamento latenza {'attivato' if self.enabled else 'disattivato'}", level="INFO")
+
+    def reset(self):
+        with self._lock:
+            self.active.clear()
+            self.traces.clear()
+            self.outcomes.clear()
+
+    def percentile(self, values, q):
+        """Percentile nearest-rank su valori ordinati"""
+        if not values:
+            return 0.0
+        index = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+        return values[index]
+
+    def mode_stats(self, traces):
+        """Tempo di elaborazione (ms) per modalità di esecuzione, per confrontare sync e async"""
+        modes = {}
+        for trace in traces:
+            modes.setdefault(trace.get("mode", "sync"), []).append(trace["processing"])
+        return {
+            mode: {
+                "samples": len(values),
+                "p50": round(self.percentile(sorted(values), 50), 1),
+                "p95": round(self.percentile(sorted(values), 95), 1)
+            }
+            for mode, values in modes.items()
+        }
+
+    def format_modes(self, modes):
+        return ", ".join(
+            f"{mode} p50 {values['p50']}ms / p95 {values['p95']}ms ({values['samples']})"
+            for mode, values in sorted(modes.items())
+        )
+
+    def light_stats(self, traces):
+        """Percentili (ms) per span e totale di un insieme di tracce"""
+        stats = {}
+        for span in self.SPANS + ("processing", "total"):
+            values = sorted(trace[span] for trace in traces)
+            stats[span] = {
+                "p50": round(self.percentile(values, 50), 1),
+                "p95": round(self.percentile(values, 95), 1),
+                "p99": round(self.percentile(values, 99), 1),
+                "max": round(values[-1], 1) if values else 0.0
+            }
+        return stats
+
+    def publish(self):
+        """Pubblica un sensore per luce con i percentili e lo stato dello SLO"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            snapshot = {light: list(traces) for light, traces in self.traces.items()}
+            outcomes = {light: dict(counts) for light, counts in self.outcomes.items()}
+
+        for light_entity, traces in snapshot.items():
+            stats = self.light_stats(traces)
+            violations = sum(1 for trace in traces if trace["processing"] > self.slo_ms)
+            object_id = light_entity.split(".")[-1]
+            self.hass.set_state(
+                f"{self.sensor_prefix}_{object_id}",
+                state=stats["processing"]["p95"],
+                attributes={
+                    "light_entity": light_entity,
+                    "samples": len(traces),
+                    "slo_ms": self.slo_ms,
+                    "slo_violations": violations,
+                    "slo_ok": violations == 0,
+                    "spans": stats,
+                    "modes": self.mode_stats(traces),
+                    "outcomes": outcomes.get(light_entity, {}),
+                    "unit_of_measurement": "ms",
+                    "friendly_name": f"Latenza presenza {object_id} (p95)"
+                }
+            )
+
+    def dump(self):
+        """Scrive nel log i percentili per luce"""
+        with self._lock:
+            snapshot = {light: list(traces) for light, traces in self.traces.items()}
+
+        self.hass.log(f"⏱️ LATENZA PRESENZA -> LUCE (SLO {self.slo_ms:.0f}ms)", level="INFO")
+
+        # Confronto sync/async su tutte le luci (tempo di elaborazione per modalità)
+        modes = self.mode_stats([trace for traces in snapshot.values() for trace in traces])
+        if modes:
+            self.hass.log(f"  confronto modalità (tutte le luci): {self.format_modes(modes)}", level="INFO")
+        for light_entity, traces in sorted(snapshot.items()):
+            stats = self.light_stats(traces)
+            spans = ", ".join(f"{span} {stats[span]['p95']}" for span in self.SPANS)
+            self.hass.log(
+                f"  - {light_entity}: {len(traces)} tracce, elaborazione p50 {stats['processing']['p50']}ms, "
+                f"p95 {stats['processing']['p95']}ms, p99 {stats['processing']['p99']}ms (p95 span: {spans})",
+                level="INFO"
+            )
+            modes = self.mode_stats(traces)
+            if len(modes) > 1:
+                self.hass.log(f"    confronto modalità: {self.format_modes(modes)}", level="INFO")
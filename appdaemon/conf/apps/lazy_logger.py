@@ -0,0 +1,190 @@
+"""
+Lazy Logger Module for AppDaemon
+Facciata di logging per le app: formattazione differita, campionamento, limiti per luce e thread di scrittura
+"""
+
+import queue
+import threading
+import time
+
+
+class LazyLogger:
+    """
+    Facciata di logging per i callback ad alta frequenza delle app AppDaemon.
+
+    Questa classe fornisce un logging che:
+    - Scarta i messaggi sotto il livello dell'app prima di formattarli
+      (argomenti in stile logging: log.info("Luce %s accesa", light_entity))
+    - Accetta anche un callable come messaggio, valutato solo se il record viene scritto
+    - Supporta il campionamento (sample=N: un messaggio ogni N)
+    - Limita i messaggi per luce (rate per finestra di per secondi) segnalando i soppressi
+    - Consegna i record a un thread di scrittura in background, così l'I/O del log
+      non occupa i thread dei callback di AppDaemon
+
+    WARNING ed ERROR non vengono mai campionati né limitati.
+
+    Uso:
+        self.lazylog = LazyLogger(self, level=self.args.get("log_level", "INFO"))
+        self.lazylog.info("💡 Luce %s accesa per presenza rilevata", light_entity, light=light_entity)
+    """
+
+    LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+    def __init__(self, hass_instance, level="INFO", background=True, rate=0, per=60, queue_size=10000):
+        """
+        Inizializza la facciata di logging.
+
+        Args:
+            hass_instance: Istanza dell'app AppDaemon che scrive i log
+            level: Livello minimo (come log_level dell'app)
+            background: Se True i record vengono scritti da un thread dedicato
+            rate: Messaggi massimi per luce nella finestra (0 = nessun limite)
+            per: Durata della finestra in secondi
+            queue_size: Record massimi in attesa (oltre vengono scartati e contati)
+        """
+        self.hass = hass_instance
+        self.threshold = self.LEVELS.get(str(level).upper(), 20)
+        self.rate = int(rate)
+        self.per = float(per)
+        self.windows = {}   # {luce: [inizio finestra, messaggi, soppressi]}
+        self.samples = {}   # {chiave: contatore}
+        self.counters = {"written": 0, "gated": 0, "sampled_out": 0, "rate_limited": 0, "dropped": 0}
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+
+        if background:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._sink, name="lazy-logger", daemon=True)
+            self._thread.start()
+
+    def enabled_for(self, level):
+        return self.LEVELS.get(level, 20) >= self.threshold
+
+    def debug(self, message, *args, **kwargs):
+        self.log("DEBUG", message, *args, **kwargs)
+
+    def info(self, message, *args, **kwargs):
+        self.log("INFO", message, *args, **kwargs)
+
+    def warning(self, message, *args, **kwargs):
+        self.log("WARNING", message, *args, **kwargs)
+
+    def error(self, message, *args, **kwargs):
+        self.log("ERROR", message, *args, **kwargs)
+
+    def log(self, level, message, *args, light=None, sample=1):
+        """
+        Accoda un record; la formattazione avviene solo se il record supera tutti i filtri.
+
+        Args:
+            level: Livello del record
+            message: Stringa con segnaposto %s oppure callable senza argomenti
+            *args: Argomenti del messaggio
+            light: Luce a cui applicare il limite per luce (opzionale)
+            sample: Scrive un messaggio ogni sample (solo sotto WARNING)
+        """
+        severity = self.LEVELS.get(level, 20)
+        if severity < self.threshold:
+            self.counters["gated"] += 1
+            return
+
+        suppressed = 0
+        if severity < 30:
+            if sample > 1 and not self._sampled(message, sample):
+                return
+            if light is not None and self.rate > 0:
+                suppressed = self._admit(light)
+                if suppressed is None:
+                    return
+
+        record = (level, message, args, suppressed)
+        if self._queue is None:
+            self._write(record)
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.counters["dropped"] += 1
+
+    def _sampled(self, message, sample):
+        key = message if isinstance(message, str) else id(message)
+        with self._lock:
+            count = self.samples.get(key, 0)
+            self.samples[key] = count + 1
+        if count % sample:
+            self.counters["sampled_out"] += 1
+            return False
+        return True
+
+    def _admit(self, light):
+        """Limite per luce: None se il record va soppresso, altrimenti i soppressi da segnalare"""
+        now = time.monotonic()
+        with self._lock:
+            window = self.windows.get(light)
+            if window is None or now - window[0] >= self.per:
+                suppressed = window[2] if window is not None else 0
+                self.windows[light] = [now, 1, 0]
+                return suppressed
+            if window[1] >= self.rate:
+                window[2] += 1
+                self.counters["rate_limited"] += 1
+                return None
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+            return suppressed
+
+    def _format(self, message, args, suppressed):
+        text = message() if callable(message) else (message % args if args else message)
+        if suppressed:
+            text += f" (+{suppressed} messaggi soppressi)"
+        return text
+
+    def _write(self, record):
+        level, message, args, suppressed = record
+        try:
+            text = self._format(message, args, suppressed)
+        except Exception as e:
+            text = f"⚠️ Messaggio di log non formattabile ({e}): {message!r} {args!r}"
+            level = "WARNING"
+        self.hass.log(text, level=level)
+        self.counters["written"] += 1
+
+    def _sink(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                self._queue.task_done()
+                return
+            try:
+                self._write(record)
+            except Exception:
+                pass
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout=2.0):
+        """Attende la scrittura dei record in coda (al massimo timeout secondi)"""
+        if self._queue is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self, timeout=2.0):
+        """Scrive i record in coda e ferma il thread di scrittura"""
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        self._queue = None
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["queued"] = self._queue.qsize() if self._queue is not None else 0
+        return stats
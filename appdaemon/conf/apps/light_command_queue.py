@@ -0,0 +1,267 @@
+"""
+Light Command Queue Module for AppDaemon
+Coda in uscita per entità: vince l'ultimo comando, scarto dei comandi inutili, throughput limitato con retry
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+class LightCommandQueue:
+    """
+    Coda dei comandi turn_on/turn_off verso Home Assistant con contropressione.
+
+    Questa classe invia i comandi da un thread dedicato e:
+    - Tiene al più un comando in attesa per entità: un comando più recente sostituisce
+      quello non ancora inviato (vince l'ultimo, nessun comando obsoleto dopo uno nuovo)
+    - Scarta un comando solo se l'ultimo comando per l'entità è partito da questa coda,
+      era la stessa azione e lo stato in cache di AppDaemon coincide ed è più recente
+      dell'invio (cioè riflette già quel comando)
+    - Raggruppa i comandi pronti con stesso dominio/azione/parametri in una chiamata
+    - Limita le chiamate al secondo e ritenta gli errori con backoff esponenziale e jitter,
+      abbandonando il retry se nel frattempo è arrivato un comando più recente
+    - Espone profondità della coda e contatori (sostituiti, scartati, retry, falliti)
+    - Notifica l'esito di ogni comando (inviato, scartato, fallito) al momento in cui
+      viene davvero eseguito, per chi misura la latenza fino all'invio
+    """
+
+    def __init__(self, hass_instance, enabled=True, rate=10, retries=3, backoff=0.5,
+                 sensor="sensor.light_presence_commands", on_dispatch=None):
+        """
+        Inizializza la coda e avvia il thread di invio.
+
+        Args:
+            hass_instance: Istanza dell'app AppDaemon (call_service, get_state, set_state, log)
+            enabled: Se False i comandi vengono inviati subito dal thread chiamante
+            rate: Chiamate di servizio massime al secondo (0 = nessun limite)
+            retries: Tentativi aggiuntivi dopo un errore
+            backoff: Ritardo base del retry in secondi (raddoppia a ogni tentativo, più jitter)
+            sensor: Sensore su cui pubblicare le metriche
+            on_dispatch: Callable(action, entities, when, result) chiamato dopo l'esito del comando,
+                         con when in time.monotonic() e result "sent", "dropped_same_state" o "failed"
+        """
+        self.hass = hass_instance
+        self.enabled = enabled
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.sensor = sensor
+        self.on_dispatch = on_dispatch
+        self.pending = OrderedDict()  # {entità: {"action", "params", "attempt", "ready_at"}}
+        self.last_sent = {}           # {entità: (ultima azione inviata, istante di invio)}
+        self.max_depth = 0
+        self.counters = {"submitted": 0, "sent": 0, "calls": 0, "superseded": 0,
+                         "dropped_same_state": 0, "retries": 0, "failed": 0}
+        self._cond = threading.Condition()
+        self._next_call = 0.0
+        self._running = False
+        self._thread = None
+
+        if enabled:
+            self._running = True
+            self._thread = threading.Thread(target=self._worker, name="light-command-queue", daemon=True)
+            self._thread.start()
+
+    def submit(self, entity_id, action, params=()):
+        """
+        Accoda il comando per l'entità sostituendo quello eventualmente in attesa.
+
+        Args:
+            entity_id: Entità destinataria
+            action: "turn_on" o "turn_off"
+            params: Parametri del servizio come tupla ordinata di coppie (chiave, valore)
+        """
+        if not self.enabled:
+            self.submit_group(entity_id.split(".", 1)[0], action, [entity_id], params)
+            return
+
+        with self._cond:
+            self.counters["submitted"] += 1
+            if self.pending.pop(entity_id, None) is not None:
+                self.counters["superseded"] += 1
+            self.pending[entity_id] = {"action": action, "params": tuple(params), "attempt": 0, "ready_at": 0.0}
+            self.max_depth = max(self.max_depth, len(self.pending))
+            self._cond.notify()
+
+    def submit_group(self, domain, action, entities, params=()):
+        """Accoda un gruppo (es. dal batch delle chiamate); da spenta lo invia in una sola chiamata"""
+        if not self.enabled:
+            # Invio diretto senza retry: l'errore è definitivo
+            if not self._send(domain, action, list(entities), params):
+                self._notify(action, entities, "failed")
+            return
+        for entity_id in entities:
+            self.submit(entity_id, action, params)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                ready = self._take_ready()
+                while self._running and not ready:
+                    self._cond.wait(self._next_wakeup())
+                    ready = self._take_ready()
+                if not self._running and not ready:
+                    return
+
+            groups = {}
+            for entity_id, command in ready.items():
+                if self._matches_state(entity_id, command):
+                    with self._cond:
+                        self.counters["dropped_same_state"] += 1
+                    self._notify(command["action"], [entity_id], "dropped_same_state")
+                    continue
+                domain = entity_id.split(".", 1)[0]
+                groups.setdefault((domain, command["action"], command["params"]), []).append(entity_id)
+
+            for (domain, action, params), entities in groups.items():
+                self._throttle()
+                if self._send(domain, action, entities, params):
+                    continue
+                for entity_id in entities:
+                    self._retry(entity_id, ready[entity_id])
+
+    def _take_ready(self):
+        """Estrae (con il lock) i comandi pronti, nell'ordine di arrivo"""
+        now = time.monotonic()
+        ready = OrderedDict()
+        for entity_id in list(self.pending):
+            if self.pending[entity_id]["ready_at"] <= now:
+                ready[entity_id] = self.pending.pop(entity_id)
+        return ready
+
+    def _next_wakeup(self):
+        """Secondi fino al prossimo retry in attesa (None se non ce ne sono)"""
+        if not self.pending:
+            return None
+        return max(0.0, min(c["ready_at"] for c in self.pending.values()) - time.monotonic())
+
+    def _matches_state(self, entity_id, command):
+        """
+        Il comando senza parametri ripete l'ultimo inviato da questa coda e lo stato in cache,
+        aggiornato dopo quell'invio, lo riflette già. Senza un invio precedente della coda
+        (o con uno stato in cache più vecchio) il comando viene sempre inviato.
+        """
+        if command["params"]:
+            return False
+        with self._cond:
+            last_action, sent_at = self.last_sent.get(entity_id, (None, None))
+        if last_action != command["action"]:
+            return False
+        target = "on" if command["action"] == "turn_on" else "off"
+        try:
+            cached = self.hass.get_state(entity_id, attribute="all") or {}
+            updated = datetime.fromisoformat(str(cached.get("last_updated")).replace("Z", "+00:00")).timestamp()
+        except Exception:
+            return False
+        return cached.get("state") == target and updated > sent_at
+
+    def _throttle(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self._next_call > now:
+            time.sleep(self._next_call - now)
+        self._next_call = max(now, self._next_call) + self.interval
+
+    def _send(self, domain, action, entities, params):
+        entity_id = entities[0] if len(entities) == 1 else entities
+        # Istante prima della chiamata: lo stato aggiornato dal comando risulta sempre più recente
+        sent_at = time.time()
+        try:
+            self.hass.call_service(f"{domain}/{action}", entity_id=entity_id, **dict(params))
+        except Exception as e:
+            self.hass.log(f"⚠️ Comando {domain}/{action} per {entity_id} non riuscito: {e}", level="WARNING")
+            return False
+        with self._cond:
+            self.counters["calls"] += 1
+            self.counters["sent"] += len(entities)
+            for entity in entities:
+                self.last_sent[entity] = (action, sent_at)
+        self._notify(action, entities, "sent")
+        return True
+
+    def _notify(self, action, entities, result):
+        """Comunica l'esito del comando a on_dispatch (gli errori del callback non fermano la coda)"""
+        if self.on_dispatch is None:
+            return
+        try:
+            self.on_dispatch(action, list(entities), time.monotonic(), result)
+        except Exception as e:
+            self.hass.log(f"⚠️ Errore nel callback di invio per {action}: {e}", level="WARNING")
+
+    def _retry(self, entity_id, command):
+        """Rimette in coda il comando fallito, salvo comandi più recenti o tentativi esauriti"""
+        with self._cond:
+            if entity_id in self.pending:
+                self.counters["superseded"] += 1
+                return
+            if command["attempt"] >= self.retries:
+                self.counters["failed"] += 1
+                self.hass.log(f"❌ Comando {command['action']} per {entity_id} abbandonato dopo {command['attempt'] + 1} tentativi", level="ERROR")
+            else:
+                delay = self.backoff * (2 ** command["attempt"])
+                command["attempt"] += 1
+                command["ready_at"] = time.monotonic() + delay + random.uniform(0, delay)
+                self.pending[entity_id] = command
+                self.counters["retries"] += 1
+                self._cond.notify()
+                return
+        self._notify(command["action"], [entity_id], "failed")
+
+    def close(self, timeout=2.0):
+        """Invia i comandi pronti e ferma il thread"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def set_enabled(self, enabled):
+        """Il thread resta attivo: da spento i nuovi comandi vengono inviati subito"""
+        self.enabled = bool(enabled) and self._thread is not None
+        self.hass.log(f"📤 Coda comandi luci {'attivata' if self.enabled else 'disattivata'}", level="INFO")
+
+    def reset(self):
+        with self._cond:
+            for key in self.counters:
+                self.counters[key] = 0
+            self.max_depth = len(self.pending)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats["depth"] = len(self.pending)
+            stats["max_depth"] = self.max_depth
+        return stats
+
+    def publish(self):
+        """Pubblica profondità della coda e contatori"""
+        if self._thread is None:
+            return
+        stats = self.stats()
+        self.hass.set_state(
+            self.sensor,
+            state=stats.pop("depth"),
+            attributes={
+                **stats,
+                "enabled": self.enabled,
+                "unit_of_measurement": "comandi",
+                "friendly_name": "Comandi luci in coda"
+            }
+        )
+
+    def dump(self):
+        """Scrive nel log profondità della coda e contatori"""
+        stats = self.stats()
+        self.hass.log(
+            f"📤 CODA COMANDI: {stats['depth']} in coda (max {stats['max_depth']}), {stats['sent']} inviati "
+            f"in {stats['calls']} chiamate, {stats['superseded']} sostituiti, "
+            f"{stats['dropped_same_state']} scartati (stato già corretto), {stats['retries']} retry, "
+            f"{stats['failed']} falliti",
+            level="INFO"
+        )
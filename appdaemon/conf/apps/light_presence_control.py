@@ -1,8 +1,40 @@
 import appdaemon.plugins.hass.hassapi as hass
-from datetime import datetime, timedelta
+import asyncio
+import copy
+import os
+import time
+import zlib
+import yaml
 from timer_manager import TimerManager
+from callback_profiler import CallbackProfiler
+from latency_tracer import LatencyTracer
+from sensor_debouncer import SensorDebouncer
+from light_state_machine import LightStateMachine
+from gesture_detector import GestureDetector
+from lux_hysteresis import LuxHysteresis
+from lazy_logger import LazyLogger
+from service_batcher import ServiceBatcher
+from light_command_queue import LightCommandQueue
+from yaml_file_updater import YamlFileUpdater
+
+# Stato passato dall'istanza che termina a quella che la sostituisce (stesso processo AppDaemon):
+# {nome app: {"configs", "states", "timers", "saved_at"}}
+_HANDOFF = {}
 
 class LightPresenceControl(hass.Hass):
+    # Timer per luce (chiave f"{light_entity}_{suffisso}") da cancellare o ricreare al ricaricamento
+    LIGHT_TIMERS = (
+        "turn_on_timer", "turn_off_timer", "timer_on_push", "timer_on_time", "timer_filter",
+        "timer_filter_on_push", "timer_filter_on_time", "lux_dwell",
+        "blink_confirm", "cooldown"
+    )
+    HANDOFF_MAX_AGE = 120
+    # Argomenti del coordinatore non copiati nelle istanze shard generate
+    SHARD_EXCLUDED_ARGS = (
+        "module", "class", "light_presence", "light_presence_control", "lights_key", "shards", "shard_by", "shard_file", "shard_thread_base",
+        "write_shard_file", "dependencies", "global_dependencies", "priority", "pin_app", "pin_thread"
+    )
+
     def initialize(self):
         """
         Inizializza la configurazione del controllo delle luci.
@@ -10,34 +42,470 @@ class LightPresenceControl(hass.Hass):
         """
         # Sostituzione strutture timer con TimerManager
         self.timer_manager = TimerManager(self)
+
+        # Log dei callback frequenti: formattazione differita e scrittura in background
+        self.lazylog = LazyLogger(
+            self,
+            level=self.args.get("log_level", "INFO"),
+            rate=int(self.args.get("log_rate_per_light", 0)),
+            per=float(self.args.get("log_rate_window", 60))
+        )
+
+        # Strumentazione attivabile a runtime con gli eventi light_presence_profiler / light_presence_tracer
+        self.profiler = CallbackProfiler(self, enabled=bool(self.args.get("profiling", False)))
+        self.tracer = LatencyTracer(
+            self,
+            enabled=bool(self.args.get("tracing", False)),
+            buffer_size=int(self.args.get("tracing_buffer", 200)),
+            slo_ms=float(self.args.get("latency_slo_ms", 300))
+        )
+        self.listen_event(self.instrumentation_command, "light_presence_profiler", component="profiler")
+        self.listen_event(self.instrumentation_command, "light_presence_tracer", component="tracer")
+
+        # Sensori riepilogativi distinti per ogni shard
+        sensor_suffix = f"_shard_{self.args['shard_index']}" if self.shard_role() == "shard" else ""
+
+        # Coda dei comandi in uscita: vince l'ultimo per entità, throughput limitato con retry
+        self.command_queue = LightCommandQueue(
+            self,
+            enabled=bool(self.args.get("command_queue", True)),
+            rate=float(self.args.get("command_rate", 10)),
+            retries=int(self.args.get("command_retries", 3)),
+            backoff=float(self.args.get("command_backoff", 0.5)),
+            sensor=f"sensor.light_presence_commands{sensor_suffix}",
+            on_dispatch=self.command_dispatched
+        )
+        self.listen_event(self.instrumentation_command, "light_presence_commands", component="command_queue")
+
+        # Chiamate turn_on/turn_off delle luci che condividono un sensore di presenza: una per servizio
+        self.batcher = ServiceBatcher(self, enabled=bool(self.args.get("batch_service_calls", True)), send=self.command_queue.submit_group)
+
+        # Stadio di debounce dei sensori di presenza (opzionale, argomento presence_debounce);
+        # è anche il punto di fan-out: un solo listener per sensore, callback dentro lo stesso batch
+        self.debouncer = SensorDebouncer(
+            self, self.args.get("presence_debounce"), fan_out=self.batcher.collect,
+            sensor=f"sensor.light_presence_debounce{sensor_suffix}"
+        )
+        self.listen_event(self.instrumentation_command, "light_presence_debouncer", component="debouncer")
+        self.run_every(self.publish_instrumentation, "now+60", int(self.args.get("profiling_publish_interval", 60)))
         
         self.log_timer_status = {}
 
-        # Inizializza il dizionario per i flag
-        self.light_turned_off_by_illuminance = {}
-        self.light_illuminance_lock_on = {}
-        
-        # Aggiunte per attivazione manuale
-        self.manual_activation_sequence = {}  # Traccia la sequenza per ogni luce
-        self.cooldown_flags = {}  # Cooldown post-attivazione
+        # Macchina a stati per luce: blocco illuminanza, gesti manuali, blink e cooldown
+        self.state_machine = LightStateMachine({
+            "complete_activation": lambda light_entity, context: self.complete_manual_activation(light_entity, "activate", context["config"]),
+            "complete_deactivation": lambda light_entity, context: self.complete_manual_activation(light_entity, "deactivate", context["config"]),
+            "start_cooldown": self.start_cooldown
+        })
+
+        # Gesti manuali sull'interruttore: buffer di transizioni per luce, nessun timer
+        manual_gestures = self.args.get("manual_gestures")
+        for name in (manual_gestures or {}):
+            if name not in ("activate", "deactivate"):
+                self.log(f"⚠️ Gesto manuale '{name}' non supportato (usa activate o deactivate)", level="WARNING")
+        self.gestures = GestureDetector(manual_gestures)
+
+        # Bande di illuminanza con isteresi e permanenza: timer solo per un cambio di banda in attesa
+        self.lux = LuxHysteresis(
+            hysteresis=float(self.args.get("lux_hysteresis", 0)),
+            dwell=float(self.args.get("lux_dwell", 0))
+        )
+
+        init_start = time.monotonic()
+
+        self.light_handles = {}   # {luce: handle dei listener registrati}
+        self._handle_sink = None
+        # Modalità asyncio per l'attivazione da presenza (argomento async_callbacks o evento light_presence_async)
+        self.async_callbacks = bool(self.args.get("async_callbacks", False))
+        self.listen_event(self.async_mode_command, "light_presence_async")
+        self.log_async_mode()
+        config = self.source_lights()
+        self.write_shard_apps(config)
+        self.initialize_light_configurations(self.owned_lights(config))
+        self.restore_runtime_state(_HANDOFF.pop(self.name, None))
+        self.listen_event(self.reload_light_configurations, "light_presence_reload")
+
+        if self.shard_role() == "shard":
+            # Le istanze shard non hanno light_presence tra i propri args: i generatori leggono il coordinatore
+            self.fire_event("light_presence_shard_ready", app=self.name, coordinator=self.args["shard_of"],
+                            lights=len(self.light_configs))
+            return
+
+        # Notifica i generatori che l'app è pronta (evita il polling di get_app)
+        self.fire_event(
+            "light_presence_control_ready",
+            app=self.name,
+            lights=len(config),
+            init_seconds=round(time.monotonic() - init_start, 3)
+        )
+
+    def terminate(self):
+        """
+        Salva lo stato per l'istanza successiva, scrive i log in coda e ferma il thread di scrittura.
+        """
+        _HANDOFF[self.name] = self.export_runtime_state()
+        self.command_queue.close()
+        self.lazylog.close()
+
+    def shard_role(self):
+        """
+        "shard" per le istanze generate, "coordinator" con shards > 1, altrimenti "single".
+        """
+        if self.args.get("shard_of"):
+            return "shard"
+        if int(self.args.get("shards", 0)) > 1:
+            return "coordinator"
+        return "single"
+
+    def source_lights(self):
+        """
+        Lista light_presence completa: quella dell'app o, per uno shard, quella del coordinatore.
+        """
+        shard_of = self.args.get("shard_of")
+        if not shard_of:
+            return self.args.get(self.lights_key(self.args)) or []
+        # Il coordinatore è una dipendenza dello shard: è già inizializzato
+        coordinator = self.get_app(shard_of)
+        if coordinator is None:
+            self.log(f"❌ Coordinatore {shard_of} non disponibile: nessuna luce per questo shard", level="ERROR")
+            return []
+        return copy.deepcopy(coordinator.args.get(self.lights_key(coordinator.args)) or [])
+
+    @staticmethod
+    def lights_key(args):
+        """
+        Chiave degli args con la lista delle luci (argomento lights_key, default light_presence_control
+        come in apps.yaml); la chiave storica light_presence resta valida se è l'unica presente.
+        """
+        key = args.get("lights_key", "light_presence_control")
+        if key not in args and "light_presence" in args:
+            return "light_presence"
+        return key
+
+    def owned_lights(self, lights):
+        """
+        Luci gestite da questa istanza. Il coordinatore normalizza la lista completa
+        (letta dai generatori) senza gestire luci; ogni shard tiene la propria partizione.
+        """
+        role = self.shard_role()
+        if role == "single":
+            return lights
+        if role == "coordinator":
+            for light_config in lights:
+                self.build_light_configuration(light_config)
+            return []
+
+        assignment = self.assign_shards(lights, int(self.args["shard_count"]), self.args.get("shard_by", "area"))
+        index = int(self.args["shard_index"])
+        return [c for c in lights if assignment.get(c.get("light_entity")) == index]
+
+    def assign_shards(self, lights, count, by):
+        """
+        Partizione deterministica {luce: indice shard}, identica in tutte le istanze.
+
+        - hash: crc32 del light_entity modulo count
+        - area: le luci di una stessa area (o, senza area, dello stesso sensore di presenza)
+          restano nello stesso shard; i gruppi vanno allo shard meno carico, dal più grande
+        """
+        if by == "hash":
+            return {
+                c["light_entity"]: zlib.crc32(c["light_entity"].encode()) % count
+                for c in lights if c.get("light_entity")
+            }
+
+        groups = {}
+        for light_config in lights:
+            light_entity = light_config.get("light_entity")
+            if not light_entity:
+                continue
+            try:
+                area = self.area_name(light_entity)
+            except Exception:
+                area = None
+            key = area or light_config.get("presence_sensor_on") or light_entity
+            groups.setdefault(key, []).append(light_entity)
+
+        loads = [0] * count
+        assignment = {}
+        for _, members in sorted(groups.items(), key=lambda item: (-len(item[1]), str(item[0]))):
+            index = loads.index(min(loads))
+            loads[index] += len(members)
+            for light_entity in members:
+                assignment[light_entity] = index
+        return assignment
+
+    @classmethod
+    def shard_file_path(cls, args):
+        return args.get(
+            "shard_file",
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "light_presence_shards.yaml")
+        )
+
+    @classmethod
+    def render_shard_apps(cls, name, args):
+        """
+        Righe del file delle istanze shard (una per shard, con thread dedicato), senza AppDaemon.
+        Con shards ≤ 1 il file contiene solo l'intestazione.
+        """
+        count = int(args.get("shards", 0))
+        by = args.get("shard_by", "area")
+        if by not in ("area", "hash"):
+            by = "area"
+
+        excluded = set(cls.SHARD_EXCLUDED_ARGS) | {cls.lights_key(args)}
+        inherited = {key: value for key, value in args.items() if key not in excluded}
+        apps = {}
+        for index in range(count if count > 1 else 0):
+            app = {
+                "module": "light_presence_control",
+                "class": "LightPresenceControl",
+                "shard_of": name,
+                "shard_index": index,
+                "shard_count": count,
+                "shard_by": by,
+                "pin_app": True,
+                # Lo shard legge la lista delle luci dal coordinatore (get_app)
+                "dependencies": [name]
+            }
+            if "shard_thread_base" in args:
+                app["pin_thread"] = int(args["shard_thread_base"]) + index
+            # Copia per shard: oggetti condivisi diventerebbero alias YAML (&id001/*id001)
+            app.update(copy.deepcopy(inherited))
+            apps[f"{name}_shard_{index}"] = app
+
+        lines = [
+            "# Generato automaticamente da LightPresenceControl: non modificare",
+            f"# Istanze shard di {name} (shards: {count}, shard_by: {by})"
+        ]
+        if apps:
+            lines += yaml.safe_dump(apps, sort_keys=False, allow_unicode=True).splitlines()
+        return lines
+
+    def write_shard_apps(self, lights):
+        """
+        Coordinatore: verifica il file YAML delle istanze shard letto da AppDaemon.
+
+        Il file si genera offline (python light_presence_control.py --write-shards): AppDaemon
+        sorveglia la cartella delle app e ricarica le app a ogni scrittura. Con write_shard_file: true
+        il coordinatore lo scrive all'avvio, solo se il contenuto cambia: la prima scrittura
+        avvia gli shard, quelle successive avvengono solo quando cambiano gli argomenti
+        del coordinatore (che AppDaemon ha già ricaricato), quindi senza ciclo di ricaricamenti.
+        """
+        if self.shard_role() == "shard":
+            return
+
+        path = self.shard_file_path(self.args)
+        count = int(self.args.get("shards", 0))
+        if count <= 1 and not os.path.exists(path):
+            return
+
+        by = self.args.get("shard_by", "area")
+        if by not in ("area", "hash"):
+            self.log(f"⚠️ shard_by '{by}' non valido, uso 'area'", level="WARNING")
+            by = "area"
+
+        lines = self.render_shard_apps(self.name, self.args)
+        written = False
+        if self.args.get("write_shard_file", False):
+            try:
+                with YamlFileUpdater(path, self) as updater:
+                    written = updater.write_lines(lines)
+            except Exception as e:
+                self.log(f"❌ Errore scrittura istanze shard su {path}: {e}", level="ERROR")
+                return
+            if written:
+                self.log(f"♻️ File shard {path} aggiornato: AppDaemon ricarica le istanze shard", level="WARNING")
+        elif not shard_file_current(path, lines):
+            self.log(
+                f"⚠️ File shard {path} non aggiornato: eseguire "
+                "\"python light_presence_control.py --write-shards\" (o impostare write_shard_file: true)",
+                level="WARNING"
+            )
+
+        if count > 1:
+            assignment = self.assign_shards(lights, count, by)
+            sizes = [sum(1 for index in assignment.values() if index == shard) for shard in range(count)]
+            self.log(
+                f"🧩 Sharding per {by}: {len(assignment)} luci in {count} istanze {sizes}"
+                f"{' (file aggiornato)' if written else ''}"
+            )
+
+    def export_runtime_state(self):
+        """
+        Configurazioni, stato della macchina a stati, timer attivi e stato lux
+        (bande e scadenze di sblocco) di ogni luce.
+        """
+        return {
+            "lux": self.lux.export(),
+            "configs": {c["light_entity"]: dict(c) for c in self.light_configs},
+            "states": {
+                light_entity: (state, dict(self.state_machine.entered.get(light_entity, {})))
+                for light_entity, state in self.state_machine.states.items()
+            },
+            "timers": self.timer_manager.snapshot(),
+            "saved_at": time.monotonic()
+        }
+
+    def restore_runtime_state(self, handoff):
+        """
+        Dopo un riavvio dell'app (es. apps.yaml riscritto dal configuratore): le luci con
+        configurazione invariata riprendono stato e timer residui dell'istanza precedente.
+        """
+        if not handoff or time.monotonic() - handoff["saved_at"] > self.HANDOFF_MAX_AGE:
+            return
+
+        current = {c["light_entity"]: c for c in self.light_configs}
+        unchanged = {
+            light_entity for light_entity, previous in handoff["configs"].items()
+            if light_entity in current and dict(current[light_entity]) == previous
+        }
+
+        for light_entity, (state, entered) in handoff["states"].items():
+            if light_entity in unchanged:
+                self.state_machine.states[light_entity] = state
+                self.state_machine.entered[light_entity] = entered
+
+        # La scadenza di sblocco vive solo in self.lux: senza di essa il blocco resterebbe attivo
+        lux_states = handoff.get("lux")
+        for light_entity in unchanged:
+            if lux_states is not None:
+                if light_entity in lux_states:
+                    self.lux.restore(light_entity, lux_states[light_entity])
+            elif self.state_machine.illuminance_locked(light_entity):
+                # Passaggio senza stato lux: sblocco immediato invece di un blocco senza scadenza
+                self.state_machine.dispatch(light_entity, "lux_unlocked")
+
+        timer_lights = {
+            f"{light_entity}_{suffix}": light_entity
+            for light_entity in unchanged for suffix in self.LIGHT_TIMERS
+        }
+        restored = 0
+        for timer in handoff["timers"]:
+            light_entity = timer_lights.get(timer["key"])
+            callback = getattr(self, timer["callback"], None)
+            if light_entity is None or callback is None:
+                continue
+            kwargs = {k: v for k, v in timer["kwargs"].items() if k != "generation" and not k.startswith("__")}
+            if "config" in kwargs:
+                kwargs["config"] = current[light_entity]
+            self.timer_manager.start_timer(timer["key"], timer["remaining"], callback, timer["is_filter"], *timer["args"], **kwargs)
+            restored += 1
+
+        rebuilt = len(current) - len(unchanged)
+        self.log(f"♻️ Riavvio: {len(unchanged)} luci invariate riprese ({restored} timer), {rebuilt} luci nuove o modificate")
+
+    def reload_light_configurations(self, event_name, data, kwargs):
+        """
+        Evento light_presence_reload (lights: nuova lista light_presence): ricarica sul posto,
+        toccando solo le luci aggiunte, rimosse o modificate.
+        """
+        lights = data.get("lights")
+        if not isinstance(lights, list):
+            self.log("⚠️ light_presence_reload senza lista 'lights': nessuna modifica", level="WARNING")
+            return
+        lights = copy.deepcopy(lights)
+        owned = self.owned_lights(lights)
+        if self.shard_role() == "coordinator":
+            self.args[self.lights_key(self.args)] = lights
+        self.apply_light_configurations(owned)
+
+    def apply_light_configurations(self, config):
+        """
+        Confronta le configurazioni per luce (light_entity) e aggiorna solo le differenze:
+        le luci invariate mantengono listener, timer e stato.
+        """
+        start = time.monotonic()
+        previous = {c["light_entity"]: c for c in self.light_configs}
+        new_configs = [self.build_light_configuration(copy.deepcopy(c)) for c in config]
+        incoming = {c["light_entity"]: c for c in new_configs}
+
+        removed = [light for light in previous if light not in incoming]
+        added = [light for light in incoming if light not in previous]
+        changed = [light for light in incoming if light in previous and dict(previous[light]) != incoming[light]]
+
+        for light_entity in removed + changed:
+            self.teardown_light(light_entity)
+
+        light_configs = []
+        for light_config in new_configs:
+            light_entity = light_config["light_entity"]
+            if light_entity in added or light_entity in changed:
+                self.register_light_listeners(light_config)
+                light_configs.append(light_config)
+            else:
+                light_configs.append(previous[light_entity])
+
+        self.light_configs = light_configs
+        if self.shard_role() == "single":
+            self.args[self.lights_key(self.args)] = light_configs
+        unchanged = len(light_configs) - len(added) - len(changed)
+        self.log(
+            f"♻️ Ricaricamento: +{len(added)} −{len(removed)} ~{len(changed)} ={unchanged} luci "
+            f"in {(time.monotonic() - start) * 1000:.1f}ms"
+        )
+
+    def teardown_light(self, light_entity):
+        """
+        Rimuove listener, timer e stato di una luce rimossa o modificata.
+        """
+        self.cancel_light_listeners(light_entity)
+
+        for suffix in self.LIGHT_TIMERS:
+            for is_filter in (False, True):
+                if self.timer_manager.is_timer_active(f"{light_entity}_{suffix}", is_filter):
+                    self.timer_manager.cancel_timer(f"{light_entity}_{suffix}", is_filter)
 
-        config = self.args.get("light_presence", [])
-        self.initialize_light_configurations(config)
+        self.state_machine.reset(light_entity)
+        self.gestures.clear(light_entity)
+        self.lux.clear(light_entity)
+        self.tracer.discard(light_entity, "reloaded", force=True)
+
+    def cancel_light_listeners(self, light_entity):
+        """
+        Cancella i listener registrati per una luce (timer e stato restano invariati).
+        """
+        for handle in self.light_handles.pop(light_entity, []):
+            if isinstance(handle, tuple) and handle[0] == "debounce":
+                self.debouncer.unregister(handle)
+            elif isinstance(handle, list):
+                for entity_handle in handle:
+                    self.cancel_listen_state(entity_handle)
+            else:
+                self.cancel_listen_state(handle)
 
     def initialize_light_configurations(self, config):
         """
         Inizializza le configurazioni per ogni luce specificata nel file YAML.
+
+        Avvio in tre fasi misurate: costruzione di tutte le configurazioni in un solo
+        passaggio, registrazione dei listener in blocco, riepilogo di una riga per luce.
+        I dettagli completi sono disponibili su richiesta (startup_details o evento
+        light_presence_details).
         """
-        initialization_details = []  # Lista unica per tutte le configurazioni
-        for light_config in config:
-            self.setup_light_configuration(light_config, initialization_details)
-        
-        # Logga TUTTE le configurazioni insieme alla fine
-        self.log_initialization_details(initialization_details)
+        phase_start = time.monotonic()
+        light_configs = [self.build_light_configuration(light_config) for light_config in config]
+        built = time.monotonic()
+
+        for light_config in light_configs:
+            self.register_light_listeners(light_config)
+        registered = time.monotonic()
+
+        self.light_configs = light_configs
+        self.listen_event(self.log_light_details, "light_presence_details")
+        if self.args.get("startup_details", False):
+            self.log_initialization_details([self.initialization_details(c) for c in light_configs])
+        else:
+            self.log_startup_summary(light_configs)
+        logged = time.monotonic()
 
-    def setup_light_configuration(self, light_config, initialization_details):
+        self.log(
+            f"⏱️ Avvio: {len(light_configs)} luci, configurazioni {(built - phase_start) * 1000:.1f}ms, "
+            f"listener {(registered - built) * 1000:.1f}ms, log {(logged - registered) * 1000:.1f}ms"
+        )
+
+    def build_light_configuration(self, light_config):
         """
-        Configura una singola luce con i parametri specificati nel file YAML.
+        Normalizza la configurazione di una luce applicando i valori predefiniti.
         """
         presence_sensor_off = light_config.get("presence_sensor_off")
         
@@ -47,57 +515,100 @@ class LightPresenceControl(hass.Hass):
             light_config["presence_sensor_off"] = presence_sensor_off
 
         # Ottieni i valori di configurazione con valori predefiniti se non specificati
-        light_entity = light_config.get("light_entity", None)
         presence_sensor_on = light_config.get("presence_sensor_on", "off")
-        presence_sensor_off = light_config.get("presence_sensor_off", presence_sensor_on)
-        illuminance_sensor = light_config.get("illuminance_sensor")
-        min_lux_activation = light_config.get("min_lux_activation", int(0))
-        max_lux_activation = light_config.get("max_lux_activation", int(1000))
-        enable_sensor = light_config.get("enable_sensor", "off")
-        enable_illuminance_filter = light_config.get("enable_illuminance_filter", "off")
-        enable_illuminance_automation = light_config.get("enable_illuminance_automation", "off")
-        enable_automation = light_config.get("enable_automation", "off")
-        automatic_enable_automation = light_config.get("automatic_enable_automation", "All")
-        light_sensor_config = light_config.get("light_sensor_config", "All")
-        timer_minutes_on_push = light_config.get("timer_minutes_on_push", int(5))
-        timer_minutes_on_time = light_config.get("timer_minutes_on_time", int(30))
-        timer_filter_on_push = light_config.get("timer_filter_on_push", int(30))
-        timer_filter_on_time = light_config.get("timer_filter_on_time", int(5))
-        timer_seconds_max_lux = light_config.get("timer_seconds_max_lux", int(5))
-        turn_on_light_offset = light_config.get("turn_on_light_offset", float(0.0))
-        turn_off_light_offset = light_config.get("turn_off_light_offset", int(30))
-        enable_manual_activation_light_sensor = light_config.get("enable_manual_activation_light_sensor", "on")
-
         light_config.update({
-            "enable_illuminance_filter": enable_illuminance_filter,
-            "enable_illuminance_automation": enable_illuminance_automation,
-            "enable_automation": enable_automation,
-            "automatic_enable_automation": automatic_enable_automation,
-            "light_sensor_config": light_sensor_config,
-            "timer_minutes_on_push": timer_minutes_on_push,
-            "timer_minutes_on_time": timer_minutes_on_time,
-            "timer_filter_on_push": timer_filter_on_push,
-            "timer_filter_on_time": timer_filter_on_time,
-            "timer_seconds_max_lux": timer_seconds_max_lux,
-            "turn_on_light_offset": turn_on_light_offset,
-            "turn_off_light_offset": turn_off_light_offset,
-            "min_lux_activation": min_lux_activation,
-            "max_lux_activation": max_lux_activation,
+            "enable_illuminance_filter": light_config.get("enable_illuminance_filter", "off"),
+            "enable_illuminance_automation": light_config.get("enable_illuminance_automation", "off"),
+            "enable_automation": light_config.get("enable_automation", "off"),
+            "automatic_enable_automation": light_config.get("automatic_enable_automation", "All"),
+            "light_sensor_config": light_config.get("light_sensor_config", "All"),
+            "timer_minutes_on_push": light_config.get("timer_minutes_on_push", int(5)),
+            "timer_minutes_on_time": light_config.get("timer_minutes_on_time", int(30)),
+            "timer_filter_on_push": light_config.get("timer_filter_on_push", int(30)),
+            "timer_filter_on_time": light_config.get("timer_filter_on_time", int(5)),
+            "timer_seconds_max_lux": light_config.get("timer_seconds_max_lux", int(5)),
+            "turn_on_light_offset": light_config.get("turn_on_light_offset", float(0.0)),
+            "turn_off_light_offset": light_config.get("turn_off_light_offset", int(30)),
+            "min_lux_activation": light_config.get("min_lux_activation", int(0)),
+            "max_lux_activation": light_config.get("max_lux_activation", int(1000)),
             "presence_sensor_on": presence_sensor_on,
-            "presence_sensor_off": presence_sensor_off,
-            "illuminance_sensor": illuminance_sensor,
-            "enable_sensor": enable_sensor,
-            "light_entity": light_entity,
-            "enable_manual_activation_light_sensor": enable_manual_activation_light_sensor,
+            "presence_sensor_off": light_config.get("presence_sensor_off", presence_sensor_on),
+            "illuminance_sensor": light_config.get("illuminance_sensor"),
+            "enable_sensor": light_config.get("enable_sensor", "off"),
+            "light_entity": light_config.get("light_entity", None),
+            "enable_manual_activation_light_sensor": light_config.get("enable_manual_activation_light_sensor", "on"),
         })
+        return light_config
+
+    def register_light_listeners(self, light_config):
+        """
+        Registra i listener di una luce già normalizzata, conservandone gli handle
+        per il ricaricamento per luce.
+        """
+        self._handle_sink = []
+        self.register_listeners(
+            light_config, light_config["light_entity"], light_config["presence_sensor_on"],
+            light_config["presence_sensor_off"], light_config["illuminance_sensor"],
+            light_config["min_lux_activation"], light_config["max_lux_activation"],
+            light_config["timer_minutes_on_push"], light_config["timer_minutes_on_time"],
+            light_config["timer_filter_on_push"], light_config["timer_filter_on_time"],
+            light_config["timer_seconds_max_lux"], light_config["enable_automation"],
+            light_config["automatic_enable_automation"], light_config["turn_on_light_offset"],
+            light_config["turn_off_light_offset"], light_config["enable_illuminance_filter"]
+        )
+        self.light_handles[light_config["light_entity"]] = self._handle_sink
+        self._handle_sink = None
+
+    def log_startup_summary(self, light_configs):
+        """
+        Una riga per luce: entità principali e numero di parametri configurati.
+        """
+        self.log(f"*** INIZIALIZZAZIONE LUCI: {len(light_configs)} configurazioni ***")
+        for index, light_config in enumerate(light_configs, 1):
+            presence = light_config["presence_sensor_on"]
+            if light_config["presence_sensor_off"] != presence:
+                presence += f" / {light_config['presence_sensor_off']}"
+            self.log(
+                f"  #{index} {light_config['light_entity']} ← {presence}"
+                f"{', lux: ' + light_config['illuminance_sensor'] if light_config['illuminance_sensor'] else ''}"
+                f" ({len(light_config)} impostazioni)"
+            )
+
+    def log_light_details(self, event_name, data, kwargs):
+        """
+        Evento light_presence_details: dettagli completi di una luce (light_entity) o di tutte.
+        """
+        light_entity = data.get("light_entity")
+        selected = [c for c in self.light_configs if light_entity in (None, c["light_entity"])]
+        if not selected:
+            self.log(f"⚠️ Nessuna configurazione per {light_entity}", level="WARNING")
+            return
+        self.log_initialization_details([self.initialization_details(c) for c in selected])
 
-        # Registra i listener per gli eventi di stato
-        self.register_listeners(light_config, light_entity, presence_sensor_on, presence_sensor_off,
-                                illuminance_sensor, min_lux_activation, max_lux_activation,
-                                timer_minutes_on_push, timer_minutes_on_time, timer_filter_on_push,
-                                timer_filter_on_time, timer_seconds_max_lux, enable_automation,
-                                automatic_enable_automation, turn_on_light_offset, turn_off_light_offset,
-                                enable_illuminance_filter)
+    def initialization_details(self, light_config):
+        """
+        Costruisce i dettagli di log di una luce (entità con default/verified e listener).
+        """
+        light_entity = light_config["light_entity"]
+        presence_sensor_on = light_config["presence_sensor_on"]
+        presence_sensor_off = light_config["presence_sensor_off"]
+        illuminance_sensor = light_config["illuminance_sensor"]
+        min_lux_activation = light_config["min_lux_activation"]
+        max_lux_activation = light_config["max_lux_activation"]
+        enable_sensor = light_config["enable_sensor"]
+        enable_illuminance_filter = light_config["enable_illuminance_filter"]
+        enable_illuminance_automation = light_config["enable_illuminance_automation"]
+        enable_automation = light_config["enable_automation"]
+        automatic_enable_automation = light_config["automatic_enable_automation"]
+        light_sensor_config = light_config["light_sensor_config"]
+        timer_minutes_on_push = light_config["timer_minutes_on_push"]
+        timer_minutes_on_time = light_config["timer_minutes_on_time"]
+        timer_filter_on_push = light_config["timer_filter_on_push"]
+        timer_filter_on_time = light_config["timer_filter_on_time"]
+        timer_seconds_max_lux = light_config["timer_seconds_max_lux"]
+        turn_on_light_offset = light_config["turn_on_light_offset"]
+        turn_off_light_offset = light_config["turn_off_light_offset"]
+        enable_manual_activation_light_sensor = light_config["enable_manual_activation_light_sensor"]
 
         # Costruisci la lista dei listener per il logging
         listeners = []
@@ -114,8 +625,7 @@ class LightPresenceControl(hass.Hass):
             f"Parametri configurazione: {len(light_config)} impostazioni"
         ])
 
-        # Aggiungi i dettagli di questa configurazione al log finale
-        initialization_details.append({
+        return {
             "entities": [
                 f"Luce: {self.formatted_value(light_entity, light_entity is None)}",
                 f"Sensore di presenza (on): {self.formatted_value(presence_sensor_on, presence_sensor_on == 'off')}",
@@ -139,7 +649,7 @@ class LightPresenceControl(hass.Hass):
                 f"Enable Manual Activation: {self.formatted_value(enable_manual_activation_light_sensor, enable_manual_activation_light_sensor == 'on')}"
             ],
             "listeners": listeners
-        })
+        }
 
     def register_listeners(self, light_config, light_entity, presence_sensor_on, presence_sensor_off,
                             illuminance_sensor, min_lux_activation, max_lux_activation,
@@ -153,31 +663,165 @@ class LightPresenceControl(hass.Hass):
 
         # Aggiungi solo se illuminance_sensor è configurato (non None)
         if illuminance_sensor is not None:
-            self.listen_state(self.illuminance_on, illuminance_sensor, config=light_config)
-            self.listen_state(self.illuminance_off, illuminance_sensor, config=light_config)
-
-        self.listen_state(self.presence_on, presence_sensor_on, new="on", config=light_config)
-        self.listen_state(self.presence_off, presence_sensor_off, new="off", config=light_config)
-        self.listen_state(self.check_and_start_timer_on_time, presence_sensor_on, new="on", config=light_config)
-        self.listen_state(self.check_and_start_timer_on_time, presence_sensor_off, new="off", config=light_config)
-        self.listen_state(self.light_turned_on, light_entity, new="on", config=light_config)
-        self.listen_state(self.light_turned_off, light_entity, new="off", config=light_config)
-        self.listen_state(self.presence_on_off, presence_sensor_on, new="off", config=light_config)
-        self.listen_state(self.value_changed, min_lux_activation, config=light_config)
-        self.listen_state(self.value_changed, max_lux_activation, config=light_config)
-        self.listen_state(self.value_changed, timer_minutes_on_push, config=light_config)
-        self.listen_state(self.value_changed, timer_minutes_on_time, config=light_config)
-        self.listen_state(self.value_changed, timer_filter_on_push, config=light_config)
-        self.listen_state(self.value_changed, timer_filter_on_time, config=light_config)
-        self.listen_state(self.value_changed, timer_seconds_max_lux, config=light_config)
-        self.listen_state(self.value_changed, turn_on_light_offset, config=light_config)
-        self.listen_state(self.value_changed, turn_off_light_offset, config=light_config)
-        self.listen_state(self.cancel_timer_on_no_presence, presence_sensor_on, config=light_config)
-        self.listen_state(self.cancel_timer_on_no_presence, presence_sensor_off, config=light_config)
-        self.listen_state(self.cancel_on_time_if_presence_detected, presence_sensor_on, new="on", config=light_config)
-        self.listen_state(self.cancel_on_time_if_presence_detected, presence_sensor_off, new="on", config=light_config)
-        self.listen_state(self.check_and_cancel_timers, enable_automation, config=light_config)
-        self.listen_state(self.check_and_cancel_timers, automatic_enable_automation, config=light_config)
+            self.listen_light_state(self.illuminance_changed, illuminance_sensor, config=light_config)
+
+        self.listen_presence_on(presence_sensor_on, light_config)
+        self.listen_presence_state(self.presence_off, presence_sensor_off, new="off", config=light_config)
+        self.listen_presence_state(self.check_and_start_timer_on_time, presence_sensor_on, new="on", config=light_config)
+        self.listen_presence_state(self.check_and_start_timer_on_time, presence_sensor_off, new="off", config=light_config)
+        self.listen_light_state(self.light_turned_on, light_entity, new="on", config=light_config)
+        self.listen_light_state(self.light_turned_off, light_entity, new="off", config=light_config)
+        self.listen_presence_state(self.presence_on_off, presence_sensor_on, new="off", config=light_config)
+        # Parametri numerici: un'unica registrazione per tutte le entità
+        self.listen_light_state(self.value_changed, [
+            min_lux_activation, max_lux_activation, timer_minutes_on_push, timer_minutes_on_time,
+            timer_filter_on_push, timer_filter_on_time, timer_seconds_max_lux,
+            turn_on_light_offset, turn_off_light_offset
+        ], config=light_config)
+        self.listen_presence_state(self.cancel_timer_on_no_presence, presence_sensor_on, config=light_config)
+        self.listen_presence_state(self.cancel_timer_on_no_presence, presence_sensor_off, config=light_config)
+        self.listen_presence_state(self.cancel_on_time_if_presence_detected, presence_sensor_on, new="on", config=light_config)
+        self.listen_presence_state(self.cancel_on_time_if_presence_detected, presence_sensor_off, new="on", config=light_config)
+        self.listen_light_state(self.check_and_cancel_timers, enable_automation, config=light_config)
+        self.listen_light_state(self.check_and_cancel_timers, automatic_enable_automation, config=light_config)
+
+    def listen_light_state(self, callback, entity, **kwargs):
+        """
+        Punto unico di registrazione dei listener delle luci: avvolge il callback nel profiler.
+        """
+        handle = self.listen_state(self.profiler.wrap(callback), entity, **kwargs)
+        if self._handle_sink is not None:
+            self._handle_sink.append(handle)
+        return handle
+
+    def listen_presence_state(self, callback, sensor, **kwargs):
+        """
+        Registra un listener su un sensore di presenza: con presence_debounce configurato
+        o con il batch delle chiamate attivo passa dal registro del debouncer (un solo
+        listener reale per sensore, callback delle luci eseguiti nello stesso batch).
+        """
+        if self.debouncer.configured or self.batcher.enabled:
+            token = self.debouncer.register(self.profiler.wrap(callback), sensor, **kwargs)
+            if self._handle_sink is not None:
+                self._handle_sink.append(token)
+            return token
+        return self.listen_light_state(callback, sensor, **kwargs)
+
+    def listen_presence_on(self, sensor, light_config):
+        """
+        Registra l'attivazione da presenza: callback sincrono (tracer, profiler, debounce e batch)
+        oppure, con async_callbacks, la coroutine eseguita sul loop di AppDaemon.
+        """
+        if not self.async_callbacks:
+            return self.listen_presence_state(self.tracer.wrap(self.presence_on), sensor, new="on", config=light_config)
+
+        if self.debouncer.configured:
+            # Il debounce decide quando inoltrare la transizione, la coroutine viene pianificata sul loop:
+            # stesse transizioni stabilizzate del percorso sincrono
+            return self.listen_presence_state(self.presence_on_deferred, sensor, new="on", config=light_config)
+
+        handle = self.listen_state(self.presence_on_async, sensor, new="on", config=light_config)
+        if self._handle_sink is not None:
+            self._handle_sink.append(handle)
+        return handle
+
+    def async_mode_command(self, event_name, data, kwargs):
+        """
+        Evento light_presence_async (action: enable, disable): cambia modalità di attivazione
+        registrando di nuovo i listener; timer e stato delle luci restano invariati.
+        """
+        action = data.get("action")
+        if action not in ("enable", "disable"):
+            self.log(f"⚠️ Azione light_presence_async non riconosciuta: {action}", level="WARNING")
+            return
+        self.async_callbacks = action == "enable"
+        for light_config in self.light_configs:
+            self.cancel_light_listeners(light_config["light_entity"])
+            self.register_light_listeners(light_config)
+        self.log_async_mode()
+
+    def log_async_mode(self):
+        """
+        Modalità di attivazione e differenze del percorso asyncio rispetto a quello sincrono.
+        """
+        if not self.async_callbacks:
+            self.log("⚡ Attivazione da presenza in modalità sincrona")
+            return
+        self.log("⚡ Attivazione da presenza in modalità asyncio")
+        if self.batcher.enabled:
+            # Ogni coroutine applica i propri effetti: nessun batch comune tra le luci dello stesso sensore
+            self.log("⚠️ Modalità asyncio: l'attivazione da presenza non usa il batch per evento delle chiamate "
+                     "di servizio (batch_service_calls); i comandi passano dalla coda comandi", level="WARNING")
+
+    def instrumentation_command(self, event_name, data, kwargs):
+        """
+        Gestisce gli eventi light_presence_profiler, light_presence_tracer e
+        light_presence_debouncer (action: enable, disable, dump, reset).
+        """
+        component = getattr(self, kwargs["component"])
+        action = data.get("action", "dump")
+        if action == "enable":
+            component.set_enabled(True)
+        elif action == "disable":
+            component.set_enabled(False)
+        elif action == "reset":
+            component.reset()
+            self.log(f"📈 Statistiche {kwargs['component']} azzerate")
+        elif action == "dump":
+            component.dump()
+        else:
+            self.log(f"⚠️ Azione {kwargs['component']} non riconosciuta: {action}", level="WARNING")
+
+    def publish_instrumentation(self, kwargs):
+        """
+        Pubblica periodicamente profiler, latenze, debounce e coda comandi come sensori (solo se attivi).
+        """
+        self.profiler.publish()
+        self.tracer.publish()
+        self.debouncer.publish()
+        self.command_queue.publish()
+
+    def get_state(self, *args, **kwargs):
+        self.profiler.count("get_state")
+        return super().get_state(*args, **kwargs)
+
+    def turn_on(self, entity_id, **kwargs):
+        self.profiler.count("turn_on")
+        if self.batcher.add("turn_on", entity_id, kwargs) or self.queue_command("turn_on", entity_id, kwargs):
+            return None
+        result = super().turn_on(entity_id, **kwargs)
+        if isinstance(entity_id, str):
+            self.tracer.dispatched(entity_id, time.monotonic())
+        return result
+
+    def turn_off(self, entity_id, **kwargs):
+        self.profiler.count("turn_off")
+        if self.batcher.add("turn_off", entity_id, kwargs) or self.queue_command("turn_off", entity_id, kwargs):
+            return None
+        return super().turn_off(entity_id, **kwargs)
+
+    def command_dispatched(self, action, entities, when, result):
+        """
+        Esito di un comando dalla coda (thread di invio): chiude le tracce di latenza
+        dei turn_on all'istante dell'invio effettivo, non a quello dell'accodamento.
+        """
+        if action == "turn_on":
+            for light_entity in entities:
+                self.tracer.dispatched(light_entity, when, result)
+
+    def queue_command(self, action, entity_id, kwargs):
+        """
+        Affida il comando alla coda in uscita (False se va eseguito direttamente).
+        """
+        if not self.command_queue.enabled or not isinstance(entity_id, str) or "." not in entity_id:
+            return False
+        try:
+            params = tuple(sorted(kwargs.items()))
+            hash(params)
+        except TypeError:
+            return False
+        self.command_queue.submit(entity_id, action, params)
+        return True
 
     def log_initialization_details(self, initialization_details):
         """
@@ -228,86 +872,161 @@ class LightPresenceControl(hass.Hass):
         return f"{value} {'(default)' if is_default else '(verified)'}"
 
     def presence_on(self, entity, attribute, old, new, kwargs):
+        config = kwargs["config"]
+        decision, detail = self.decide_presence_on(
+            config, old, new, self.get_state, self.presence_timer_flags(config["light_entity"])
+        )
+        self.apply_presence_on(entity, config, decision, detail)
+
+    async def presence_on_async(self, entity, attribute, old, new, kwargs):
+        """
+        Variante asyncio di presence_on: le letture di stato dei controlli partono insieme
+        (asyncio.gather), la decisione è la stessa funzione pura del percorso sincrono e gli
+        effetti (timer, macchina a stati, coda comandi) vengono eseguiti nell'executor.
+        """
         config = kwargs["config"]
         light_entity = config["light_entity"]
-        enable_sensor = config["enable_sensor"]
-        enable_automation = config["enable_automation"]
-        enable_illuminance_filter = config["enable_illuminance_filter"]
-        illuminance_sensor = config["illuminance_sensor"]
-        min_lux_activation = config["min_lux_activation"]
-        timer_seconds_max_lux = config["timer_seconds_max_lux"]
-        turn_off_light_offset = config["turn_off_light_offset"]
-        turn_on_light_offset = config["turn_on_light_offset"]
+        reads = self.presence_on_reads(config)
+        traced = self.tracer.enabled
+        started = time.perf_counter()
+
+        if traced:
+            values = await asyncio.gather(
+                self.get_state(entity, attribute="last_changed"),
+                *(self.get_state(read) for read in reads)
+            )
+            self.tracer.begin(light_entity, entity, receipt=self.tracer.receipt_delay(values[0]), mode="async")
+            values = values[1:]
+        else:
+            values = await asyncio.gather(*(self.get_state(read) for read in reads))
+
+        states = dict(zip(reads, values))
+        decision, detail = self.decide_presence_on(
+            config, old, new, states.get, self.presence_timer_flags(light_entity)
+        )
+        try:
+            await self.run_in_executor(self.apply_presence_on, entity, config, decision, detail)
+        finally:
+            if traced:
+                self.tracer.discard(light_entity, "gated")
+            if self.profiler.enabled:
+                # La coroutine non passa da profiler.wrap: durata e letture registrate qui
+                frame = dict.fromkeys(self.profiler.COUNTERS, 0)
+                frame["get_state"] = len(reads)
+                self.profiler.record("presence_on_async", light_entity, time.perf_counter() - started, frame)
+
+    def presence_on_deferred(self, entity, attribute, old, new, kwargs):
+        """
+        Inoltro del debouncer in modalità asyncio: pianifica presence_on_async sul loop.
+        """
+        self.run_in(self.presence_on_scheduled, 0, sensor=entity, old_state=old, new_state=new,
+                    config=kwargs["config"])
+
+    async def presence_on_scheduled(self, kwargs):
+        await self.presence_on_async(kwargs["sensor"], "state", kwargs["old_state"], kwargs["new_state"],
+                                     {"config": kwargs["config"]})
+
+    def presence_on_reads(self, config):
+        """
+        Entità lette dai controlli di presence_on (nell'ordine in cui vengono valutate).
+        """
+        reads = [config["enable_automation"], config["enable_sensor"], config["turn_on_light_offset"]]
+        if config["light_sensor_config"]:
+            reads.insert(0, config["light_sensor_config"])
+        return reads
+
+    def presence_timer_flags(self, light_entity):
+        """
+        Timer che bloccano l'attivazione da presenza.
+        """
+        return {
+            "on_push": self.timer_manager.is_timer_active(f"{light_entity}_timer_on_push"),
+            "filter_on_push": self.timer_manager.is_timer_active(f"{light_entity}_timer_filter_on_push", is_filter=True)
+        }
+
+    @staticmethod
+    def decide_presence_on(config, old, new, read, timers):
+        """
+        Decisione pura dell'attivazione da presenza, condivisa dai percorsi sincrono e asyncio.
 
+        Args:
+            config: Configurazione della luce
+            old, new: Transizione del sensore
+            read: Funzione entità -> stato (get_state o letture già raccolte)
+            timers: Timer bloccanti da presence_timer_flags
+
+        Returns:
+            tuple: (decisione, dettaglio) con decisione tra "mode", "transition", "disabled",
+                   "on_push", "filter_on_push", "delayed", "immediate"
+        """
         # Controllo della modalità selezionata
-        light_sensor_mode = self.get_state(config["light_sensor_config"]).lower() if config["light_sensor_config"] else "all"
+        light_sensor_mode = (read(config["light_sensor_config"]) or "").lower() if config["light_sensor_config"] else "all"
         if light_sensor_mode not in ["on", "all"]:
-            self.log(f"⏭️ Modalità '{light_sensor_mode}': accensione disabilitata")
-            return
+            return "mode", light_sensor_mode
 
         # Verifica transizione OFF->ON
         if not (old == "off" and new == "on"):
-            return
+            return "transition", None
 
         # Controllo abilitazione automazione
-        if not (self.get_state(enable_automation) == "on" and self.get_state(enable_sensor) == "on"):
-            self.log(f"⏻ Automazione disabilitata per {light_entity}", level="DEBUG")
-            return
+        if not (read(config["enable_automation"]) == "on" and read(config["enable_sensor"]) == "on"):
+            return "disabled", None
 
-        timer_push_key = f"{light_entity}_timer_on_push" 
+        # +++ CONTROLLO BLOCCANTE +++ e timer conflittuali
+        if timers["on_push"]:
+            return "on_push", None
+        if timers["filter_on_push"]:
+            return "filter_on_push", None
 
-        # +++ CONTROLLO BLOCCANTE +++
-        if self.timer_manager.is_timer_active(timer_push_key):
-            self.log(f"🚫 Blocco accensione per {light_entity}: timer_on_push attivo")
-            return
+        # Accensione ritardata o immediata
+        try:
+            turn_on_offset = int(float(read(config["turn_on_light_offset"])))
+        except (TypeError, ValueError):
+            turn_on_offset = 0
+        return ("delayed", turn_on_offset) if turn_on_offset > 0 else ("immediate", 0)
 
-        # Controllo timer conflittuali
-        timer_illuminance_key = f"{light_entity}_illuminance_timer"
-        timer_filter_key = f"{light_entity}_timer_filter"
-        timer_filter_on_push_key = f"{light_entity}_timer_filter_on_push"
+    def apply_presence_on(self, entity, config, decision, detail):
+        """
+        Esegue la decisione di presence_on: log dei blocchi oppure accensione (ritardata o immediata).
+        """
+        light_entity = config["light_entity"]
 
-        # Verifica timer filter push
-        if self.timer_manager.is_timer_active(timer_filter_on_push_key, is_filter=True):
-            self.log(f"⏳ Timer filter_on_push attivo, ignoro presenza su {entity}")
+        if decision == "mode":
+            self.lazylog.info("⏭️ Modalità '%s': accensione disabilitata", detail, light=light_entity)
             return
-
-        # Verifica illuminance
-        if timer_illuminance_key in self.timer_manager.timers:
-            self.log(f"☀️ Timer illuminance attivo, ignoro presenza su {entity}")
+        if decision == "transition":
+            return
+        if decision == "disabled":
+            self.lazylog.debug("⏻ Automazione disabilitata per %s", light_entity, light=light_entity)
+            return
+        if decision == "on_push":
+            self.lazylog.info("🚫 Blocco accensione per %s: timer_on_push attivo", light_entity, light=light_entity)
+            return
+        if decision == "filter_on_push":
+            self.lazylog.info("⏳ Timer filter_on_push attivo, ignoro presenza su %s", entity, light=light_entity)
             return
 
         # Cancellazione timer spegnimento
-        timer_offset_key = f"{light_entity}_turn_off_timer"
-        self.timer_manager.cancel_timer(timer_offset_key)
+        self.timer_manager.cancel_timer(f"{light_entity}_turn_off_timer")
 
         # Cancella timer filtro se presente
+        timer_filter_key = f"{light_entity}_timer_filter"
         if timer_filter_key in self.timer_manager.filter_timers:
-            self.log(f"⚡ Cancello timer filtro per {light_entity} per presenza rilevata")
+            self.lazylog.info("⚡ Cancello timer filtro per %s per presenza rilevata", light_entity, light=light_entity)
             self.timer_manager.cancel_timer(timer_filter_key, is_filter=True)
 
-        # Gestione del timer filter_on_push
-        if self.timer_manager.is_timer_active(timer_filter_on_push_key, is_filter=True):
-            self.timer_manager.cancel_timer(timer_filter_on_push_key, is_filter=True)
-            self.turn_off(config["enable_automation"])
-            self.log(f"⏳ Timer filter_on_push cancellato per {light_entity}")
-
-        # Avvia timer di accensione ritardata
-        try:
-            turn_on_offset = int(float(self.get_state(turn_on_light_offset)))
-        except (TypeError, ValueError):
-            turn_on_offset = 0
-
-        timer_key = f"{light_entity}_turn_on_timer"
-        if turn_on_offset > 0:
+        self.tracer.mark(light_entity, "gates")
+        if decision == "delayed":
+            self.tracer.park(light_entity)
             self.timer_manager.start_timer(
-                key=timer_key,
-                delay=turn_on_offset,
+                key=f"{light_entity}_turn_on_timer",
+                delay=detail,
                 callback=self.delayed_turn_on,
                 is_filter=False,
                 light_entity=light_entity,
                 config=config
             )
-            self.log(f"⏳ Avviato timer di accensione ({turn_on_offset}s) per {light_entity}")
+            self.lazylog.info("⏳ Avviato timer di accensione (%ss) per %s", detail, light_entity, light=light_entity)
         else:
             # Accensione immediata se offset = 0
             self.execute_turn_on(config, light_entity)
@@ -332,7 +1051,7 @@ class LightPresenceControl(hass.Hass):
         # Controllo della modalità selezionata
         light_sensor_mode = self.get_state(config["light_sensor_config"]).lower() if config["light_sensor_config"] else "all"
         if light_sensor_mode not in ["off", "all"]:
-            self.log(f"⏭️ Modalità '{light_sensor_mode}': spegnimento disabilitato")
+            self.lazylog.info("⏭️ Modalità '%s': spegnimento disabilitato", light_sensor_mode, light=light_entity)
             return
 
         # Verifica se l'automazione è abilitata
@@ -346,7 +1065,7 @@ class LightPresenceControl(hass.Hass):
 
         # Cancella timer di accensione se presente
         timer_key = f"{light_entity}_turn_on_timer"
-        self.log(f"⏹️ Cancellato timer accensione per {light_entity}: presenza persa", level = "INFO")
+        self.lazylog.info("⏹️ Cancellato timer accensione per %s: presenza persa", light_entity, light=light_entity)
         self.timer_manager.cancel_timer(timer_key)  # Metodo di TimerManager
 
         # Solo se entrambi i sensori sono OFF e la luce è accesa
@@ -357,14 +1076,14 @@ class LightPresenceControl(hass.Hass):
             # Avvia timer di accensione ritardata
             try:
                 turn_off_light_offset_value = int(float(self.get_state(turn_off_light_offset)))
-                self.log(f"Valore turn_off_light_offset letto: {turn_off_light_offset_value} -> {turn_off_light_offset}s", level="DEBUG")
+                self.lazylog.debug("Valore turn_off_light_offset letto: %s -> %ss", turn_off_light_offset_value, turn_off_light_offset, light=light_entity)
             except (TypeError, ValueError) as e:
                 turn_off_light_offset_value = 30
-                self.log(f"⚠️ Errore lettura turn_off_light_offset: {e}. Usato default: 30s", level="WARNING")
+                self.lazylog.warning("⚠️ Errore lettura turn_off_light_offset: %s. Usato default: 30s", e)
 
             # Se offset = 0, spegni immediatamente
             if turn_off_light_offset_value == 0:
-                self.log(f"🛑 Spegnimento immediato per {light_entity} (offset = 0)")
+                self.lazylog.info("🛑 Spegnimento immediato per %s (offset = 0)", light_entity, light=light_entity)
                 self.turn_off_light_after_offset({
                     "light_entity": light_entity,
                     "enable_sensor": enable_sensor,
@@ -383,7 +1102,7 @@ class LightPresenceControl(hass.Hass):
             self.get_state(presence_sensor_off) == "off"):
             filter_timer_key = f"{light_entity}_timer_filter_on_time"
             self.timer_manager.cancel_timer(filter_timer_key, is_filter=True)
-            self.log(f"🛑 Cancellato filter timer per {light_entity} (sensori OFF)", level = "DEBUG")
+            self.lazylog.debug("🛑 Cancellato filter timer per %s (sensori OFF)", light_entity, light=light_entity)
 
     def presence_on_off(self, entity, attribute, old, new, kwargs):
         """
@@ -405,8 +1124,8 @@ class LightPresenceControl(hass.Hass):
         enable_automation = kwargs["enable_automation"]
         generation = kwargs.get("generation")
 
-        # Resetta il flag light_turned_off_by_illuminance
-        self.light_turned_off_by_illuminance[light_entity] = False
+        # Fine dello stato "spenta da illuminanza"
+        self.state_machine.dispatch(light_entity, "offset_off")
 
         # Verifica validità solo se chiamato tramite timer
         if timer_key is not None:
@@ -424,7 +1143,7 @@ class LightPresenceControl(hass.Hass):
             self.turn_off(light_entity)
             self.log(f"💡 Luce {light_entity} spenta {'immediatamente' if timer_key is None else 'per timer scaduto'}", 
                     level="INFO")
-            self.log(f"🔓 Sblocco spegnimento per {light_entity} (light_illuminance_lock_on = False)", 
+            self.log(f"🔓 Sblocco spegnimento per {light_entity} (blocco illuminanza rimosso)", 
                     level="INFO")
 
     def execute_turn_on(self, config, light_entity):
@@ -436,14 +1155,16 @@ class LightPresenceControl(hass.Hass):
 
         # Cancella eventuali timer di accensione pendenti
         self.timer_manager.cancel_timer(timer_key)
+        self.tracer.mark(light_entity, "gates")
 
         # Controllo coerenza configurazione filtro illuminanza
         if self.get_state(enable_illuminance_filter) == "on":
             if not illuminance_sensor:
-                self.log(f"🚨 Configurazione errata: filtro illuminanza attivo senza sensore. Disattivo il filtro per {light_entity}", level="ERROR")
+                self.lazylog.error("🚨 Configurazione errata: filtro illuminanza attivo senza sensore. Disattivo il filtro per %s", light_entity)
                 self.turn_off(config["enable_illuminance_filter"])  # Disabilita l'input_boolean
+                self.tracer.await_dispatch(light_entity, "on_fallback")
                 self.turn_on(light_entity)  # Accensione comunque per sicurezza
-                self.log(f"💡 Luce {light_entity} accesa (filtro disattivato per errore configurazione)")
+                self.lazylog.info("💡 Luce %s accesa (filtro disattivato per errore configurazione)", light_entity, light=light_entity)
                 self.light_state_changed_on(light_entity, None, None, None, {"config": config})
                 return
 
@@ -451,15 +1172,19 @@ class LightPresenceControl(hass.Hass):
                 illuminance = float(self.get_state(illuminance_sensor))
                 min_lux = float(self.get_state(min_lux_activation))
                 
+                self.tracer.mark(light_entity, "illuminance_filter")
                 if illuminance < min_lux:
+                    self.tracer.await_dispatch(light_entity)
                     self.turn_on(light_entity)
-                    self.log(f"💡 Luce {light_entity} accesa per presenza + illuminanza {illuminance} < {min_lux} lux")
+                    self.lazylog.info("💡 Luce %s accesa per presenza + illuminanza %s < %s lux", light_entity, illuminance, min_lux, light=light_entity)
                 else:
-                    self.log(f"🟢 Illuminazione sufficiente ({illuminance} lux), luce non accesa", level="DEBUG")
+                    self.tracer.discard(light_entity, "lux_sufficient", force=True)
+                    self.lazylog.debug("🟢 Illuminazione sufficiente (%s lux), luce non accesa", illuminance, light=light_entity)
                     return  # Non accendere la luce
 
             except (TypeError, ValueError) as e:
-                self.log(f"⚠️ Errore lettura sensori: {e} - Accensione comunque per sicurezza", level="WARNING")
+                self.lazylog.warning("⚠️ Errore lettura sensori: %s - Accensione comunque per sicurezza", e)
+                self.tracer.await_dispatch(light_entity, "on_fallback")
                 self.turn_on(light_entity)  # Fallback in caso di errore
 
             # Aggiorna lo stato dopo l'accensione
@@ -467,8 +1192,9 @@ class LightPresenceControl(hass.Hass):
         
         else:
             # Caso senza filtro illuminanza
+            self.tracer.await_dispatch(light_entity)
             self.turn_on(light_entity)
-            self.log(f"💡 Luce {light_entity} accesa per presenza rilevata")
+            self.lazylog.info("💡 Luce %s accesa per presenza rilevata", light_entity, light=light_entity)
             self.light_state_changed_on(light_entity, None, None, None, {"config": config})
 
     def light_turned_on(self, entity, attribute, old, new, kwargs):
@@ -499,8 +1225,8 @@ class LightPresenceControl(hass.Hass):
             self.turn_on(config["enable_automation"])
             self.log(f"🔌 Riattivazione automazione per {light_entity}")
 
-        # Imposta il flag a True per la luce corrente
-        self.light_illuminance_lock_on[light_entity] = True
+        # Blocco dello spegnimento per illuminanza
+        self.state_machine.dispatch(light_entity, "light_on")
         self.log(f"🔒 Blocco spegnimento per {entity}")
 
         # Timer "on_push" e controllo presenza
@@ -532,11 +1258,11 @@ class LightPresenceControl(hass.Hass):
         # Passa old e new per verificare la transizione corretta
         self.check_manual_activation_sequence(light_entity, old, new, config)
 
-        # Resetta il flag a False per questa luce
-        self.light_illuminance_lock_on[light_entity] = False
+        # Rimuove il blocco dello spegnimento per illuminanza
+        self.state_machine.dispatch(light_entity, "light_off")
 
         # Controlla se la luce è stata spenta dalla logica di illuminanza
-        if self.light_turned_off_by_illuminance.get(light_entity, False):
+        if self.state_machine.turned_off_by_illuminance(light_entity):
             self.log(f"⏭️ Timer 'on_push' non avviato per {light_entity}: spenta da illuminanza")
             return
 
@@ -570,6 +1296,10 @@ class LightPresenceControl(hass.Hass):
                     self.log(f"⏳ Timer 'on_push' avviato: {timer_duration} minuti")
 
     def light_state_changed_on(self, entity, attribute, old, new, kwargs):
+        """
+        Dopo un'accensione automatica registra la scadenza del controllo di sblocco
+        (timer_seconds_max_lux), valutata dal primo campione di illuminanza successivo.
+        """
         config = kwargs["config"]
         light_entity = config["light_entity"]
         timer_seconds_max_lux_entity = config["timer_seconds_max_lux"]
@@ -581,18 +1311,7 @@ class LightPresenceControl(hass.Hass):
             timer_seconds = 5  # Default a 5 secondi
             self.log(f"⚠️ Errore lettura timer: {e}. Usato default: {timer_seconds}s", level="WARNING")
 
-        # Avvia il timer con il valore corretto
-        self.timer_manager.start_timer(
-            key=f"{entity}_illuminance_timer",
-            delay=timer_seconds,
-            callback=self.check_luminosity_after_delay,
-            is_filter=True,
-            light_entity=light_entity,
-            timer_illuminance_key=f"{entity}_illuminance_timer",
-            illuminance_sensor=config["illuminance_sensor"],
-            max_lux_activation=config["max_lux_activation"],
-            config=config
-        )
+        self.lux.arm_unlock(light_entity, timer_seconds)
 
     def check_presence_and_disable_automation(self, kwargs):
         config = kwargs["config"]
@@ -665,81 +1384,111 @@ class LightPresenceControl(hass.Hass):
         except KeyError as e:
             self.log(f"Chiave mancante: {str(e)}", level="ERROR")
 
-    def illuminance_on(self, entity, attribute, old, new, kwargs):
-        """Gestisce l'accensione della luce basata sull'illuminanza."""
+    def illuminance_changed(self, entity, attribute, old, new, kwargs):
+        """
+        Campione del sensore di illuminanza: aggiorna la banda della luce (isteresi e permanenza),
+        valuta lo sblocco se la scadenza è trascorsa e applica accensione/spegnimento per banda.
+        """
+        config = kwargs["config"]
+        light_entity = config["light_entity"]
+
+        try:
+            current_lux = float(new)
+        except (TypeError, ValueError):
+            self.lazylog.warning("Valore non valido per il sensore di illuminazione %s. Ignoro.", entity)
+            return
+
+        # Sblocco dopo l'accensione: valutato con l'illuminanza in vigore alla scadenza
+        due, held_lux = self.lux.take_unlock(light_entity)
+        if due:
+            self.check_luminosity_unlock(config, light_entity, current_lux if held_lux is None else held_lux)
+
+        try:
+            min_lux = float(self.get_state(config["min_lux_activation"]))
+            max_lux = float(self.get_state(config["max_lux_activation"]))
+        except (TypeError, ValueError):
+            self.lazylog.error("Soglia lux non valida per %s", light_entity)
+            return
+
+        band = self.lux.sample(light_entity, current_lux, min_lux, max_lux)
+        self.illuminance_on(config, current_lux, band, min_lux)
+        self.illuminance_off(config, current_lux, band, max_lux)
+
+        # Cambio di banda in attesa senza nuovi campioni: un solo timer fino alla conferma
+        wait = self.lux.pending(light_entity)
+        dwell_key = f"{light_entity}_lux_dwell"
+        if wait is not None and not self.timer_manager.is_timer_active(dwell_key, is_filter=True):
+            self.timer_manager.start_timer(
+                key=dwell_key,
+                delay=wait,
+                callback=self.lux_dwell_expired,
+                is_filter=True,
+                config=config
+            )
+
+    def lux_dwell_expired(self, kwargs):
+        """
+        Scadenza della permanenza: ripete l'ultimo campione per confermare il cambio di banda.
+        """
         config = kwargs["config"]
+        last_lux = self.lux.last_lux(config["light_entity"])
+        if last_lux is not None:
+            self.illuminance_changed(config["illuminance_sensor"], "state", None, last_lux, {"config": config})
+
+    def illuminance_on(self, config, current_lux, band, min_lux):
+        """Gestisce l'accensione della luce basata sulla banda di illuminanza confermata."""
         light_entity = config["light_entity"]
         enable_sensor = config["enable_sensor"]
         enable_automation = config["enable_automation"]
         enable_illuminance_automation = config["enable_illuminance_automation"]
         presence_sensor_on = config["presence_sensor_on"]
         presence_sensor_off = config["presence_sensor_off"]
-        illuminance_sensor = config["illuminance_sensor"]
-        min_lux_activation = config["min_lux_activation"]
 
         # Chiave del timer "on push"
         timer_push_key = f"{light_entity}_timer_on_push"
 
-        # Esci se non c'è un sensore di illuminazione configurato
-        if not illuminance_sensor:
-            return
-
         # Verifica se il sensore e l'automazione sono abilitati
         if not (self.get_state(enable_sensor) == "on" and self.get_state(enable_automation) == "on"):
-            self.log(f"Automazione o sensore disabilitati per {light_entity}. Nessuna azione.", level="DEBUG")
+            self.lazylog.debug("Automazione o sensore disabilitati per %s. Nessuna azione.", light_entity, light=light_entity)
             return
 
         # Controlla se il timer "on push" è attivo tramite TimerManager
         if self.timer_manager.is_valid(timer_push_key, self.timer_manager.generations.get(timer_push_key, 0)):
-            self.log(f"Illuminazione rilevata, ma il timer 'on push' è attivo per {light_entity}. Nessuna azione.", level="DEBUG")
-            return
-
-        try:
-            current_lux = float(new)
-        except (TypeError, ValueError):
-            self.log(f"Valore non valido per il sensore di illuminazione {entity}. Ignoro.", level="WARNING")
+            self.lazylog.debug("Illuminazione rilevata, ma il timer 'on push' è attivo per %s. Nessuna azione.", light_entity, light=light_entity)
             return
 
         # Logica di accensione con filtro illuminanza
         if self.get_state(enable_illuminance_automation) == "on":
-            try:
-                min_lux = float(self.get_state(min_lux_activation))
-            except (TypeError, ValueError):
-                self.log(f"Soglia lux non valida per {light_entity}", level="ERROR")
-                return
-
             presence_active = (
                 self.get_state(presence_sensor_on) == "on" or
                 self.get_state(presence_sensor_off) == "on"
             )
 
-            if presence_active and current_lux < min_lux and self.get_state(light_entity) == "off":
+            if presence_active and band == "dark" and self.get_state(light_entity) == "off":
                 self.turn_on(light_entity)
-                self.log(f"Luce {light_entity} accesa: luminosità ({current_lux}) sotto soglia ({min_lux}) con presenza rilevata.", level="INFO")
-                # Passa il controllo a light_state_changed_on che usa TimerManager
-                self.light_state_changed_on(light_entity, None, old, new, kwargs)
+                self.lazylog.info("Luce %s accesa: luminosità (%s) sotto soglia (%s) con presenza rilevata.", light_entity, current_lux, min_lux, light=light_entity)
+                # Registra la scadenza del controllo di sblocco
+                self.light_state_changed_on(light_entity, None, None, None, {"config": config})
             else:
-                self.log(f"Tentativo di attivazione luce {light_entity} già accesa. Nessuna azione.", level="DEBUG")
+                self.lazylog.debug("Tentativo di attivazione luce %s già accesa. Nessuna azione.", light_entity, light=light_entity, sample=10)
 
-    def illuminance_off(self, entity, attribute, old, new, kwargs):
+    def illuminance_off(self, config, current_lux, band, max_lux):
         """
-        Gestisce lo spegnimento della luce basato sull'illuminanza, solo se entrambi i sensori sono OFF.
+        Gestisce lo spegnimento della luce basato sulla banda di illuminanza, solo con presenza attiva.
         """
-        config = kwargs["config"]
         light_entity = config["light_entity"]
         presence_sensor_on = config["presence_sensor_on"]
         presence_sensor_off = config["presence_sensor_off"]
         enable_sensor = config["enable_sensor"]
         enable_automation = config["enable_automation"]
-        max_lux_activation = config["max_lux_activation"]
 
         # Verifica preliminare automazione
         if not (self.get_state(enable_sensor) == "on" and self.get_state(enable_automation) == "on"):
             return
 
         # Controlla se lo spegnimento è bloccato dal flag
-        if self.light_illuminance_lock_on.get(light_entity, False):
-            self.log(f"🚫 Spegnimento di {light_entity} bloccato (light_illuminance_lock_on = True)", level = "DEBUG")
+        if self.state_machine.illuminance_locked(light_entity):
+            self.lazylog.debug("🚫 Spegnimento di %s bloccato (blocco illuminanza attivo)", light_entity, light=light_entity, sample=10)
             return
 
         presence_active = (
@@ -750,141 +1499,70 @@ class LightPresenceControl(hass.Hass):
         if not presence_active:
             return
 
-        try:
-            current_lux = float(new)
-            max_lux = float(self.get_state(max_lux_activation))
-        except (TypeError, ValueError):
-            return
-
         # Spegnimento per alta illuminanza + presenza
-        if current_lux > max_lux and self.get_state(light_entity) == "on":
+        if band == "bright" and self.get_state(light_entity) == "on":
             self.turn_off(light_entity)
-            self.light_turned_off_by_illuminance[light_entity] = True
-            self.log(f"💡 Luce {light_entity} spenta: luminosità {current_lux} > {max_lux} lux con presenza attiva")
-
-            # Resetta il flag a False per questa luce
-            self.light_illuminance_lock_on[light_entity] = False
-            self.log(f"🔓 Sblocco spegnimento per {light_entity} (light_illuminance_lock_on = False)")
-
-    def start_illuminance_timer(self, light_entity, timer_key, illuminance_sensor, max_lux_activation, timer_seconds_max_lux):
-        """
-        Configura e avvia il timer per il controllo della luminosità.
-        """
-        try:
-            timer_seconds_value = int(float(self.get_state(timer_seconds_max_lux)))
-            self.log(f"Valore convertito di timer_seconds_max_lux: {timer_seconds_value}", level="DEBUG")
-        except (TypeError, ValueError) as e:
-            self.log(f"Errore nella conversione di timer_seconds_max_lux: {e}. Imposto il timer a 5 secondi.", level="INFO")
-            timer_seconds_value = 5
-
-        if timer_seconds_value <= 0:
-            self.log(f"Valore timer non valido ({timer_seconds_value}) per '{timer_seconds_max_lux}'. Imposto a 5 secondi.", level="WARNING")
-            timer_seconds_value = 5
-
-        # Recupera la configurazione associata alla luce
-        config = None
-        for light_config in self.args["light_presence"]:
-            if light_config.get("light_entity") == light_entity:
-                config = light_config
-                break
-
-        if not config:
-            self.log(f"Configurazione non trovata per {light_entity}. Impossibile avviare il timer.", level="ERROR")
-            return
-
-        if not illuminance_sensor:
-            self.log(f"Impossibile avviare timer: sensore di illuminazione non configurato per {light_entity}", level="ERROR")
-            return
+            self.state_machine.dispatch(light_entity, "lux_turned_off")
+            self.lazylog.info("💡 Luce %s spenta: luminosità %s > %s lux con presenza attiva", light_entity, current_lux, max_lux, light=light_entity)
+            self.lazylog.info("🔓 Sblocco spegnimento per %s (blocco illuminanza rimosso)", light_entity, light=light_entity)
 
-        # Avvia il timer (gestisce cancellazione e generazioni automaticamente)
-        self.timer_manager.start_timer(
-            key=timer_key,
-            delay=timer_seconds_value,
-            callback=self.check_luminosity_after_delay,
-            is_filter=True,
-            light_entity=light_entity,
-            timer_illuminance_key=timer_key,
-            illuminance_sensor=illuminance_sensor,
-            max_lux_activation=max_lux_activation,
-            config=config
-        )
-        self.log(f"⏳ Timer controllo luminosità avviato per {light_entity}: {timer_seconds_value}s")
-
-    def check_luminosity_after_delay(self, kwargs):
+    def check_luminosity_unlock(self, config, light_entity, current_lux):
         """
-        Controlla la luminosità dopo un ritardo specificato dal timer.
-        Gestito ora da TimerManager per validità e generazioni.
+        Controllo di sblocco dopo l'accensione (scadenza di timer_seconds_max_lux),
+        con l'illuminanza in vigore alla scadenza.
         """
-        timer_illuminance_key = None
         try:
-            config = kwargs["config"]
-            light_entity = kwargs["light_entity"]
             enable_sensor = config["enable_sensor"]
             enable_automation = config["enable_automation"]
-            illuminance_sensor = kwargs["illuminance_sensor"]
-            max_lux_activation = kwargs["max_lux_activation"]
-            timer_illuminance_key = kwargs.get("timer_illuminance_key")
+            max_lux_activation = config["max_lux_activation"]
 
             # Verifica automazione (mantenuta come logica di business)
             if not (self.get_state(enable_sensor) == "on" and self.get_state(enable_automation) == "on"):
-                self.log(f"🚫 Automazione disabilitata, ignorato aggiornamento lux per {light_entity}")
+                self.lazylog.info("🚫 Automazione disabilitata, ignorato aggiornamento lux per %s", light_entity, light=light_entity)
                 return
 
             # Verifica stato luce (mantenuta come logica di business)
             if self.get_state(light_entity) != "on":
-                self.log(f"Luce {light_entity} spenta. Timer non eseguito.", level="INFO")
-                self.timer_manager.cancel_timer(timer_illuminance_key, is_filter=True)
+                self.lazylog.info("Luce %s spenta. Controllo di sblocco non eseguito.", light_entity, light=light_entity)
                 return
 
             # Verifica blocco illuminanza (mantenuta come logica di business)
-            if not self.light_illuminance_lock_on.get(light_entity, False):
-                self.log(f"🔓 Blocco non attivo per '{light_entity}'. Timer annullato.", level="INFO")
-                self.timer_manager.cancel_timer(timer_illuminance_key, is_filter=True)
+            if not self.state_machine.illuminance_locked(light_entity):
+                self.lazylog.info("🔓 Blocco non attivo per '%s'. Controllo annullato.", light_entity, light=light_entity)
                 return
 
-            # Conversione parametri con gestione errori e None
+            max_lux_value = self.get_state(max_lux_activation)
+            if max_lux_value is None:
+                self.lazylog.warning("⚠️ max_lux_activation è None per %s, uso default: 1000", light_entity)
             try:
-                # Ottieni i valori grezzi
-                max_lux_value = self.get_state(max_lux_activation)
-                current_lux_value = self.get_state(illuminance_sensor)
-                
-                # Log di debug per valori None
-                if max_lux_value is None:
-                    self.log(f"⚠️ max_lux_activation è None per {light_entity}, uso default: 1000", level="WARNING")
-                if current_lux_value is None:
-                    self.log(f"⚠️ illuminance_sensor è None per {light_entity}, uso default: 0", level="WARNING")
-                
-                # Conversione con valori di default se None
                 max_lux = float(max_lux_value) if max_lux_value is not None else 1000.0
-                current_lux = float(current_lux_value) if current_lux_value is not None else 0.0
-                
             except (TypeError, ValueError) as e:
-                self.log(f"Errore conversione valori: {e}. max_lux={max_lux_value}, current_lux={current_lux_value}", level="WARNING")
-                self.timer_manager.cancel_timer(timer_illuminance_key, is_filter=True)
+                self.lazylog.warning("Errore conversione valori: %s. max_lux=%s, current_lux=%s", e, max_lux_value, current_lux)
                 return
 
             # Logica di controllo senza offset
             if current_lux < max_lux:
                 # Disattiva il blocco perché non c'è rischio di spegnimento
-                self.light_illuminance_lock_on[light_entity] = False
-                self.log(f"🔓 Sblocco sicuro per {light_entity} (illuminanza = {current_lux} < {max_lux} lux)")
-            elif current_lux > max_lux and self.light_turned_off_by_illuminance.get(light_entity, False):
-                self.light_illuminance_lock_on[light_entity] = False
-                self.log(f"🔓 Sblocco sicuro per {light_entity} (illuminanza = {current_lux} > {max_lux} lux)")
+                self.state_machine.dispatch(light_entity, "lux_unlocked")
+                self.lazylog.info("🔓 Sblocco sicuro per %s (illuminanza = %s < %s lux)", light_entity, current_lux, max_lux, light=light_entity)
+            elif current_lux > max_lux and self.state_machine.turned_off_by_illuminance(light_entity):
+                self.state_machine.dispatch(light_entity, "lux_unlocked")
+                self.lazylog.info("🔓 Sblocco sicuro per %s (illuminanza = %s > %s lux)", light_entity, current_lux, max_lux, light=light_entity)
             else:
                 # Mantieni il blocco attivo e logga
-                self.log(f"🔒 Blocco mantenuto per {light_entity} (illuminanza = {current_lux} ≥ {max_lux} lux)")
+                self.lazylog.info("🔒 Blocco mantenuto per %s (illuminanza = %s ≥ %s lux)", light_entity, current_lux, max_lux, light=light_entity)
 
         except KeyError as e:
-            self.log(f"Parametro mancante: {e}", level="ERROR")
+            self.lazylog.error("Parametro mancante: %s", e)
         except Exception as e:
-            self.log(f"Errore generico: {e}", level="ERROR")
+            self.lazylog.error("Errore generico: %s", e)
 
     def delayed_turn_on(self, kwargs):
         """Esegue l'accensione dopo il ritardo se la presenza è ancora attiva"""
         config = kwargs["config"]
         light_entity = kwargs["light_entity"]
         timer_key = f"{light_entity}_turn_on_timer"
+        self.tracer.mark(light_entity, "timer_wait")
 
         # Verifica validità (gestita automaticamente dal wrapper)
         presence_active = (
@@ -894,6 +1572,7 @@ class LightPresenceControl(hass.Hass):
         
         if presence_active and self.get_state(light_entity) == "off":
             self.execute_turn_on(config, light_entity)
+        self.tracer.discard(light_entity, "cancelled", force=True)
         
         # Pulizia garantita
         self.timer_manager.cancel_timer(timer_key)
@@ -935,7 +1614,7 @@ class LightPresenceControl(hass.Hass):
             self.timer_manager.cancel_timer(f"{light_entity}_timer_filter_on_time", is_filter=True)
         elif entity == timer_seconds_max_lux:
             self.log(f"Timer 'Max Lux' modificato per {light_entity}: da {float_old} a {float_new} secondi")
-            self.timer_manager.cancel_timer(f"{light_entity}_illuminance_timer", is_filter=True)
+            self.lux.disarm_unlock(light_entity)
         elif entity == min_lux_activation:
             self.log(f"Min Lux Activation Light modificato per {light_entity}: da {float_old} lux a {float_new} lux")
         elif entity == max_lux_activation:
@@ -976,7 +1655,7 @@ class LightPresenceControl(hass.Hass):
 
         # Verifica se la luce è stata spenta manualmente in presenza
         if (self.get_state(light_entity) == "off" and 
-            self.light_turned_off_by_illuminance.get(light_entity, False) is False and
+            not self.state_machine.turned_off_by_illuminance(light_entity) and
             self.get_state(config["enable_automation"]) == "on"):
 
             # Avvia il timer filter_on_push solo se i sensori sono OFF
@@ -1194,17 +1873,18 @@ class LightPresenceControl(hass.Hass):
 
     def check_manual_activation_sequence(self, light_entity, old_state, new_state, config):
         """
-        Controlla se il cambio di stato fa parte di una sequenza di attivazione manuale.
-        Verifica le transizioni OFF->ON o ON->OFF per attivare/disattivare enable_sensor.
+        Controlla se il cambio di stato completa un gesto di attivazione manuale.
+        Le transizioni OFF->ON / ON->OFF finiscono nel buffer di GestureDetector; un gesto
+        riconosciuto diventa un evento della macchina a stati della luce.
         """
         # Verifica se l'attivazione manuale è abilitata
         manual_activation = config.get("enable_manual_activation_light_sensor", "on")
         if self.get_state(manual_activation) != "on":
             return False
 
-        # Verifica se siamo in cooldown
-        if light_entity in self.cooldown_flags:
-            self.log(f"🔒 Cooldown attivo per {light_entity}, ignoro sequenza manuale")
+        # Verifica se siamo in blink di conferma o cooldown
+        if self.state_machine.manual_busy(light_entity):
+            self.lazylog.info("🔒 Cooldown attivo per %s, ignoro sequenza manuale", light_entity, light=light_entity)
             return False
 
         # Verifica presenza
@@ -1221,113 +1901,22 @@ class LightPresenceControl(hass.Hass):
             return False
 
         enable_sensor_state = self.get_state(config["enable_sensor"])
-        
-        # Inizializza la sequenza se non esiste
-        if light_entity not in self.manual_activation_sequence:
-            self.manual_activation_sequence[light_entity] = {
-                "step": 0,
-                "target_sequence": None,
-                "start_time": None,
-                "expected_first_transition": None
-            }
+        if (old_state, new_state) not in (("off", "on"), ("on", "off")) or enable_sensor_state not in ("on", "off"):
+            return False
 
-        sequence = self.manual_activation_sequence[light_entity]
-        
-        # **LOGICA CORRETTA PER ATTIVAZIONE (enable_sensor OFF)**
-        if enable_sensor_state == "off":
-            # Step 1: Transizione OFF->ON (luce si accende)
-            if old_state == "off" and new_state == "on" and sequence["step"] == 0:
-                sequence["step"] = 1
-                sequence["target_sequence"] = "activate"
-                sequence["start_time"] = self.get_now()
-                sequence["expected_first_transition"] = "off_to_on"
-                self.log(f"🎯 Sequenza attivazione iniziata per {light_entity} (step 1: off->on)")
-                
-                # Avvia timer di timeout (1 secondo)
-                self.timer_manager.start_timer(
-                    key=f"{light_entity}_manual_timeout",
-                    delay=1,
-                    callback=self.reset_manual_sequence,
-                    is_filter=False,
-                    light_entity=light_entity
-                )
-                return True
-                
-            # Step 2: Transizione ON->OFF (luce si spegne) - completa la sequenza
-            elif (old_state == "on" and new_state == "off" and 
-                  sequence["step"] == 1 and 
-                  sequence["target_sequence"] == "activate"):
-                
-                elapsed = (self.get_now() - sequence["start_time"]).total_seconds()
-                if elapsed <= 1.0:
-                    self.log(f"✅ Sequenza attivazione completata per {light_entity} in {elapsed:.2f}s")
-                    self.complete_manual_activation(light_entity, "activate", config)
-                    return True
-                else:
-                    self.log(f"⏰ Sequenza attivazione troppo lenta per {light_entity} ({elapsed:.2f}s)")
-                    self.reset_manual_sequence({"light_entity": light_entity})
-                    return False
-
-        # **LOGICA CORRETTA PER DISATTIVAZIONE (enable_sensor ON)**
-        elif enable_sensor_state == "on":
-            # Step 1: Transizione ON->OFF (luce si spegne)
-            if old_state == "on" and new_state == "off" and sequence["step"] == 0:
-                sequence["step"] = 1
-                sequence["target_sequence"] = "deactivate"
-                sequence["start_time"] = self.get_now()
-                sequence["expected_first_transition"] = "on_to_off"
-                self.log(f"🎯 Sequenza disattivazione iniziata per {light_entity} (step 1: on->off)")
-                
-                # Avvia timer di timeout (1 secondo)
-                self.timer_manager.start_timer(
-                    key=f"{light_entity}_manual_timeout",
-                    delay=1,
-                    callback=self.reset_manual_sequence,
-                    is_filter=False,
-                    light_entity=light_entity
-                )
-                return True
-                
-            # Step 2: Transizione OFF->ON (luce si accende) - completa la sequenza
-            elif (old_state == "off" and new_state == "on" and 
-                  sequence["step"] == 1 and 
-                  sequence["target_sequence"] == "deactivate"):
-                
-                elapsed = (self.get_now() - sequence["start_time"]).total_seconds()
-                if elapsed <= 1.0:
-                    self.log(f"✅ Sequenza disattivazione completata per {light_entity} in {elapsed:.2f}s")
-                    self.complete_manual_activation(light_entity, "deactivate", config)
-                    return True
-                else:
-                    self.log(f"⏰ Sequenza disattivazione troppo lenta per {light_entity} ({elapsed:.2f}s)")
-                    self.reset_manual_sequence({"light_entity": light_entity})
-                    return False
-
-        # Reset se sequenza errata o timeout
-        if sequence["step"] > 0:
-            # Verifica se la transizione è quella corretta per il secondo step
-            if sequence["target_sequence"] == "activate":
-                # Per attivazione: primo step è off->on, secondo step deve essere on->off
-                if sequence["step"] == 1 and not (old_state == "on" and new_state == "off"):
-                    self.log(f"❌ Sequenza attivazione interrotta per {light_entity} (transizione errata: {old_state}->{new_state})")
-                    self.reset_manual_sequence({"light_entity": light_entity})
-            elif sequence["target_sequence"] == "deactivate":
-                # Per disattivazione: primo step è on->off, secondo step deve essere off->on
-                if sequence["step"] == 1 and not (old_state == "off" and new_state == "on"):
-                    self.log(f"❌ Sequenza disattivazione interrotta per {light_entity} (transizione errata: {old_state}->{new_state})")
-                    self.reset_manual_sequence({"light_entity": light_entity})
-        
-        return False
+        gesture = self.gestures.record(light_entity, new_state, enable_sensor_state)
+        if gesture is None:
+            return False
+
+        name, duration = gesture
+        self.lazylog.info("🎯 Gesto '%s' riconosciuto per %s in %.0fms", name, light_entity, duration * 1000, light=light_entity)
+        return self.state_machine.dispatch(light_entity, f"gesture_{name}", config=config)
 
     def complete_manual_activation(self, light_entity, action, config):
         """
         Completa la sequenza di attivazione manuale e avvia il blink di conferma.
         """
-        # Cancella timer di timeout
-        self.timer_manager.cancel_timer(f"{light_entity}_manual_timeout")
-        
-        # Reset sequenza
-        self.reset_manual_sequence({"light_entity": light_entity})
+        self.log(f"✅ Sequenza {'attivazione' if action == 'activate' else 'disattivazione'} completata per {light_entity}")
         
         # Pausa solo i timer critici
         self.pause_conflicting_timers(light_entity)
@@ -1350,24 +1939,18 @@ class LightPresenceControl(hass.Hass):
 
     def pause_conflicting_timers(self, light_entity):
         """
-        Pausa temporaneamente solo i timer critici durante l'attivazione manuale.
+        Annulla i timer di accensione/spegnimento durante l'attivazione manuale.
+        Non vengono ripristinati: dopo il blink lo stato finale è quello scelto dal gesto.
         """
-        # Salva lo stato dei timer attivi per ripristinarli dopo
-        if not hasattr(self, 'paused_timers'):
-            self.paused_timers = {}
-        
         critical_timers = [
             f"{light_entity}_turn_on_timer",
             f"{light_entity}_turn_off_timer"
         ]
         
-        self.paused_timers[light_entity] = []
-        
         for timer_key in critical_timers:
             if self.timer_manager.is_timer_active(timer_key):
                 self.timer_manager.cancel_timer(timer_key)
-                self.paused_timers[light_entity].append(timer_key)
-                self.log(f"⏸️ Timer {timer_key} pausato per attivazione manuale")
+                self.log(f"⏸️ Timer {timer_key} annullato per attivazione manuale")
 
     def start_confirmation_blink(self, light_entity, initial_state, final_state, config):
         """
@@ -1408,12 +1991,13 @@ class LightPresenceControl(hass.Hass):
             self.turn_off(light_entity)
             self.log(f"✅ Blink completato: {light_entity} rimane SPENTA (enable_sensor OFF)")
         
-        # Pulisci i timer pausati
-        if hasattr(self, 'paused_timers') and light_entity in self.paused_timers:
-            del self.paused_timers[light_entity]
-        
         # Avvia cooldown di 2 secondi
-        self.cooldown_flags[light_entity] = True
+        self.state_machine.dispatch(light_entity, "blink_done")
+
+    def start_cooldown(self, light_entity, context):
+        """
+        Avvia il cooldown dopo il blink di conferma.
+        """
         self.timer_manager.start_timer(
             key=f"{light_entity}_cooldown",
             delay=2,
@@ -1423,35 +2007,14 @@ class LightPresenceControl(hass.Hass):
         )
         self.log(f"⏳ Cooldown avviato per {light_entity} (2s)")
 
-    def reset_manual_sequence(self, kwargs):
-        """
-        Resetta la sequenza di attivazione manuale per la luce specificata.
-        """
-        light_entity = kwargs["light_entity"]
-        
-        if light_entity in self.manual_activation_sequence:
-            del self.manual_activation_sequence[light_entity]
-        
-        # Cancella timer di timeout
-        self.timer_manager.cancel_timer(f"{light_entity}_manual_timeout")
-        
-        self.log(f"🔄 Sequenza manuale resettata per {light_entity}")
-
     def end_cooldown(self, kwargs):
         """
         Termina il cooldown per l'attivazione manuale.
         """
         light_entity = kwargs["light_entity"]
-        if light_entity in self.cooldown_flags:
-            del self.cooldown_flags[light_entity]
+        self.state_machine.dispatch(light_entity, "cooldown_end")
         self.log(f"✅ Cooldown terminato per {light_entity}")
 
-    def get_now(self):
-        """
-        Ottiene il timestamp corrente.
-        """
-        return datetime.now()
-
     def is_automation_in_progress(self, light_entity):
         """
         Verifica se ci sono automazioni in corso che potrebbero aver causato il cambio di stato.
@@ -1459,8 +2022,7 @@ class LightPresenceControl(hass.Hass):
         # Lista dei timer che indicano automazioni in corso
         automation_timers = [
             f"{light_entity}_turn_on_timer",
-            f"{light_entity}_turn_off_timer",
-            f"{light_entity}_illuminance_timer"
+            f"{light_entity}_turn_off_timer"
         ]
         
         for timer_key in automation_timers:
@@ -1468,9 +2030,66 @@ class LightPresenceControl(hass.Hass):
                 return True
             if self.timer_manager.is_timer_active(timer_key, is_filter=True):
                 return True
+
+        # Accensione automatica recente (scadenza del controllo di sblocco non ancora trascorsa)
+        if self.lux.unlock_window(light_entity):
+            return True
         
         # Verifica se è stata spenta da illuminanza
-        if self.light_turned_off_by_illuminance.get(light_entity, False):
+        if self.state_machine.turned_off_by_illuminance(light_entity):
             return True
         
-        return False
\ No newline at end of file
+        return False
+
+
+def shard_file_current(path, lines):
+    """True se il file delle istanze shard ha già il contenuto indicato"""
+    try:
+        with open(path, "r", encoding="utf-8") as shard_file:
+            return shard_file.read() == "\n".join(lines).rstrip() + "\n"
+    except OSError:
+        return False
+
+
+def write_shards(apps, check=False):
+    """
+    Genera offline i file delle istanze shard dei coordinatori in apps.yaml.
+
+    Returns:
+        int: 0 se i file sono aggiornati (o sono stati scritti), 1 se check trova file da rigenerare
+    """
+    status = 0
+    for name, args in apps.items():
+        if not isinstance(args, dict) or args.get("class") != "LightPresenceControl" or args.get("shard_of"):
+            continue
+        path = LightPresenceControl.shard_file_path(args)
+        if int(args.get("shards", 0)) <= 1 and not os.path.exists(path):
+            continue
+
+        lines = LightPresenceControl.render_shard_apps(name, args)
+        if shard_file_current(path, lines):
+            print(f"{name}: {path} aggiornato")
+        elif check:
+            print(f"{name}: {path} da rigenerare")
+            status = 1
+        else:
+            with YamlFileUpdater(path) as updater:
+                updater.write_lines(lines)
+            print(f"{name}: {path} scritto")
+    return status
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Istanze shard di LightPresenceControl")
+    parser.add_argument("--write-shards", action="store_true", help="Scrive i file delle istanze shard")
+    parser.add_argument("--check", action="store_true", help="Verifica senza scrivere (exit code 1 se da rigenerare)")
+    parser.add_argument("--apps", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "apps.yaml"))
+    options = parser.parse_args()
+    if not (options.write_shards or options.check):
+        parser.error("indicare --write-shards o --check")
+
+    with open(options.apps, "r", encoding="utf-8") as apps_file:
+        sys.exit(write_shards(yaml.safe_load(apps_file) or {}, check=options.check))
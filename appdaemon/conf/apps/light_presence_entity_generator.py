@@ -1,27 +1,97 @@
 import appdaemon.plugins.hass.hassapi as hass
+import hashlib
+import json
 import os
 import re
+import time
 from datetime import datetime
+from generation_pipeline import GenerationPipeline, SectionContribution, SectionEdit
+from yaml_roundtrip import create_roundtrip
+
+# Versione del formato generato: cambiarla forza la rigenerazione delle sezioni
+GENERATOR_VERSION = "2"
 
 class LightPresenceEntityGenerator(hass.Hass):
     def initialize(self):
         self.log("Attendo inizializzazione di LightPresenceControl...", level="INFO")
-        self.run_in(self.try_generate, 1)
 
-    def try_generate(self, kwargs):
-        lpc_app = self.get_app("light_presence")
-        if not lpc_app:
-            self.log("⏳ LightPresenceControl non ancora disponibile, ritento tra 2 secondi...", level="WARNING")
-            self.run_in(self.try_generate, 2)
+        self.source_app_name = self.args.get("source_app", "light_presence")
+        # Chiave degli args dell'app sorgente che contiene la lista delle configurazioni
+        self.source_key = self.args.get("source_key", "light_presence")
+        self.wait_start = time.monotonic()
+        self.generation_started = False
+        self.ready_handle = None
+        self.ready_timeout_handle = None
+
+        # L'app sorgente notifica quando è pronta: nessun polling di get_app.
+        # Senza ready_event (app sorgente che non lo emette) si tenta una sola volta, senza attesa
+        ready_event = self.args.get("ready_event")
+        if ready_event:
+            self.ready_handle = self.listen_event(self.on_source_app_ready, ready_event)
+            self.ready_timeout_handle = self.run_in(self.on_ready_timeout, self.args.get("ready_timeout", 120))
+
+        # L'app potrebbe essere già inizializzata (es. grazie alle dependencies)
+        self.run_in(self.try_generate, 0, final=not ready_event)
+
+    def on_source_app_ready(self, event_name, data, kwargs):
+        """Avvia la generazione appena LightPresenceControl segnala di essere pronta"""
+        self.try_generate({"app": data.get("app", self.source_app_name)})
+
+    def on_ready_timeout(self, kwargs):
+        """Ultimo tentativo allo scadere del timeout di attesa"""
+        self.ready_timeout_handle = None
+        if self.generation_started:
             return
 
-        presence_configs = lpc_app.args.get("light_presence", [])
-        self.generate_files(presence_configs)
+        self.try_generate({"final": True})
+
+    def stop_waiting(self):
+        """Rimuove il listener di readiness e il timer di timeout"""
+        if self.ready_handle is not None:
+            self.cancel_listen_event(self.ready_handle)
+            self.ready_handle = None
+        if self.ready_timeout_handle is not None:
+            self.cancel_timer(self.ready_timeout_handle)
+            self.ready_timeout_handle = None
+
+    def try_generate(self, kwargs):
+        """Genera i file se LightPresenceControl è disponibile. Restituisce True se la generazione è partita."""
+        if self.generation_started:
+            return True
+
+        source_app = self.get_app(kwargs.get("app", self.source_app_name))
+        if not source_app:
+            if kwargs.get("final"):
+                waited = time.monotonic() - self.wait_start
+                self.log(f"❌ LightPresenceControl non disponibile dopo {waited:.1f}s, generazione annullata", level="ERROR")
+                self.stop_waiting()
+            else:
+                self.log("⏳ LightPresenceControl non ancora pronta, attendo l'evento di readiness", level="DEBUG")
+            return False
+
+        # Una lista vuota cancellerebbe tutte le sezioni generate: non generare
+        configs = source_app.args.get(self.source_key) or []
+        if not configs:
+            self.log(f"❌ Nessuna configurazione in '{self.source_key}' di {self.source_app_name}: "
+                     "generazione annullata per non svuotare i file generati", level="ERROR")
+            self.stop_waiting()
+            return False
+
+        self.generation_started = True
+        self.stop_waiting()
+
+        waited = time.monotonic() - self.wait_start
+        self.log(f"🚀 LightPresenceControl pronta dopo {waited:.2f}s", level="INFO")
+
+        self.generate_files(configs)
+
+        self.log(f"⏱️ Avvio completato in {time.monotonic() - self.wait_start:.2f}s", level="INFO")
+        return True
 
     def generate_files(self, presence_configs):
         self.log("✅ LightPresenceControl trovato, procedo con la generazione.", level="INFO")
         
-        config_path = "/homeassistant/www/configurations"
+        config_path = self.args.get("config_path", "/homeassistant/www/configurations")
         ib_path = os.path.join(config_path, "input_boolean.yaml")
         in_path = os.path.join(config_path, "input_number.yaml")
         is_path = os.path.join(config_path, "input_select.yaml")
@@ -41,16 +111,57 @@ class LightPresenceEntityGenerator(hass.Hass):
             # Genera gli ID per ogni tipo di entità
             self.generate_entity_ids(cfg, base_id, config_ib_ids, config_in_ids, config_is_ids)
 
-        # Processa i file
-        self.process_yaml_file(ib_path, "input_boolean", config_ib_ids, presence_configs)
-        self.process_yaml_file(in_path, "input_number", config_in_ids, presence_configs)
-        self.process_yaml_file(is_path, "input_select", config_is_ids, presence_configs)
+        # Contributi alla pipeline di generazione: una sezione per file
+        contributions = [
+            self.make_contribution(ib_path, "input_boolean", config_ib_ids, presence_configs),
+            self.make_contribution(in_path, "input_number", config_in_ids, presence_configs),
+            self.make_contribution(is_path, "input_select", config_is_ids, presence_configs)
+        ]
+        results = self.run_generation_pipeline(contributions)
 
         self.log(f"✅ Sincronizzazione completata per {len(config_ib_ids)} input boolean, {len(config_in_ids)} input number e {len(config_is_ids)} input select", level="INFO")
         self.log("ℹ️ Assicurati di avere in configuration.yaml:", level="WARNING")
         self.log("  input_boolean: !include input_boolean.yaml", level="WARNING")
         self.log("  input_number: !include input_number.yaml", level="WARNING")
         self.log("  input_select: !include input_select.yaml", level="WARNING")
+        return results
+
+    def make_contribution(self, path, entity_type, config_ids, presence_configs):
+        """Crea il contributo alla pipeline per la sezione di un tipo di entità"""
+        return SectionContribution(
+            path,
+            f"{self.get_generator_name()}:{entity_type}",
+            lambda updater: self.compute_section_edit(updater, entity_type, config_ids, presence_configs)
+        )
+
+    def get_generator_name(self):
+        return getattr(self, "name", "light_presence_entity_generator")
+
+    def run_generation_pipeline(self, contributions):
+        """
+        Invia i contributi alla pipeline condivisa. Se pipeline_members elenca altri generatori,
+        la scrittura avviene quando tutti hanno inviato i contributi o allo scadere del timeout.
+        Con dry_run: true restituisce i risultati per file (diff e conteggi) senza scrivere.
+        """
+        pipeline = GenerationPipeline.shared(self.args.get("pipeline", "default"), self.args.get("pipeline_workers", 4))
+
+        if self.args.get("dry_run", False):
+            # Dry-run: stesso percorso di rendering, solo diff e tempi, nessuna scrittura né attesa
+            return pipeline.run(contributions, self, dry_run=True)
+
+        members = self.args.get("pipeline_members", [])
+        if self.get_generator_name() not in members:
+            members = []
+
+        results = pipeline.submit(self.get_generator_name(), contributions, expected=members, hass_instance=self)
+        if results is None:
+            self.log("⏳ Contributi inviati alla pipeline, attendo gli altri generatori", level="INFO")
+            self.run_in(self.flush_generation_pipeline, self.args.get("pipeline_timeout", 30))
+        return results
+
+    def flush_generation_pipeline(self, kwargs):
+        """Scrive i contributi in attesa anche se qualche generatore non ha risposto"""
+        GenerationPipeline.shared(self.args.get("pipeline", "default")).flush(self)
 
     def generate_entity_ids(self, cfg, base_id, ib_ids, in_ids, is_ids):
         """Genera gli ID delle entità per ogni configurazione"""
@@ -83,81 +194,176 @@ class LightPresenceEntityGenerator(hass.Hass):
             if field in cfg and cfg[field].startswith("input_select."):
                 is_ids.add(f"{base_id}_{field}")
 
-    def process_yaml_file(self, path, entity_type, config_ids, presence_configs):
-        """Processa un file YAML gestendo la sincronizzazione completa"""
-        try:
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            
-            # Leggi il contenuto esistente
-            if os.path.exists(path):
-                with open(path, "r", encoding="utf-8") as f:
-                    content = f.read().splitlines()
-            else:
-                content = []
+    def compute_fingerprint(self, entity_type, config_ids, presence_configs):
+        """
+        Calcola l'impronta della sezione generata: hash della parte di configurazione
+        che influenza il file (luce e campi del tipo di entità) più la versione del generatore.
+        """
+        type_fields = self.get_entity_type_fields(entity_type)
+        normalized = {
+            "version": GENERATOR_VERSION,
+            "entity_type": entity_type,
+            "ids": sorted(config_ids),
+            "configs": [
+                [cfg.get("light_entity", "").strip(), sorted(field for field in cfg if field in type_fields)]
+                for cfg in presence_configs
+                if cfg.get("light_entity", "").strip()
+            ]
+        }
+        payload = json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+        return f"v{GENERATOR_VERSION}-{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]}"
 
-            # Controlla se il file è vuoto o non esiste
-            file_is_empty = self.is_file_empty_or_nonexistent(path)
-            
-            if file_is_empty:
-                # Crea file con header decorativo e struttura base
-                content = self.create_empty_file_structure(entity_type)
-                self.log(f"📋 Creato nuovo file {path} con struttura base", level="INFO")
-
-            # Trova le sezioni generate automaticamente
-            start_marker, end_marker = self.get_section_markers(entity_type)
-            start_idx, end_idx = self.find_generated_section(content, start_marker, end_marker)
-            
-            # Leggi le entità esistenti nella sezione generata
-            existing_generated_ids = set()
-            if start_idx != -1 and end_idx != -1:
-                section_content = content[start_idx:end_idx+1]
-                existing_generated_ids = self.extract_ids_from_section(section_content, entity_type)
-
-            # Determina operazioni necessarie
-            ids_to_add = config_ids - existing_generated_ids
-            ids_to_remove = existing_generated_ids - config_ids
-            
-            self.log(f"📊 {entity_type}: da aggiungere {len(ids_to_add)}, da rimuovere {len(ids_to_remove)}", level="INFO")
-
-            # Se non ci sono cambiamenti, esci
-            if not ids_to_add and not ids_to_remove:
-                self.log(f"ℹ️ Nessuna modifica necessaria per {path}", level="DEBUG")
-                return
-
-            # Genera i nuovi blocchi
-            new_blocks = []
-            if config_ids:  # Solo se ci sono configurazioni
-                for cfg in presence_configs:
-                    light_entity = cfg.get("light_entity", "").strip()
-                    if not light_entity:
-                        continue
-                    
-                    base_id = light_entity.split(".")[-1] if "." in light_entity else light_entity
-                    friendly_base = " ".join([word.capitalize() for word in base_id.split("_")])
-                    
-                    # Genera i blocchi per ogni tipo di entità
-                    if entity_type == "input_boolean":
-                        new_blocks.extend(self.generate_input_boolean_blocks(cfg, base_id, friendly_base, config_ids))
-                    elif entity_type == "input_number":
-                        new_blocks.extend(self.generate_input_number_blocks(cfg, base_id, friendly_base, config_ids))
-                    elif entity_type == "input_select":
-                        new_blocks.extend(self.generate_input_select_blocks(cfg, base_id, friendly_base, config_ids))
-
-            # Ricostruisci il contenuto
-            new_content = self.rebuild_file_content(content, entity_type, new_blocks, start_idx, end_idx)
-
-            # Scrivi il file
-            with open(path, "w", encoding="utf-8") as f:
-                f.write("\n".join(new_content).rstrip() + "\n")
-            
-            self.log(f"📄 File {path} aggiornato correttamente", level="INFO")
+    def get_entity_type_fields(self, entity_type):
+        """Restituisce i campi di configurazione che generano entità del tipo indicato"""
+        fields = {
+            "input_boolean": [
+                "enable_sensor", "enable_manual_activation_sensor",
+                "enable_manual_activation_light_sensor", "enable_automation",
+                "enable_illuminance_filter", "enable_illuminance_automation"
+            ],
+            "input_number": [
+                "timer_minutes_on_push", "timer_filter_on_push", "timer_minutes_on_time",
+                "timer_filter_on_time", "timer_seconds_max_lux", "min_lux_activation",
+                "max_lux_activation", "turn_on_light_offset", "turn_off_light_offset"
+            ],
+            "input_select": ["automatic_enable_automation", "light_sensor_config"]
+        }
+        return fields.get(entity_type, [])
+
+    def read_section_fingerprint(self, lines):
+        """
+        Legge l'impronta dall'intestazione della sezione generata.
+        Si ferma appena trovata l'intestazione, senza leggere il resto del file.
+        """
+        in_header = False
+        for line in lines:
+            if "START PRESENCE ENTITY GENERATOR" in line:
+                in_header = True
+            elif in_header:
+                stripped = line.strip()
+                if stripped.startswith("# fingerprint:"):
+                    return stripped.split(":", 1)[1].strip()
+                if stripped and not stripped.startswith("#"):
+                    return None
+
+        return None
 
-        except Exception as e:
-            self.log(f"❌ Errore durante l'elaborazione di {path}: {str(e)}", level="ERROR")
+    def compute_section_edit(self, updater, entity_type, config_ids, presence_configs):
+        """
+        Calcola la modifica della sezione generata in un file già aperto dalla pipeline.
 
-    def generate_input_boolean_blocks(self, cfg, base_id, friendly_base, config_ids):
-        """Genera i blocchi per gli input boolean"""
-        blocks = []
+        Returns:
+            SectionEdit oppure None se il file è già aggiornato
+        """
+        path = updater.path
+
+        # Individua la sezione generata senza caricare il file in memoria
+        start_marker, end_marker = self.get_section_markers(entity_type)
+        start_pattern, end_pattern = self.get_section_patterns()
+        section = updater.find_section(start_pattern, end_pattern, start_marker)
+
+        # Se l'impronta della sezione coincide, il file è già aggiornato: nessuna scrittura
+        fingerprint = self.compute_fingerprint(entity_type, config_ids, presence_configs)
+        existing_fingerprint = self.read_section_fingerprint(section.iter_lines())
+        if existing_fingerprint == fingerprint:
+            self.log(f"ℹ️ {entity_type}: configurazione invariata ({fingerprint}), {path} non modificato", level="DEBUG")
+            return None
+
+        # Leggi i blocchi esistenti nella sezione generata: {id: (testo, hash)}
+        existing_blocks = {}
+        if section.found:
+            existing_blocks = self.read_existing_blocks(updater, section, start_pattern)
+        existing_generated_ids = set(existing_blocks)
+
+        # Determina operazioni necessarie
+        ids_to_add = config_ids - existing_generated_ids
+        ids_to_remove = existing_generated_ids - config_ids
+
+        self.log(f"📊 {entity_type}: da aggiungere {len(ids_to_add)}, da rimuovere {len(ids_to_remove)}", level="INFO")
+
+        # Se non ci sono cambiamenti, esci (a meno che la sezione debba solo aggiornare l'impronta)
+        if not ids_to_add and not ids_to_remove and (not section.found or not config_ids):
+            self.log(f"ℹ️ Nessuna modifica necessaria per {path}", level="DEBUG")
+            return None
+
+        # I blocchi esistenti si riutilizzano se il formato del generatore non è cambiato:
+        # si generano solo quelli nuovi (o tutti, se la versione della sezione è diversa)
+        rerender_all = self.get_fingerprint_version(existing_fingerprint) != GENERATOR_VERSION
+        ids_to_render = config_ids if rerender_all else ids_to_add
+
+        ordered_ids = []
+        rendered_blocks = {}
+        for cfg in presence_configs:
+            light_entity = cfg.get("light_entity", "").strip()
+            if not light_entity:
+                continue
+
+            base_id = light_entity.split(".")[-1] if "." in light_entity else light_entity
+            friendly_base = " ".join([word.capitalize() for word in base_id.split("_")])
+
+            # Ordine dei blocchi: configurazioni, poi campi del tipo di entità
+            for field in self.get_entity_type_fields(entity_type):
+                entity_id = f"{base_id}_{field}"
+                if entity_id in config_ids and entity_id not in ordered_ids:
+                    ordered_ids.append(entity_id)
+
+            if not ids_to_render:
+                continue
+
+            # Genera i blocchi per ogni tipo di entità
+            if entity_type == "input_boolean":
+                rendered_blocks.update(self.generate_input_boolean_blocks(cfg, base_id, friendly_base, ids_to_render))
+            elif entity_type == "input_number":
+                rendered_blocks.update(self.generate_input_number_blocks(cfg, base_id, friendly_base, ids_to_render))
+            elif entity_type == "input_select":
+                rendered_blocks.update(self.generate_input_select_blocks(cfg, base_id, friendly_base, ids_to_render))
+
+        # Unisci blocchi riutilizzati e rigenerati, contando quelli effettivamente modificati
+        new_blocks = []
+        changed = 0
+        for entity_id in ordered_ids:
+            block = rendered_blocks.get(entity_id)
+            if block is None:
+                block = existing_blocks[entity_id][0]
+            elif entity_id in existing_blocks and existing_blocks[entity_id][1] != self.block_hash(block):
+                changed += 1
+            new_blocks.append(block)
+
+        self.log(
+            f"🧩 {entity_type}: {len(ids_to_add)} aggiunti, {len(ids_to_remove)} rimossi, "
+            f"{changed} modificati, {len(ordered_ids) - len(rendered_blocks)} riutilizzati",
+            level="DEBUG"
+        )
+
+        # Costruisci solo la sezione generata
+        new_section = self.render_generated_section(entity_type, new_blocks, fingerprint)
+
+        section_text = "\n".join(new_section) + "\n" if new_section else ""
+        counts = {"added": len(ids_to_add), "removed": len(ids_to_remove), "changed": changed}
+
+        def after_write(written_updater):
+            roundtrip = self.get_yaml_roundtrip()
+            if roundtrip is not None:
+                # Modalità round-trip: la modifica si applica anche all'albero in cache
+                roundtrip.apply_edits(written_updater, start_pattern, dict(zip(ordered_ids, new_blocks)), ids_to_remove)
+
+        if not updater.has_meaningful_content():
+            # File vuoto o inesistente: header decorativo, struttura base e sezione
+            self.log(f"📋 Creo il file {path} con struttura base", level="INFO")
+            content = self.create_empty_file_structure(entity_type) + new_section
+            return SectionEdit(0, updater.size, "\n".join(content).rstrip() + "\n", section_text,
+                               replaces_file=True, after_write=after_write, **counts)
+
+        # I byte prima e dopo la sezione vengono copiati direttamente dal file sorgente
+        if section.found:
+            return SectionEdit(section.start, section.end, section_text, after_write=after_write, **counts)
+
+        # Inserisci la nuova sezione alla fine del file
+        return SectionEdit(updater.size, updater.size, section_text, after_write=after_write, **counts)
+
+    def generate_input_boolean_blocks(self, cfg, base_id, friendly_base, ids_to_render):
+        """Genera i blocchi per gli input boolean indicati: {id: blocco}"""
+        blocks = {}
         boolean_fields = [
             "enable_sensor",
             "enable_manual_activation_sensor",
@@ -178,8 +384,8 @@ class LightPresenceEntityGenerator(hass.Hass):
         
         for field in boolean_fields:
             entity_id = f"{base_id}_{field}"
-            if field in cfg:
-                blocks.append(
+            if entity_id in ids_to_render:
+                blocks[entity_id] = (
                     f"{entity_id}:\n"
                     f"  name: {friendly_base} {friendly_names[field]}\n"
                     f"  icon: mdi:toggle-switch"
@@ -187,9 +393,9 @@ class LightPresenceEntityGenerator(hass.Hass):
         
         return blocks
 
-    def generate_input_number_blocks(self, cfg, base_id, friendly_base, config_ids):
-        """Genera i blocchi per gli input number"""
-        blocks = []
+    def generate_input_number_blocks(self, cfg, base_id, friendly_base, ids_to_render):
+        """Genera i blocchi per gli input number indicati: {id: blocco}"""
+        blocks = {}
         number_configs = {
             "timer_minutes_on_push": {
                 "name": "Timer Minutes On Push",
@@ -240,8 +446,8 @@ class LightPresenceEntityGenerator(hass.Hass):
         
         for field, config in number_configs.items():
             entity_id = f"{base_id}_{field}"
-            if field in cfg:
-                blocks.append(
+            if entity_id in ids_to_render:
+                blocks[entity_id] = (
                     f"{entity_id}:\n"
                     f"  name: {friendly_base} {config['name']}\n"
                     f"  min: {config['min']}\n"
@@ -254,9 +460,9 @@ class LightPresenceEntityGenerator(hass.Hass):
         
         return blocks
 
-    def generate_input_select_blocks(self, cfg, base_id, friendly_base, config_ids):
-        """Genera i blocchi per gli input select"""
-        blocks = []
+    def generate_input_select_blocks(self, cfg, base_id, friendly_base, ids_to_render):
+        """Genera i blocchi per gli input select indicati: {id: blocco}"""
+        blocks = {}
         select_configs = {
             "automatic_enable_automation": {
                 "name": "Automatic Enable Automation",
@@ -272,9 +478,9 @@ class LightPresenceEntityGenerator(hass.Hass):
         
         for field, config in select_configs.items():
             entity_id = f"{base_id}_{field}"
-            if field in cfg:
+            if entity_id in ids_to_render:
                 options_str = "\n".join([f"    - \"{option}\"" for option in config['options']])
-                blocks.append(
+                blocks[entity_id] = (
                     f"{entity_id}:\n"
                     f"  name: {friendly_base} {config['name']}\n"
                     f"  icon: {config['icon']}\n"
@@ -308,56 +514,83 @@ class LightPresenceEntityGenerator(hass.Hass):
         
         return start_marker, end_marker
 
-    def find_generated_section(self, content, start_marker, end_marker):
-        """Trova la sezione generata automaticamente"""
-        start_idx = -1
-        end_idx = -1
-        
-        # Cerca i marcatori specifici per le sezioni generate
-        start_pattern = "START PRESENCE ENTITY GENERATOR"
-        end_pattern = "END PRESENCE ENTITY GENERATOR"
-        
-        for i, line in enumerate(content):
-            if start_pattern in line:
-                start_idx = i
-            elif end_pattern in line and start_idx != -1:
-                end_idx = i
-                break
-        
-        return start_idx, end_idx
+    def get_section_patterns(self):
+        """Restituisce i testi che identificano inizio e fine della sezione generata"""
+        return "START PRESENCE ENTITY GENERATOR", "END PRESENCE ENTITY GENERATOR"
 
     def extract_ids_from_section(self, section_content, entity_type):
         """Estrae gli ID delle entità dalla sezione generata"""
-        ids = set()
+        return set(self.parse_section_blocks(section_content))
+
+    def get_yaml_roundtrip(self):
+        """Restituisce l'helper round-trip (yaml_mode: roundtrip) o None in modalità testo"""
+        if not hasattr(self, "yaml_roundtrip"):
+            self.yaml_roundtrip = create_roundtrip(self, self.args.get("yaml_mode", "text"))
+        return self.yaml_roundtrip
+
+    def read_existing_blocks(self, updater, section, section_id):
+        """Legge i blocchi della sezione dall'albero in cache (round-trip) o dal testo"""
+        roundtrip = self.get_yaml_roundtrip()
+        if roundtrip is not None:
+            try:
+                return roundtrip.section_blocks(updater, section, section_id)
+            except Exception as e:
+                self.log(f"⚠️ Analisi round-trip di {updater.path} non riuscita ({e}), uso la modalità testo", level="WARNING")
+        return self.parse_section_blocks(section.iter_lines())
+
+    def parse_section_blocks(self, section_content):
+        """
+        Suddivide la sezione generata in blocchi indicizzati per ID entità.
+
+        Returns:
+            dict: {entity_id: (testo del blocco, hash)} nell'ordine del file
+        """
+        blocks = {}
+        presence_fields = [field for entity_type in ("input_boolean", "input_number", "input_select")
+                           for field in self.get_entity_type_fields(entity_type)]
         pattern = r"^([a-zA-Z0-9_]+):"
-        
+        current_id = None
+        current_lines = []
+
+        def close_block():
+            if current_id is not None:
+                text = "\n".join(current_lines).rstrip()
+                blocks[current_id] = (text, self.block_hash(text))
+
         for line in section_content:
             match = re.match(pattern, line)
             if match:
+                close_block()
                 entity_id = match.group(1)
                 # Verifica che sia un'entità presence generata (contiene i campi noti)
-                presence_fields = [
-                    "enable_sensor", "enable_manual_activation_sensor", 
-                    "enable_manual_activation_light_sensor", "enable_automation",
-                    "enable_illuminance_filter", "enable_illuminance_automation",
-                    "timer_minutes_on_push", "timer_filter_on_push", "timer_minutes_on_time",
-                    "timer_filter_on_time", "timer_seconds_max_lux", "min_lux_activation",
-                    "max_lux_activation", "turn_on_light_offset", "turn_off_light_offset",
-                    "automatic_enable_automation", "light_sensor_config"
-                ]
-                
                 if any(field in entity_id for field in presence_fields):
-                    ids.add(entity_id)
-        
-        return ids
+                    current_id, current_lines = entity_id, [line]
+                else:
+                    current_id, current_lines = None, []
+            elif line.startswith("#"):
+                # Separatori e cornici chiudono il blocco corrente
+                close_block()
+                current_id, current_lines = None, []
+            elif current_id is not None:
+                current_lines.append(line)
 
-    def rebuild_file_content(self, content, entity_type, new_blocks, start_idx, end_idx):
-        """Ricostruisce il contenuto del file con le nuove entità"""
+        close_block()
+        return blocks
+
+    def block_hash(self, text):
+        """Hash del testo di un blocco, usato per riconoscere i blocchi modificati"""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+    def get_fingerprint_version(self, fingerprint):
+        """Estrae la versione del generatore dall'impronta (es. "v2-..." -> "2"), None se assente"""
+        if not fingerprint or not fingerprint.startswith("v") or "-" not in fingerprint:
+            return None
+        return fingerprint[1:].split("-", 1)[0]
+
+    def render_generated_section(self, entity_type, new_blocks, fingerprint=None):
+        """Costruisce le righe della sezione generata (lista vuota se non ci sono blocchi)"""
         if not new_blocks:
-            # Se non ci sono nuovi blocchi, rimuovi solo la sezione esistente
-            if start_idx != -1 and end_idx != -1:
-                return content[:start_idx] + content[end_idx+1:]
-            return content
+            return []
 
         # Prepara i marcatori
         start_marker = "################################################################################"
@@ -371,7 +604,9 @@ class LightPresenceEntityGenerator(hass.Hass):
         new_section.append(start_marker)
         new_section.append(start_comment)
         new_section.append(start_marker)
-        
+        if fingerprint:
+            new_section.append(f"# fingerprint: {fingerprint}")
+
         # Aggiungi i blocchi delle entità
         for i, block in enumerate(new_blocks):
             lines = block.split("\n")
@@ -380,40 +615,13 @@ class LightPresenceEntityGenerator(hass.Hass):
                     new_section.append(line)
                 else:
                     new_section.append("")
-            
+
             # Aggiungi separatore dopo ogni blocco, escluso l'ultimo
             if i < len(new_blocks) - 1:
                 new_section.append("################################################################################")
-        
+
         new_section.append(start_marker)
         new_section.append(end_comment)
         new_section.append(end_marker)
 
-        # Determina dove inserire la nuova sezione
-        if start_idx != -1 and end_idx != -1:
-            # Sostituisci la sezione esistente
-            return content[:start_idx] + new_section + content[end_idx+1:]
-        else:
-            # Inserisci la nuova sezione alla fine del file
-            return content + new_section
-
-    def is_file_empty_or_nonexistent(self, path):
-        """Controlla se il file non esiste o è vuoto (ignorando spazi e commenti)"""
-        if not os.path.exists(path):
-            return True
-        
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-            
-            if not content:
-                return True
-            
-            # Controlla se ci sono solo commenti e spazi
-            lines = content.split('\n')
-            meaningful_lines = [line for line in lines if line.strip() and not line.strip().startswith('#')]
-            return len(meaningful_lines) == 0
-            
-        except Exception as e:
-            self.log(f"❌ Errore controllo file vuoto {path}: {e}", level="ERROR")
-            return True
+        return new_section
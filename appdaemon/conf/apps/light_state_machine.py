@@ -0,0 +1,169 @@
+"""
+Light State Machine Module for AppDaemon
+Macchina a stati per luce con tabella di transizione precompilata (stato, evento)
+"""
+
+import itertools
+import threading
+import time
+
+
+class LightStateMachine:
+    """
+    Macchina a stati esplicita per ogni luce di LightPresenceControl.
+
+    Lo stato di una luce è composto da regioni ortogonali:
+    - lux: blocco di spegnimento per illuminanza e spegnimento causato dall'illuminanza
+      (sostituisce i flag light_illuminance_lock_on e light_turned_off_by_illuminance)
+    - manual: gesti manuali (riconosciuti da GestureDetector), blink di conferma e cooldown
+      (sostituisce manual_activation_sequence e cooldown_flags)
+
+    Le tabelle delle regioni vengono compilate una sola volta in una tabella piatta
+    {(stato, evento): (stato_successivo, azioni)} sul prodotto degli stati: ogni evento
+    costa una ricerca nel dizionario più l'esecuzione delle azioni registrate.
+    Le coppie (stato, evento) assenti dalla tabella vengono ignorate.
+
+    I timer restano gestiti da TimerManager (generazioni e cancellazioni); le azioni
+    sono i metodi esistenti dell'app, registrati per nome. Accensione e spegnimento
+    da presenza (execute_turn_on, start_offset_timer) restano fuori dalla tabella:
+    il loro stato è dato dai timer attivi e dallo stato della luce in HA.
+    """
+
+    REGIONS = {
+        "lux": {
+            "initial": "free",
+            "states": ("free", "locked", "off_by_lux", "off_by_lux_locked"),
+            "transitions": {
+                # Accensione della luce: blocco dello spegnimento per illuminanza
+                ("free", "light_on"): ("locked", ()),
+                ("off_by_lux", "light_on"): ("off_by_lux_locked", ()),
+                # Spegnimento della luce: blocco rimosso
+                ("locked", "light_off"): ("free", ()),
+                ("off_by_lux_locked", "light_off"): ("off_by_lux", ()),
+                # Spegnimento per alta illuminanza con presenza
+                ("free", "lux_turned_off"): ("off_by_lux", ()),
+                ("locked", "lux_turned_off"): ("off_by_lux", ()),
+                ("off_by_lux_locked", "lux_turned_off"): ("off_by_lux", ()),
+                # Controllo luminosità dopo il ritardo: spegnimento sicuro
+                ("locked", "lux_unlocked"): ("free", ()),
+                ("off_by_lux_locked", "lux_unlocked"): ("off_by_lux", ()),
+                # Spegnimento per offset: fine dello stato "spenta da illuminanza"
+                ("off_by_lux", "offset_off"): ("free", ()),
+                ("off_by_lux_locked", "offset_off"): ("locked", ()),
+            }
+        },
+        "manual": {
+            "initial": "idle",
+            "states": ("idle", "blink", "cooldown"),
+            "transitions": {
+                # Gesto completato (il riconoscimento avviene nel buffer di GestureDetector)
+                ("idle", "gesture_activate"): ("blink", ("complete_activation",)),
+                ("idle", "gesture_deactivate"): ("blink", ("complete_deactivation",)),
+                # Blink di conferma e cooldown
+                ("blink", "blink_done"): ("cooldown", ("start_cooldown",)),
+                ("cooldown", "cooldown_end"): ("idle", ()),
+            }
+        }
+    }
+
+    ORDER = ("lux", "manual")
+    TABLE = None
+    INITIAL = None
+
+    @classmethod
+    def compile(cls):
+        """Compila le tabelle delle regioni in un'unica tabella sugli stati composti"""
+        if cls.TABLE is not None:
+            return cls.TABLE
+
+        regions = [cls.REGIONS[name] for name in cls.ORDER]
+        events = {event for region in regions for (_, event) in region["transitions"]}
+        table = {}
+        for state in itertools.product(*(region["states"] for region in regions)):
+            for event in events:
+                next_state = list(state)
+                actions = ()
+                handled = False
+                for index, region in enumerate(regions):
+                    transition = region["transitions"].get((state[index], event))
+                    if transition is not None:
+                        next_state[index] = transition[0]
+                        actions += transition[1]
+                        handled = True
+                if handled:
+                    table[(state, event)] = (tuple(next_state), actions)
+
+        cls.INITIAL = tuple(region["initial"] for region in regions)
+        cls.TABLE = table
+        return table
+
+    def __init__(self, actions=None):
+        """
+        Inizializza la macchina a stati.
+
+        Args:
+            actions: Dizionario {nome azione: callable(light_entity, context)}
+        """
+        self.table = self.compile()
+        self.actions = dict(actions or {})
+        self.states = {}   # {luce: stato composto}
+        self.entered = {}  # {luce: {regione: istante di ingresso (monotonic)}}
+        self.dispatched = 0
+        self.ignored = 0
+        self._lock = threading.Lock()
+
+    def state(self, light_entity):
+        return self.states.get(light_entity, self.INITIAL)
+
+    def region_state(self, light_entity, region):
+        return self.state(light_entity)[self.ORDER.index(region)]
+
+    def time_in_state(self, light_entity, region):
+        """Secondi trascorsi dall'ingresso nello stato attuale della regione"""
+        entered = self.entered.get(light_entity, {}).get(region)
+        return time.monotonic() - entered if entered is not None else None
+
+    def dispatch(self, light_entity, event, **context):
+        """
+        Applica un evento alla luce: una ricerca in tabella più le azioni associate.
+
+        Returns:
+            bool: True se la coppia (stato, evento) era presente in tabella
+        """
+        with self._lock:
+            state = self.states.get(light_entity, self.INITIAL)
+            transition = self.table.get((state, event))
+            if transition is None:
+                self.ignored += 1
+                return False
+
+            next_state, actions = transition
+            self.dispatched += 1
+            if next_state != state:
+                self.states[light_entity] = next_state
+                now = time.monotonic()
+                entered = self.entered.setdefault(light_entity, {})
+                for index, region in enumerate(self.ORDER):
+                    if next_state[index] != state[index]:
+                        entered[region] = now
+
+        for action in actions:
+            self.actions[action](light_entity, context)
+        return True
+
+    def reset(self, light_entity):
+        with self._lock:
+            self.states.pop(light_entity, None)
+            self.entered.pop(light_entity, None)
+
+    # Viste derivate dallo stato (sostituiscono i flag sparsi)
+
+    def turned_off_by_illuminance(self, light_entity):
+        return self.region_state(light_entity, "lux") in ("off_by_lux", "off_by_lux_locked")
+
+    def illuminance_locked(self, light_entity):
+        return self.region_state(light_entity, "lux") in ("locked", "off_by_lux_locked")
+
+    def manual_busy(self, light_entity):
+        """Blink di conferma o cooldown in corso: le transizioni non sono gesti manuali"""
+        return self.region_state(light_entity, "manual") in ("blink", "cooldown")
@@ -1,29 +1,101 @@
 import appdaemon.plugins.hass.hassapi as hass
+import hashlib
+import json
 import os
 import re
+import time
 from datetime import datetime
+from generation_pipeline import GenerationPipeline, SectionContribution, SectionEdit
+from yaml_roundtrip import create_roundtrip
+
+# Versione del formato generato: cambiarla forza la rigenerazione delle sezioni
+GENERATOR_VERSION = "2"
 
 class LightTemplateGenerator(hass.Hass):
     def initialize(self):
         self.log("Attendo inizializzazione di LightConfigControl...", level="INFO")
-        self.run_in(self.try_generate, 1)
 
-    def try_generate(self, kwargs):
-        lcc_app = self.get_app("light_config")
-        if not lcc_app:
-            self.log("⏳ LightConfigControl non ancora disponibile, ritento tra 2 secondi...", level="WARNING")
-            self.run_in(self.try_generate, 2)
+        self.source_app_name = self.args.get("source_app", "light_config")
+        # Chiave degli args dell'app sorgente che contiene la lista delle configurazioni
+        self.source_key = self.args.get("source_key", "light_config")
+        self.wait_start = time.monotonic()
+        self.generation_started = False
+        self.ready_handle = None
+        self.ready_timeout_handle = None
+
+        # L'app sorgente notifica quando è pronta: nessun polling di get_app.
+        # Senza ready_event (app sorgente che non lo emette) si tenta una sola volta, senza attesa
+        ready_event = self.args.get("ready_event")
+        if ready_event:
+            self.ready_handle = self.listen_event(self.on_source_app_ready, ready_event)
+            self.ready_timeout_handle = self.run_in(self.on_ready_timeout, self.args.get("ready_timeout", 120))
+
+        # L'app potrebbe essere già inizializzata (es. grazie alle dependencies)
+        self.run_in(self.try_generate, 0, final=not ready_event)
+
+    def on_source_app_ready(self, event_name, data, kwargs):
+        """Avvia la generazione appena LightConfigControl segnala di essere pronta"""
+        self.try_generate({"app": data.get("app", self.source_app_name)})
+
+    def on_ready_timeout(self, kwargs):
+        """Ultimo tentativo allo scadere del timeout di attesa"""
+        self.ready_timeout_handle = None
+        if self.generation_started:
             return
 
-        light_configs = lcc_app.args.get("light_config", [])
-        self.generate_files(light_configs)
+        self.try_generate({"final": True})
+
+    def stop_waiting(self):
+        """Rimuove il listener di readiness e il timer di timeout"""
+        if self.ready_handle is not None:
+            self.cancel_listen_event(self.ready_handle)
+            self.ready_handle = None
+        if self.ready_timeout_handle is not None:
+            self.cancel_timer(self.ready_timeout_handle)
+            self.ready_timeout_handle = None
+
+    def try_generate(self, kwargs):
+        """Genera i file se LightConfigControl è disponibile. Restituisce True se la generazione è partita."""
+        if self.generation_started:
+            return True
+
+        source_app = self.get_app(kwargs.get("app", self.source_app_name))
+        if not source_app:
+            if kwargs.get("final"):
+                waited = time.monotonic() - self.wait_start
+                self.log(f"❌ LightConfigControl non disponibile dopo {waited:.1f}s, generazione annullata", level="ERROR")
+                self.stop_waiting()
+            else:
+                self.log("⏳ LightConfigControl non ancora pronta, attendo l'evento di readiness", level="DEBUG")
+            return False
+
+        # Una lista vuota cancellerebbe tutte le sezioni generate: non generare
+        configs = source_app.args.get(self.source_key) or []
+        if not configs:
+            self.log(f"❌ Nessuna configurazione in '{self.source_key}' di {self.source_app_name}: "
+                     "generazione annullata per non svuotare i file generati", level="ERROR")
+            self.stop_waiting()
+            return False
+
+        self.generation_started = True
+        self.stop_waiting()
+
+        waited = time.monotonic() - self.wait_start
+        self.log(f"🚀 LightConfigControl pronta dopo {waited:.2f}s", level="INFO")
+
+        self.generate_files(configs)
+
+        self.log(f"⏱️ Avvio completato in {time.monotonic() - self.wait_start:.2f}s", level="INFO")
+        return True
 
     def generate_files(self, light_configs):
         self.log("✅ LightConfigControl trovato, procedo con la generazione.", level="INFO")
         
-        config_path = "/homeassistant/www/configurations"
+        config_path = self.args.get("config_path", "/homeassistant/www/configurations")
         ib_path = os.path.join(config_path, "input_boolean.yaml")
         tl_path = os.path.join(config_path, "lights.yaml")
+        tpl_path = os.path.join(config_path, "templates.yaml")
+        compact = self.args.get("output_mode", "standard") == "compact"
 
         # Genera gli ID dalle configurazioni
         config_ib_ids = set()
@@ -42,88 +114,229 @@ class LightTemplateGenerator(hass.Hass):
             config_ib_ids.add(template_id)
             config_tl_ids.add(light_id)
 
-        # Processa i file
-        self.process_yaml_file(ib_path, "input_boolean", config_ib_ids, light_configs)
-        self.process_yaml_file(tl_path, "template_lights", config_tl_ids, light_configs)
+        # Contributi alla pipeline di generazione: una sezione per file
+        contributions = [self.make_contribution(ib_path, "input_boolean", config_ib_ids, light_configs)]
+        if compact:
+            # Modalità compatta: un unico blocco template a trigger per tutte le luci in templates.yaml,
+            # la sezione legacy in lights.yaml viene rimossa
+            contributions.append(self.make_contribution(tpl_path, "template_compact", config_tl_ids, light_configs))
+            if os.path.exists(tl_path):
+                contributions.append(self.make_contribution(tl_path, "template_lights", set(), light_configs))
+        else:
+            contributions.append(self.make_contribution(tl_path, "template_lights", config_tl_ids, light_configs))
+            if os.path.exists(tpl_path):
+                contributions.append(self.make_contribution(tpl_path, "template_compact", set(), light_configs))
+        results = self.run_generation_pipeline(contributions)
 
         self.log(f"✅ Sincronizzazione completata per {len(config_ib_ids)} input boolean e {len(config_tl_ids)} template lights", level="INFO")
         self.log("ℹ️ Assicurati di avere in configuration.yaml:", level="WARNING")
         self.log("  input_boolean: !include input_boolean.yaml", level="WARNING")
-        self.log("  light: !include lights.yaml", level="WARNING")
+        if compact:
+            self.log("  template: !include templates.yaml", level="WARNING")
+            self.log("ℹ️ Passando a compact lights.yaml diventa una lista vuota: \"light: !include lights.yaml\" "
+                     "resta valido e si può rimuovere se non include altre luci", level="WARNING")
+        else:
+            self.log("  light: !include lights.yaml", level="WARNING")
+            self.log("ℹ️ Tornando a standard la sezione di templates.yaml viene rimossa: "
+                     "\"template: !include templates.yaml\" si può rimuovere se non include altri template", level="WARNING")
+        return results
 
-    def process_yaml_file(self, path, entity_type, config_ids, light_configs):
-        """Processa un file YAML gestendo la sincronizzazione completa"""
-        try:
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            
-            # Leggi il contenuto esistente
-            if os.path.exists(path):
-                with open(path, "r", encoding="utf-8") as f:
-                    content = f.read().splitlines()
-            else:
-                content = []
+    def make_contribution(self, path, entity_type, config_ids, light_configs):
+        """Crea il contributo alla pipeline per la sezione di un tipo di entità"""
+        return SectionContribution(
+            path,
+            f"{self.get_generator_name()}:{entity_type}",
+            lambda updater: self.compute_section_edit(updater, entity_type, config_ids, light_configs)
+        )
 
-            # Controlla se il file è vuoto o non esiste
-            file_is_empty = self.is_file_empty_or_nonexistent(path)
-            
-            if file_is_empty:
-                # Crea file con header decorativo e struttura base
-                content = self.create_empty_file_structure(entity_type)
-                self.log(f"📋 Creato nuovo file {path} con struttura base", level="INFO")
-
-            # Trova le sezioni generate automaticamente
-            start_marker, end_marker = self.get_section_markers(entity_type)
-            start_idx, end_idx = self.find_generated_section(content, start_marker, end_marker)
-            
-            # Leggi le entità esistenti nella sezione generata
-            existing_generated_ids = set()
-            if start_idx != -1 and end_idx != -1:
-                section_content = content[start_idx:end_idx+1]
-                existing_generated_ids = self.extract_ids_from_section(section_content, entity_type)
-
-            # Determina operazioni necessarie
-            ids_to_add = config_ids - existing_generated_ids
-            ids_to_remove = existing_generated_ids - config_ids
-            
-            self.log(f"📊 {entity_type}: da aggiungere {len(ids_to_add)}, da rimuovere {len(ids_to_remove)}", level="INFO")
-
-            # Se non ci sono cambiamenti, esci
-            if not ids_to_add and not ids_to_remove:
-                self.log(f"ℹ️ Nessuna modifica necessaria per {path}", level="DEBUG")
-                return
-
-            # Genera i nuovi blocchi
-            new_blocks = []
-            if config_ids:  # Solo se ci sono configurazioni
-                for cfg in light_configs:
-                    light_entity = cfg.get("light_entity", "").strip()
-                    if not light_entity:
-                        continue
-                    
-                    base_id = light_entity.split(".")[-1] if "." in light_entity else light_entity
-                    normalized_base_id = base_id.lower().replace(" ", "_")
-                    
-                    if entity_type == "input_boolean":
+    def get_generator_name(self):
+        return getattr(self, "name", "light_template_generator")
+
+    def run_generation_pipeline(self, contributions):
+        """
+        Invia i contributi alla pipeline condivisa. Se pipeline_members elenca altri generatori,
+        la scrittura avviene quando tutti hanno inviato i contributi o allo scadere del timeout.
+        Con dry_run: true restituisce i risultati per file (diff e conteggi) senza scrivere.
+        """
+        pipeline = GenerationPipeline.shared(self.args.get("pipeline", "default"), self.args.get("pipeline_workers", 4))
+
+        if self.args.get("dry_run", False):
+            # Dry-run: stesso percorso di rendering, solo diff e tempi, nessuna scrittura né attesa
+            return pipeline.run(contributions, self, dry_run=True)
+
+        members = self.args.get("pipeline_members", [])
+        if self.get_generator_name() not in members:
+            members = []
+
+        results = pipeline.submit(self.get_generator_name(), contributions, expected=members, hass_instance=self)
+        if results is None:
+            self.log("⏳ Contributi inviati alla pipeline, attendo gli altri generatori", level="INFO")
+            self.run_in(self.flush_generation_pipeline, self.args.get("pipeline_timeout", 30))
+        return results
+
+    def flush_generation_pipeline(self, kwargs):
+        """Scrive i contributi in attesa anche se qualche generatore non ha risposto"""
+        GenerationPipeline.shared(self.args.get("pipeline", "default")).flush(self)
+
+    def compute_fingerprint(self, entity_type, config_ids, light_configs):
+        """
+        Calcola l'impronta della sezione generata: hash delle luci configurate
+        (nell'ordine di generazione) più la versione del generatore.
+        """
+        normalized = {
+            "version": GENERATOR_VERSION,
+            "entity_type": entity_type,
+            "ids": sorted(config_ids),
+            "lights": [
+                cfg.get("light_entity", "").strip()
+                for cfg in light_configs
+                if cfg.get("light_entity", "").strip()
+            ]
+        }
+        payload = json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+        return f"v{GENERATOR_VERSION}-{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]}"
+
+    def read_section_fingerprint(self, lines):
+        """
+        Legge l'impronta dall'intestazione della sezione generata.
+        Si ferma appena trovata l'intestazione, senza leggere il resto del file.
+        """
+        in_header = False
+        for line in lines:
+            if "START LIGHT TEMPLATE GENERATOR ENTITY" in line:
+                in_header = True
+            elif in_header:
+                stripped = line.strip()
+                if stripped.startswith("# fingerprint:"):
+                    return stripped.split(":", 1)[1].strip()
+                if stripped and not stripped.startswith("#"):
+                    return None
+
+        return None
+
+    def compute_section_edit(self, updater, entity_type, config_ids, light_configs):
+        """
+        Calcola la modifica della sezione generata in un file già aperto dalla pipeline.
+
+        Returns:
+            SectionEdit oppure None se il file è già aggiornato
+        """
+        path = updater.path
+
+        # Individua la sezione generata senza caricare il file in memoria
+        start_marker, end_marker = self.get_section_markers(entity_type)
+        start_pattern, end_pattern = self.get_section_patterns()
+        section = updater.find_section(start_pattern, end_pattern, start_marker)
+
+        # Se l'impronta della sezione coincide, il file è già aggiornato: nessuna scrittura
+        fingerprint = self.compute_fingerprint(entity_type, config_ids, light_configs)
+        if self.read_section_fingerprint(section.iter_lines()) == fingerprint:
+            self.log(f"ℹ️ {entity_type}: configurazione invariata ({fingerprint}), {path} non modificato", level="DEBUG")
+            return None
+
+        # Leggi le entità esistenti nella sezione generata
+        existing_generated_ids = set()
+        if section.found:
+            existing_generated_ids = self.read_existing_ids(updater, section, start_pattern, entity_type)
+
+        # Determina operazioni necessarie
+        ids_to_add = config_ids - existing_generated_ids
+        ids_to_remove = existing_generated_ids - config_ids
+
+        self.log(f"📊 {entity_type}: da aggiungere {len(ids_to_add)}, da rimuovere {len(ids_to_remove)}", level="INFO")
+
+        # File lasciato dal cambio di modalità senza contenuto: un blocco "lights:" vuoto o un file
+        # vuoto valgono null e HA li rifiuta finché l'!include è attivo, quindi si scrive una lista vuota
+        templates = entity_type in ("template_lights", "template_compact")
+        outside = self.structural_lines(updater, section) if templates else None
+        if templates and not config_ids and outside in (["- platform: template", "lights:"], []):
+            self.log(f"📋 Nessuna luce generata: {path} diventa una lista vuota", level="INFO")
+            return SectionEdit(0, updater.size, self.render_empty_list_file(entity_type), replaces_file=True,
+                               removed=len(ids_to_remove))
+
+        # Lista vuota lasciata dall'altra modalità: si riparte dalla struttura base
+        is_empty_stub = outside == ["[]"]
+
+        # Se non ci sono cambiamenti, esci (a meno che la sezione debba solo aggiornare l'impronta)
+        if not ids_to_add and not ids_to_remove and (not section.found or not config_ids):
+            self.log(f"ℹ️ Nessuna modifica necessaria per {path}", level="DEBUG")
+            return None
+
+        # Genera i nuovi blocchi
+        new_blocks = []
+        block_ids = []
+        compact_lights = []
+        if config_ids:  # Solo se ci sono configurazioni
+            for cfg in light_configs:
+                light_entity = cfg.get("light_entity", "").strip()
+                if not light_entity:
+                    continue
+
+                base_id = light_entity.split(".")[-1] if "." in light_entity else light_entity
+                normalized_base_id = base_id.lower().replace(" ", "_")
+
+                if entity_type == "input_boolean":
+                    template_id = f"{normalized_base_id}_template_state"
+                    if template_id in config_ids:
+                        new_blocks.append(self.generate_input_boolean_block(template_id, base_id))
+                        block_ids.append(template_id)
+                elif entity_type == "template_compact":
+                    light_id = f"{normalized_base_id}_template_light"
+                    if light_id in config_ids:
+                        compact_lights.append((light_id, f"{normalized_base_id}_template_state", base_id))
+                else:  # template_lights
+                    light_id = f"{normalized_base_id}_template_light"
+                    if light_id in config_ids:
                         template_id = f"{normalized_base_id}_template_state"
-                        if template_id in config_ids:
-                            new_blocks.append(self.generate_input_boolean_block(template_id, base_id))
-                    else:  # template_lights
-                        light_id = f"{normalized_base_id}_template_light"
-                        if light_id in config_ids:
-                            template_id = f"{normalized_base_id}_template_state"
-                            new_blocks.append(self.generate_template_light_block(light_id, normalized_base_id, template_id, base_id))
-
-            # Ricostruisci il contenuto
-            new_content = self.rebuild_file_content(content, entity_type, new_blocks, start_idx, end_idx)
-
-            # Scrivi il file
-            with open(path, "w", encoding="utf-8") as f:
-                f.write("\n".join(new_content).rstrip() + "\n")
-            
-            self.log(f"📄 File {path} aggiornato correttamente", level="INFO")
+                        new_blocks.append(self.generate_template_light_block(light_id, normalized_base_id, template_id, base_id))
+                        block_ids.append(light_id)
+
+            if compact_lights:
+                # Un solo blocco condiviso: trigger comune e tutte le luci
+                new_blocks.append(self.generate_compact_template_block(compact_lights))
+
+        # Costruisci solo la sezione generata
+        new_section = self.render_generated_section(entity_type, new_blocks, fingerprint)
+
+        section_text = "\n".join(new_section) + "\n" if new_section else ""
+
+        # Blocchi mantenuti ma riscritti con un contenuto diverso
+        changed = 0
+        kept_ids = config_ids & existing_generated_ids
+        if kept_ids:
+            existing_blocks = self.extract_blocks_from_section(section.iter_lines(), entity_type)
+            if entity_type == "template_compact":
+                # Blocco unico: se cambia, cambiano tutte le luci mantenute
+                if existing_blocks.get(None) != self.normalize_block("\n".join(new_blocks), entity_type):
+                    changed = len(kept_ids)
+            else:
+                changed = sum(
+                    1 for entity_id, block in zip(block_ids, new_blocks)
+                    if entity_id in kept_ids and existing_blocks.get(entity_id) != self.normalize_block(block, entity_type)
+                )
+        counts = {"added": len(ids_to_add), "removed": len(ids_to_remove), "changed": changed}
+
+        def after_write(written_updater):
+            roundtrip = self.get_yaml_roundtrip()
+            if roundtrip is not None and entity_type != "template_compact":
+                # Modalità round-trip: la modifica si applica anche all'albero in cache
+                roundtrip.apply_edits(written_updater, start_pattern, dict(zip(block_ids, new_blocks)), ids_to_remove)
+
+        if (not updater.has_meaningful_content() or is_empty_stub) and not section.found:
+            # File vuoto o inesistente: header decorativo, struttura base e sezione
+            self.log(f"📋 Creo il file {path} con struttura base", level="INFO")
+            content = self.create_empty_file_structure(entity_type)
+            insert_pos = self.find_insertion_point(content, entity_type)
+            content = content[:insert_pos] + new_section + content[insert_pos:]
+            return SectionEdit(0, updater.size, "\n".join(content).rstrip() + "\n", section_text,
+                               replaces_file=True, after_write=after_write, **counts)
+
+        # I byte prima e dopo la sezione vengono copiati direttamente dal file sorgente
+        if section.found:
+            return SectionEdit(section.start, section.end, section_text, after_write=after_write, **counts)
 
-        except Exception as e:
-            self.log(f"❌ Errore durante l'elaborazione di {path}: {str(e)}", level="ERROR")
+        offset = self.find_insertion_offset(updater, entity_type)
+        return SectionEdit(offset, offset, section_text, after_write=after_write, **counts)
 
     def create_empty_file_structure(self, entity_type):
         """Crea la struttura base per un file vuoto"""
@@ -137,6 +350,14 @@ class LightTemplateGenerator(hass.Hass):
                 "- platform: template",
                 "  lights:"
             ]
+        elif entity_type == "template_compact":
+            return [
+                "################################################################################",
+                "#                                                                              #",
+                "#                                  TEMPLATES                                   #",
+                "#                                                                              #",
+                "################################################################################"
+            ]
         else:  # input_boolean
             return [
                 "################################################################################",
@@ -146,6 +367,20 @@ class LightTemplateGenerator(hass.Hass):
                 "################################################################################"
             ]
 
+    def render_empty_list_file(self, entity_type):
+        """File senza luci generate: header e lista vuota (configurazione valida per HA)"""
+        header = self.create_empty_file_structure(entity_type)[:5]
+        other = "templates.yaml" if entity_type == "template_lights" else "lights.yaml"
+        return "\n".join(header + [f"# Nessuna luce generata in questo file (vedi {other})", "[]"]) + "\n"
+
+    def structural_lines(self, updater, section):
+        """Righe significative (non vuote e non commenti) del file fuori dalla sezione generata"""
+        if section.found:
+            lines = list(updater.iter_lines(0, section.start)) + list(updater.iter_lines(section.end))
+        else:
+            lines = updater.iter_lines()
+        return [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+
     def get_section_markers(self, entity_type):
         """Restituisce i marcatori di inizio e fine sezione"""
         if entity_type == "template_lights":
@@ -157,29 +392,34 @@ class LightTemplateGenerator(hass.Hass):
         
         return start_marker, end_marker
 
-    def find_generated_section(self, content, start_marker, end_marker):
-        """Trova la sezione generata automaticamente"""
-        start_idx = -1
-        end_idx = -1
-        
-        # Cerca i marcatori specifici per le sezioni generate
-        start_pattern = "START LIGHT TEMPLATE GENERATOR ENTITY"
-        end_pattern = "END LIGHT TEMPLATE GENERATOR ENTITY"
-        
-        for i, line in enumerate(content):
-            if start_pattern in line:
-                start_idx = i
-            elif end_pattern in line and start_idx != -1:
-                end_idx = i
-                break
-        
-        return start_idx, end_idx
+    def get_section_patterns(self):
+        """Restituisce i testi che identificano inizio e fine della sezione generata"""
+        return "START LIGHT TEMPLATE GENERATOR ENTITY", "END LIGHT TEMPLATE GENERATOR ENTITY"
+
+    def get_yaml_roundtrip(self):
+        """Restituisce l'helper round-trip (yaml_mode: roundtrip) o None in modalità testo"""
+        if not hasattr(self, "yaml_roundtrip"):
+            self.yaml_roundtrip = create_roundtrip(self, self.args.get("yaml_mode", "text"))
+        return self.yaml_roundtrip
+
+    def read_existing_ids(self, updater, section, section_id, entity_type):
+        """Legge gli ID della sezione dall'albero in cache (round-trip) o dal testo"""
+        roundtrip = self.get_yaml_roundtrip()
+        # Il blocco compatto è un unico elemento di lista: gli ID si leggono dal testo
+        if roundtrip is not None and entity_type != "template_compact":
+            try:
+                return set(roundtrip.section_blocks(updater, section, section_id))
+            except Exception as e:
+                self.log(f"⚠️ Analisi round-trip di {updater.path} non riuscita ({e}), uso la modalità testo", level="WARNING")
+        return self.extract_ids_from_section(section.iter_lines(), entity_type)
 
     def extract_ids_from_section(self, section_content, entity_type):
         """Estrae gli ID delle entità dalla sezione generata"""
         ids = set()
         if entity_type == "template_lights":
             pattern = r"^\s{4}([a-zA-Z0-9_]+):"
+        elif entity_type == "template_compact":
+            pattern = r"^\s+unique_id:\s*([a-zA-Z0-9_]+)"
         else:  # input_boolean
             pattern = r"^([a-zA-Z0-9_]+):"
         
@@ -193,6 +433,30 @@ class LightTemplateGenerator(hass.Hass):
         
         return ids
 
+    def normalize_block(self, block, entity_type):
+        """Testo del blocco senza l'indentazione della sezione e senza righe vuote, per il confronto"""
+        indent = 4 if entity_type == "template_lights" else 0
+        return "\n".join(line[indent:].rstrip() if line.startswith(" " * indent) else line.rstrip()
+                         for line in block.split("\n") if line.strip())
+
+    def extract_blocks_from_section(self, section_content, entity_type):
+        """
+        Estrae il testo normalizzato dei blocchi della sezione generata: {entity_id: testo}.
+        Il blocco compatto è unico e usa la chiave None.
+        """
+        pattern = r"^\s{4}([a-zA-Z0-9_]+):" if entity_type == "template_lights" else r"^([a-zA-Z0-9_]+):"
+        blocks = {}
+        current = None
+        for line in section_content:
+            if not line.strip() or line.strip().startswith("#"):
+                continue
+            if entity_type != "template_compact":
+                match = re.match(pattern, line)
+                if match:
+                    current = match.group(1)
+            blocks.setdefault(current, []).append(line)
+        return {key: self.normalize_block("\n".join(lines), entity_type) for key, lines in blocks.items()}
+
     def generate_input_boolean_block(self, template_id, base_id):
         """Genera il blocco per un input boolean"""
         return (
@@ -217,13 +481,47 @@ class LightTemplateGenerator(hass.Hass):
             f"      entity_id: input_boolean.{template_id}"
         )
 
-    def rebuild_file_content(self, content, entity_type, new_blocks, start_idx, end_idx):
-        """Ricostruisce il contenuto del file con le nuove entità"""
+    def generate_compact_template_block(self, lights):
+        """
+        Genera il blocco template compatto: un trigger condiviso su tutti gli input boolean
+        e una template light per ogni luce, con gli stessi entity_id della modalità standard.
+
+        Args:
+            lights: Lista di tuple (light_id, template_id, base_id)
+        """
+        state_entities = "\n".join(f"        - input_boolean.{template_id}" for _, template_id, _ in lights)
+        light_blocks = "\n".join(
+            f"    - name: Luce Virtuale {base_id.capitalize()}\n"
+            f"      unique_id: {light_id}\n"
+            f"      default_entity_id: light.{light_id}\n"
+            f"      state: \"{{{{ is_state('input_boolean.{template_id}', 'on') }}}}\"\n"
+            f"      turn_on:\n"
+            f"        - action: input_boolean.turn_on\n"
+            f"          target:\n"
+            f"            entity_id: input_boolean.{template_id}\n"
+            f"      turn_off:\n"
+            f"        - action: input_boolean.turn_off\n"
+            f"          target:\n"
+            f"            entity_id: input_boolean.{template_id}"
+            for light_id, template_id, base_id in lights
+        )
+        return (
+            f"- trigger:\n"
+            f"    - trigger: state\n"
+            f"      entity_id:\n"
+            f"{state_entities}\n"
+            f"    - trigger: homeassistant\n"
+            f"      event: start\n"
+            f"    - trigger: event\n"
+            f"      event_type: event_template_reloaded\n"
+            f"  light:\n"
+            f"{light_blocks}"
+        )
+
+    def render_generated_section(self, entity_type, new_blocks, fingerprint=None):
+        """Costruisce le righe della sezione generata (lista vuota se non ci sono blocchi)"""
         if not new_blocks:
-            # Se non ci sono nuovi blocchi, rimuovi solo la sezione esistente
-            if start_idx != -1 and end_idx != -1:
-                return content[:start_idx] + content[end_idx+1:]
-            return content
+            return []
 
         # Prepara i marcatori e l'indentazione
         if entity_type == "template_lights":
@@ -245,7 +543,9 @@ class LightTemplateGenerator(hass.Hass):
         new_section.append(start_marker)
         new_section.append(start_comment)
         new_section.append(start_marker)
-        a
+        if fingerprint:
+            new_section.append(" " * indent + f"# fingerprint: {fingerprint}")
+
         # Aggiungi i blocchi delle entità
         for i, block in enumerate(new_blocks):            
             lines = block.split("\n")
@@ -266,14 +566,7 @@ class LightTemplateGenerator(hass.Hass):
         new_section.append(end_comment)
         new_section.append(end_marker)
 
-        # Determina dove inserire la nuova sezione
-        if start_idx != -1 and end_idx != -1:
-            # Sostituisci la sezione esistente
-            return content[:start_idx] + new_section + content[end_idx+1:]
-        else:
-            # Inserisci la nuova sezione alla fine del file
-            insert_pos = self.find_insertion_point(content, entity_type)
-            return content[:insert_pos] + new_section + content[insert_pos:]
+        return new_section
 
     def find_insertion_point(self, content, entity_type):
         """Trova il punto dove inserire la nuova sezione"""
@@ -287,23 +580,12 @@ class LightTemplateGenerator(hass.Hass):
             # Inserisci alla fine del file
             return len(content)
 
-    def is_file_empty_or_nonexistent(self, path):
-        """Controlla se il file non esiste o è vuoto (ignorando spazi e commenti)"""
-        if not os.path.exists(path):
-            return True
-        
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-            
-            if not content:
-                return True
-            
-            # Controlla se ci sono solo commenti e spazi
-            lines = content.split('\n')
-            meaningful_lines = [line for line in lines if line.strip() and not line.strip().startswith('#')]
-            return len(meaningful_lines) == 0
-            
-        except Exception as e:
-            self.log(f"❌ Errore controllo file vuoto {path}: {e}", level="ERROR")
-            return True
+    def find_insertion_offset(self, updater, entity_type):
+        """Trova l'offset in byte dove inserire la nuova sezione in un file esistente"""
+        if entity_type == "template_lights":
+            # Inserisci subito dopo "lights:"
+            offset = updater.find_line_end(lambda line: "lights:" in line and not line.strip().startswith("#"))
+            if offset is not None:
+                return offset
+        # Inserisci alla fine del file
+        return updater.size
@@ -0,0 +1,167 @@
+"""
+Lux Hysteresis Module for AppDaemon
+Isteresi e tempo di permanenza per banda di illuminanza, calcolati dal flusso dei campioni
+"""
+
+import threading
+import time
+
+
+class LuxHysteresis:
+    """
+    Motore di isteresi dell'illuminanza per ogni luce.
+
+    Questa classe mantiene per luce la banda confermata e:
+    - Classifica i campioni in tre bande: "dark" (sotto min_lux), "normal", "bright"
+      (sopra max_lux), con un margine di isteresi per uscire dalla banda corrente
+    - Conferma un cambio di banda solo dopo che i campioni sono rimasti nella nuova banda
+      per il tempo di permanenza (dwell); un campione che torna indietro annulla il cambio
+    - Espone la scadenza del cambio in attesa: il timer serve solo se un cambio è
+      davvero pendente e non arrivano altri campioni
+    - Sostituisce il timer di sblocco dopo l'accensione: la scadenza viene registrata
+      e valutata al primo campione successivo, con il valore in vigore alla scadenza
+
+    Con hysteresis = 0 e dwell = 0 le decisioni coincidono con i confronti diretti
+    lux < min_lux / lux > max_lux.
+    """
+
+    def __init__(self, hysteresis=0.0, dwell=0.0):
+        """
+        Inizializza il motore.
+
+        Args:
+            hysteresis: Margine in lux per uscire dalla banda corrente
+            dwell: Secondi di permanenza richiesti per confermare un cambio di banda
+        """
+        self.hysteresis = max(0.0, float(hysteresis))
+        self.dwell = max(0.0, float(dwell))
+        self.lights = {}  # {luce: stato della banda e dello sblocco}
+        self._lock = threading.Lock()
+
+    def _state(self, light_entity):
+        state = self.lights.get(light_entity)
+        if state is None:
+            state = self.lights[light_entity] = {
+                "band": None, "candidate": None, "since": 0.0,
+                "lux": None, "sampled_at": 0.0, "unlock_at": None
+            }
+        return state
+
+    def classify(self, lux, min_lux, max_lux, band):
+        """Banda del campione, con isteresi rispetto alla banda corrente"""
+        margin = self.hysteresis
+        if band == "dark" and lux < min_lux + margin:
+            return "dark"
+        if band == "bright" and lux > max_lux - margin:
+            return "bright"
+        if lux < min_lux - (margin if band is not None else 0):
+            return "dark"
+        if lux > max_lux + (margin if band is not None else 0):
+            return "bright"
+        return "normal"
+
+    def sample(self, light_entity, lux, min_lux, max_lux, now=None):
+        """
+        Registra un campione e restituisce la banda confermata.
+
+        Returns:
+            str: "dark", "normal" o "bright"
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            state = self._state(light_entity)
+            state["lux"] = lux
+            state["sampled_at"] = now
+            observed = self.classify(lux, min_lux, max_lux, state["band"])
+
+            if state["band"] is None or observed == state["band"]:
+                # Primo campione (nessuna storia) o ritorno nella banda corrente
+                state["band"] = state["band"] or observed
+                state["candidate"] = None
+            elif observed != state["candidate"]:
+                state["candidate"] = observed
+                state["since"] = now
+
+            if state["candidate"] is not None and now - state["since"] >= self.dwell:
+                state["band"] = state["candidate"]
+                state["candidate"] = None
+            return state["band"]
+
+    def pending(self, light_entity, now=None):
+        """Secondi mancanti alla conferma del cambio di banda in attesa (None se nessuno)"""
+        now = time.monotonic() if now is None else now
+        state = self.lights.get(light_entity)
+        if state is None or state["candidate"] is None:
+            return None
+        return max(0.0, state["since"] + self.dwell - now)
+
+    def last_lux(self, light_entity):
+        state = self.lights.get(light_entity)
+        return state["lux"] if state is not None else None
+
+    def arm_unlock(self, light_entity, delay, now=None):
+        """Registra la scadenza del controllo di sblocco dopo un'accensione automatica"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._state(light_entity)["unlock_at"] = now + delay
+
+    def disarm_unlock(self, light_entity):
+        with self._lock:
+            if light_entity in self.lights:
+                self.lights[light_entity]["unlock_at"] = None
+
+    def unlock_window(self, light_entity, now=None):
+        """True finché la scadenza di sblocco non è trascorsa (accensione automatica recente)"""
+        now = time.monotonic() if now is None else now
+        state = self.lights.get(light_entity)
+        return state is not None and state["unlock_at"] is not None and now < state["unlock_at"]
+
+    def take_unlock(self, light_entity, now=None):
+        """
+        Consuma la scadenza di sblocco se trascorsa.
+
+        Returns:
+            tuple: (True, lux in vigore alla scadenza o None) se da valutare, altrimenti (False, None)
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            state = self.lights.get(light_entity)
+            if state is None or state["unlock_at"] is None or now < state["unlock_at"]:
+                return False, None
+            state["unlock_at"] = None
+            return True, state["lux"]
+
+    def export(self, now=None):
+        """
+        Stato di tutte le luci per il passaggio a una nuova istanza dell'app: tempi relativi
+        (età del cambio in attesa e secondi mancanti alla scadenza di sblocco).
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return {
+                light_entity: {
+                    "band": state["band"],
+                    "candidate": state["candidate"],
+                    "pending_for": now - state["since"] if state["candidate"] is not None else None,
+                    "lux": state["lux"],
+                    "unlock_in": state["unlock_at"] - now if state["unlock_at"] is not None else None
+                }
+                for light_entity, state in self.lights.items()
+            }
+
+    def restore(self, light_entity, data, now=None):
+        """Ripristina lo stato esportato da export() per una luce"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            state = self._state(light_entity)
+            state["band"] = data.get("band")
+            state["candidate"] = data.get("candidate")
+            state["since"] = now - data["pending_for"] if data.get("pending_for") is not None else 0.0
+            state["lux"] = data.get("lux")
+            state["sampled_at"] = now
+            # Scadenza già trascorsa: resta armata e viene valutata al prossimo campione
+            state["unlock_at"] = now + max(0.0, data["unlock_in"]) if data.get("unlock_in") is not None else None
+
+    def clear(self, light_entity):
+        with self._lock:
+            self.lights.pop(light_entity, None)
@@ -0,0 +1,241 @@
+"""
+Sensor Debouncer Module for AppDaemon
+Stadio di ingresso per sensore: debounce, hold-off e rate limit prima della logica di presenza
+"""
+
+import contextlib
+import threading
+import time
+
+
+class SensorDebouncer:
+    """
+    Filtra le transizioni instabili dei sensori di presenza (PIR, mmWave).
+
+    Questa classe registra un solo listener per sensore e:
+    - Smista le transizioni stabilizzate a tutti i callback registrati sul sensore
+      (registro di dispatch, con lo stesso filtro new= di listen_state)
+    - Applica un debounce separato per on/off: la transizione viene inoltrata solo
+      se il nuovo stato resta stabile per il tempo indicato
+    - Applica hold-off e rate limit: dopo un inoltro, le transizioni successive
+      vengono rimandate e coalescenti (vince l'ultimo stato)
+    - Conta gli eventi soppressi per sensore
+    - Esegue i callback di uno stesso inoltro dentro il contesto fan_out (es. il batch
+      delle chiamate di servizio), anche quando il debounce non è configurato
+
+    Configurazione (argomento presence_debounce):
+        presence_debounce:
+          debounce_on: 0          # secondi di stabilità richiesti per "on"
+          debounce_off: 2         # secondi di stabilità richiesti per "off"
+          hold_off: 1             # secondi minimi tra due inoltri
+          rate_limit: 30          # inoltri massimi al minuto
+          binary_sensor.presenza_02_movimento:
+            debounce_off: 5       # override per singolo sensore
+    """
+
+    SETTINGS = ("debounce_on", "debounce_off", "hold_off", "rate_limit")
+
+    def __init__(self, hass_instance, config=None, fan_out=None, sensor="sensor.light_presence_debounce"):
+        """
+        Inizializza lo stadio di debounce.
+
+        Args:
+            hass_instance: Istanza dell'app AppDaemon (listen_state, run_in, get_state, log)
+            config: Dizionario presence_debounce (None = disattivato)
+            fan_out: Factory di un context manager che racchiude il dispatch ai callback
+            sensor: Sensore riepilogativo pubblicato da publish()
+        """
+        self.hass = hass_instance
+        config = config or {}
+        self.configured = bool(config)
+        self.enabled = self.configured
+        self.defaults = {key: float(config.get(key, 0)) for key in self.SETTINGS}
+        self.overrides = {key: value for key, value in config.items() if "." in key and isinstance(value, dict)}
+        self.fan_out = fan_out or contextlib.nullcontext
+        self.sensor = sensor
+        self.sensors = {}  # {sensore: stato del filtro}
+        self._lock = threading.Lock()
+
+    def settings(self, sensor):
+        """Parametri effettivi del sensore (default + override)"""
+        settings = dict(self.defaults)
+        for key, value in self.overrides.get(sensor, {}).items():
+            if key in self.SETTINGS:
+                settings[key] = float(value)
+        return settings
+
+    def register(self, callback, sensor, new=None, **kwargs):
+        """
+        Registra un callback sul sensore; il listener reale viene creato una sola volta.
+
+        Il callback riceve (entity, attribute, old, new, kwargs) come con listen_state,
+        dove old/new sono gli stati stabilizzati.
+
+        Returns:
+            tuple: Riferimento da passare a unregister
+        """
+        with self._lock:
+            state = self.sensors.get(sensor)
+            if state is None:
+                state = {
+                    "settings": self.settings(sensor),
+                    "callbacks": [],
+                    "settled": self.hass.get_state(sensor),
+                    "raw": None,
+                    "raw_since": 0.0,
+                    "last_emit": 0.0,
+                    "timer": None,
+                    "emit_times": [],
+                    "counters": {"raw": 0, "emitted": 0, "suppressed_debounce": 0, "suppressed_rate": 0}
+                }
+                state["raw"] = state["settled"]
+                self.sensors[sensor] = state
+                create_listener = True
+            else:
+                create_listener = False
+            entry = (callback, new, kwargs)
+            state["callbacks"].append(entry)
+
+        if create_listener:
+            self.hass.listen_state(self.raw_changed, sensor)
+        return ("debounce", sensor, entry)
+
+    def unregister(self, token):
+        """Rimuove un callback registrato (il listener reale del sensore resta attivo)"""
+        _, sensor, entry = token
+        with self._lock:
+            callbacks = self.sensors.get(sensor, {}).get("callbacks", [])
+            for index, registered in enumerate(callbacks):
+                if registered is entry:
+                    del callbacks[index]
+                    break
+
+    def raw_changed(self, entity, attribute, old, new, kwargs):
+        """Transizione grezza del sensore: inoltro immediato o rinvio fino alla stabilità"""
+        if old == new:
+            return
+
+        state = self.sensors[entity]
+        now = time.monotonic()
+        with self._lock:
+            state["counters"]["raw"] += 1
+            if state["timer"] is not None:
+                # Transizione arrivata prima che la precedente si stabilizzasse
+                self._cancel(state)
+                state["counters"]["suppressed_debounce"] += 1
+            state["raw"] = new
+            state["raw_since"] = now
+
+            if not self.enabled:
+                emit = new != state["settled"]
+                delay = 0
+            else:
+                delay = self._delay(state, new, now)
+                emit = delay <= 0 and new != state["settled"]
+                if delay > 0:
+                    state["timer"] = self.hass.run_in(self.settle, delay, sensor=entity)
+
+        if emit:
+            self._emit(entity, state, now)
+
+    def settle(self, kwargs):
+        """Scadenza del rinvio: inoltra l'ultimo stato grezzo se diverso da quello stabilizzato"""
+        entity = kwargs["sensor"]
+        state = self.sensors[entity]
+        now = time.monotonic()
+        with self._lock:
+            state["timer"] = None
+            delay = self._delay(state, state["raw"], now)
+            if delay > 0:
+                # Finestra di hold-off/rate limit non ancora trascorsa
+                state["timer"] = self.hass.run_in(self.settle, delay, sensor=entity)
+                return
+            emit = state["raw"] != state["settled"]
+
+        if emit:
+            self._emit(entity, state, now)
+
+    def _delay(self, state, new, now):
+        """Secondi mancanti prima di poter inoltrare lo stato new (0 = subito)"""
+        settings = state["settings"]
+        debounce = settings["debounce_on"] if new == "on" else settings["debounce_off"]
+        wait = state["raw_since"] + debounce - now
+
+        if state["last_emit"]:
+            wait = max(wait, state["last_emit"] + settings["hold_off"] - now)
+
+        if settings["rate_limit"] > 0:
+            window = [t for t in state["emit_times"] if now - t < 60]
+            state["emit_times"] = window
+            if len(window) >= settings["rate_limit"]:
+                wait = max(wait, window[0] + 60 - now)
+                state["counters"]["suppressed_rate"] += 1
+
+        return wait if wait > 0.001 else 0
+
+    def _emit(self, entity, state, now):
+        """Inoltra la transizione stabilizzata ai callback registrati"""
+        with self._lock:
+            old = state["settled"]
+            new = state["raw"]
+            if old == new:
+                return
+            state["settled"] = new
+            state["last_emit"] = now
+            state["emit_times"].append(now)
+            state["counters"]["emitted"] += 1
+            callbacks = list(state["callbacks"])
+
+        with self.fan_out():
+            for callback, new_filter, kwargs in callbacks:
+                if new_filter is None or new_filter == new:
+                    callback(entity, "state", old, new, dict(kwargs))
+
+    def _cancel(self, state):
+        if self.hass.timer_running(state["timer"]):
+            self.hass.cancel_timer(state["timer"])
+        state["timer"] = None
+
+    def set_enabled(self, enabled):
+        """Da spento i sensori registrati passano le transizioni senza filtro"""
+        self.enabled = bool(enabled)
+        self.hass.log(f"🧹 Debounce sensori {'attivato' if self.enabled else 'disattivato'}", level="INFO")
+
+    def reset(self):
+        with self._lock:
+            for state in self.sensors.values():
+                for key in state["counters"]:
+                    state["counters"][key] = 0
+
+    def stats(self):
+        """Contatori per sensore"""
+        with self._lock:
+            return {sensor: dict(state["counters"]) for sensor, state in self.sensors.items()}
+
+    def publish(self):
+        """Pubblica i contatori in un sensore riepilogativo (solo con presence_debounce configurato)"""
+        stats = self.stats()
+        if not stats or not self.configured:
+            return
+        suppressed = sum(c["raw"] - c["emitted"] for c in stats.values())
+        self.hass.set_state(
+            self.sensor,
+            state=max(0, suppressed),
+            attributes={
+                "enabled": self.enabled,
+                "sensors": stats,
+                "unit_of_measurement": "eventi",
+                "friendly_name": "Eventi presenza soppressi"
+            }
+        )
+
+    def dump(self):
+        """Scrive nel log i contatori per sensore"""
+        self.hass.log(f"🧹 DEBOUNCE SENSORI ({'attivo' if self.enabled else 'spento'})", level="INFO")
+        for sensor, counters in sorted(self.stats().items()):
+            self.hass.log(
+                f"  - {sensor}: {counters['raw']} grezzi, {counters['emitted']} inoltrati, "
+                f"{counters['suppressed_debounce']} soppressi (debounce), "
+                f"{counters['suppressed_rate']} rinviati (hold-off/rate limit)",
+                level="INFO"
+            )
@@ -0,0 +1,106 @@
+"""
+Service Batcher Module for AppDaemon
+Raggruppa le chiamate turn_on/turn_off emesse nello stesso evento in una chiamata per servizio
+"""
+
+import contextlib
+import threading
+
+
+class ServiceBatcher:
+    """
+    Fan-out delle chiamate di servizio per le luci che condividono un sensore di presenza.
+
+    Questa classe raccoglie le chiamate di un intervallo di dispatch e:
+    - Accumula turn_on/turn_off per entità mentre un batch è aperto nel thread corrente
+      (le chiamate fuori da un batch passano direttamente)
+    - Tiene solo l'ultima azione per entità (vince l'ultima, senza duplicati)
+    - Alla chiusura invia una chiamata per dominio/azione/parametri con la lista entity_id,
+      o la chiamata singola se l'entità è una sola
+    - Conta batch, entità e chiamate risparmiate
+
+    Uso:
+        with self.batcher.collect():
+            ...  # callback di tutte le luci dello stesso sensore
+    """
+
+    def __init__(self, hass_instance, enabled=True, send=None):
+        """
+        Inizializza il batcher.
+
+        Args:
+            hass_instance: Istanza dell'app AppDaemon (call_service, log)
+            enabled: Se False le chiamate passano sempre direttamente
+            send: Callable(domain, action, entities, params) che esegue un gruppo
+                  (default: call_service immediata)
+        """
+        self.hass = hass_instance
+        self.enabled = enabled
+        self.send = send or self._call_service
+        self.counters = {"batches": 0, "entities": 0, "calls": 0, "calls_saved": 0}
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def collect(self):
+        """Apre un batch nel thread corrente (annidabile: invia solo il più esterno)"""
+        if not self.enabled or getattr(self._local, "pending", None) is not None:
+            yield
+            return
+
+        self._local.pending = {}
+        try:
+            yield
+        finally:
+            pending, self._local.pending = self._local.pending, None
+            self.flush(pending)
+
+    def add(self, action, entity_id, kwargs):
+        """
+        Accoda l'azione se è aperto un batch.
+
+        Returns:
+            bool: True se accodata, False se va eseguita direttamente
+        """
+        pending = getattr(self._local, "pending", None)
+        if pending is None or not isinstance(entity_id, str) or "." not in entity_id:
+            return False
+        try:
+            params = tuple(sorted(kwargs.items()))
+            hash(params)
+        except TypeError:
+            return False
+
+        # Vince l'ultima azione per entità
+        pending.pop(entity_id, None)
+        pending[entity_id] = (action, params)
+        return True
+
+    def flush(self, pending):
+        """Invia le azioni accodate raggruppate per dominio, azione e parametri"""
+        if not pending:
+            return
+
+        groups = {}
+        for entity_id, (action, params) in pending.items():
+            domain = entity_id.split(".", 1)[0]
+            groups.setdefault((domain, action, params), []).append(entity_id)
+
+        self.counters["batches"] += 1
+        self.counters["entities"] += len(pending)
+        self.counters["calls"] += len(groups)
+        self.counters["calls_saved"] += len(pending) - len(groups)
+
+        for (domain, action, params), entities in groups.items():
+            self.send(domain, action, entities, params)
+            if len(entities) > 1:
+                self.hass.log(f"📦 {domain}/{action} in blocco: {', '.join(entities)}", level="DEBUG")
+
+    def _call_service(self, domain, action, entities, params):
+        entity_id = entities[0] if len(entities) == 1 else entities
+        try:
+            self.hass.call_service(f"{domain}/{action}", entity_id=entity_id, **dict(params))
+        except Exception as e:
+            self.hass.log(f"❌ Errore chiamata {domain}/{action} per {entity_id}: {e}", level="ERROR")
+
+    def stats(self):
+        return dict(self.counters)
@@ -0,0 +1,120 @@
+"""
+Temperature Cache Module for AppDaemon
+Cache LRU limitata con scadenza (TTL) per le letture dei sensori di temperatura
+"""
+
+import time
+from collections import OrderedDict
+
+
+class TemperatureCache:
+    """
+    Cache LRU con dimensione massima e scadenza temporale per AppDaemon.
+
+    Questa classe fornisce una cache per le letture dei sensori che:
+    - Mantiene al massimo max_size voci, eliminando quelle usate meno di recente
+    - Considera scadute le voci più vecchie di ttl secondi
+    - Conta hit, miss, scadenze ed eliminazioni per il monitoraggio
+    - Usa un orologio monotono, immune ai cambi di ora di sistema
+    """
+
+    def __init__(self, max_size=64, ttl=900):
+        """
+        Inizializza la cache.
+
+        Args:
+            max_size: Numero massimo di voci mantenute in cache
+            ttl: Durata di validità di una voce in secondi
+        """
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl)
+        self.entries = OrderedDict()  # {key: (value, timestamp)}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def get(self, key):
+        """
+        Restituisce il valore in cache se presente e non scaduto.
+
+        Args:
+            key: Chiave della voce (entity_id del sensore)
+
+        Returns:
+            Il valore memorizzato, oppure None se assente o scaduto
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, timestamp = entry
+        if time.monotonic() - timestamp > self.ttl:
+            # Voce scaduta: la rimuove e la conta come miss
+            del self.entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Memorizza un valore aggiornandone il timestamp.
+
+        Args:
+            key: Chiave della voce
+            value: Valore da memorizzare
+        """
+        self.entries[key] = (value, time.monotonic())
+        self.entries.move_to_end(key)
+
+        # Elimina le voci usate meno di recente oltre la dimensione massima
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+    def invalidate(self, key):
+        """
+        Rimuove una voce dalla cache (es. sensore non disponibile).
+
+        Args:
+            key: Chiave della voce
+
+        Returns:
+            bool: True se la voce era presente, False altrimenti
+        """
+        return self.entries.pop(key, None) is not None
+
+    def clear(self):
+        """Svuota la cache mantenendo i contatori."""
+        self.entries.clear()
+
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and time.monotonic() - entry[1] <= self.ttl
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_stats(self):
+        """
+        Restituisce le statistiche della cache.
+
+        Returns:
+            dict: Dimensione, hit, miss, scadenze, eliminazioni e hit ratio
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+        }
@@ -3,6 +3,8 @@ Timer Manager Module for AppDaemon
 Gestisce timer con controllo generazionale per evitare esecuzioni spurie
 """
 
+import time
+
 class TimerManager:
     """
     Gestisce timer con controllo generazionale per AppDaemon.
@@ -12,6 +14,7 @@ class TimerManager:
     - Gestisce automaticamente la cancellazione e il cleanup
     - Supporta due tipi di timer: normali e filter
     - Usa un sistema di generazioni per tracciare la validità dei timer
+    - Esporta i timer attivi con il tempo residuo, per ricrearli dopo un ricaricamento
     """
     
     def __init__(self, hass_instance):
@@ -25,6 +28,7 @@ class TimerManager:
         self.timers = {}        # {key: (handle, generation)}
         self.filter_timers = {} # {key: (handle, generation)}
         self.generations = {}   # {key: generation}
+        self.details = {}       # {(key, is_filter): callback, scadenza e argomenti}
 
     def start_timer(self, key, delay, callback, is_filter=False, *args, **kwargs):
         """
@@ -58,6 +62,13 @@ class TimerManager:
             self.filter_timers[key] = (handle, current_gen)
         else:
             self.timers[key] = (handle, current_gen)
+
+        self.details[(key, is_filter)] = {
+            "callback": callback,
+            "deadline": time.monotonic() + delay,
+            "args": args,
+            "kwargs": kwargs
+        }
             
         return handle
 
@@ -103,6 +114,7 @@ class TimerManager:
         
         if key in target:
             handle, gen = target.pop(key)
+            self.details.pop((key, is_filter), None)
             # Incrementa la generazione per invalidare eventuali timer in esecuzione
             self.generations[key] = self.generations.get(key, 0) + 1
             
@@ -145,6 +157,7 @@ class TimerManager:
         target = self.filter_timers if is_filter else self.timers
         if key in target:
             del target[key]
+            self.details.pop((key, is_filter), None)
             self.hass.log(f"Cleanup timer {key}", level="DEBUG")
 
     def is_timer_active(self, key, is_filter=False):
@@ -178,6 +191,33 @@ class TimerManager:
         else:
             return list(self.timers.keys())
 
+    def snapshot(self, keys=None):
+        """
+        Esporta i timer attivi per ricrearli su una nuova istanza dell'app.
+        
+        Args:
+            keys: Chiavi da esportare (None per tutte)
+            
+        Returns:
+            list: Dizionari con key, is_filter, nome del callback, tempo residuo e argomenti
+        """
+        now = time.monotonic()
+        exported = []
+        for (key, is_filter), detail in self.details.items():
+            if keys is not None and key not in keys:
+                continue
+            if not self.is_timer_active(key, is_filter):
+                continue
+            exported.append({
+                "key": key,
+                "is_filter": is_filter,
+                "callback": detail["callback"].__name__,
+                "remaining": max(0.0, detail["deadline"] - now),
+                "args": detail["args"],
+                "kwargs": dict(detail["kwargs"])
+            })
+        return exported
+
     def cancel_all_timers(self, is_filter=None):
         """
         Cancella tutti i timer.
@@ -0,0 +1,403 @@
+"""
+YAML File Updater Module for AppDaemon
+Aggiornamento atomico e sincronizzato dei file YAML condivisi tra più generatori
+"""
+
+import io
+import mmap
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Piattaforme senza fcntl: resta solo il lock di processo
+    fcntl = None
+
+
+class YamlFileUpdater:
+    """
+    Aggiorna un file YAML condiviso in modo sicuro per AppDaemon.
+
+    Questa classe fornisce un componente di scrittura comune ai generatori che:
+    - Serializza gli aggiornamenti con un lock di processo e un lock consultivo (flock)
+      su un file .lock affiancato, valido anche tra processi diversi
+    - Mappa il file in memoria (mmap) una sola volta e legge solo ciò che serve
+    - Sostituisce una sezione copiando i byte prima e dopo direttamente dal file sorgente:
+      solo la sezione generata viene costruita in memoria, qualunque sia la dimensione del file
+    - Scrive su un file temporaneo nella stessa directory, esegue fsync e lo rinomina
+      atomicamente sul file di destinazione: Home Assistant non vede mai un file a metà
+    - Non scrive nulla se il nuovo contenuto coincide con quello esistente
+
+    Uso:
+        with YamlFileUpdater(path, self) as updater:
+            section = updater.find_section(start_pattern, end_pattern, frame_line)
+            ...
+            updater.splice([(section.start, section.end, new_section_text)])
+    """
+
+    _process_locks = {}
+    _process_locks_guard = threading.Lock()
+
+    def __init__(self, path, hass_instance=None, encoding="utf-8", read_only=False):
+        """
+        Inizializza l'updater.
+
+        Args:
+            path: Percorso del file YAML da aggiornare
+            hass_instance: Istanza dell'app AppDaemon usata per il logging (opzionale)
+            encoding: Codifica del file
+            read_only: Sola lettura (dry-run): nessuna directory, file .lock o scrittura su disco
+        """
+        self.path = path
+        self.hass = hass_instance
+        self.encoding = encoding
+        self.read_only = read_only
+        self.lock_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.lock")
+        self.exists = False
+        self.written = False
+        self._source = None
+        self._mm = None
+        self._lock_file = None
+        self._process_lock = self._get_process_lock(path)
+        self._holds_process_lock = False
+
+    @classmethod
+    def _get_process_lock(cls, path):
+        """Restituisce il lock di processo associato al percorso (uno per file)"""
+        key = os.path.abspath(path)
+        with cls._process_locks_guard:
+            if key not in cls._process_locks:
+                cls._process_locks[key] = threading.Lock()
+            return cls._process_locks[key]
+
+    def __enter__(self):
+        if not self.read_only:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        self._process_lock.acquire()
+        self._holds_process_lock = True
+        try:
+            if not self.read_only:
+                self._lock_file = open(self.lock_path, "a")
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+
+            # Apre il file sorgente dopo aver preso il lock: legge lo stato più recente
+            if os.path.exists(self.path):
+                self._source = open(self.path, "rb")
+                self.exists = True
+                if os.fstat(self._source.fileno()).st_size > 0:
+                    self._mm = mmap.mmap(self._source.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._release()
+            raise
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._release()
+        return False
+
+    def _release(self):
+        """Chiude il file sorgente e rilascia i lock"""
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+        if self._lock_file is not None:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            finally:
+                self._lock_file.close()
+                self._lock_file = None
+
+        if self._holds_process_lock:
+            self._holds_process_lock = False
+            self._process_lock.release()
+
+    @property
+    def size(self):
+        """Dimensione in byte del file sorgente"""
+        return len(self._mm) if self._mm is not None else 0
+
+    def iter_lines(self, start=0, end=None):
+        """
+        Itera le righe del file (senza terminatori) leggendole dalla mappa in memoria.
+
+        Args:
+            start: Offset in byte da cui iniziare (inizio di una riga)
+            end: Offset in byte a cui fermarsi (default: fine del file)
+        """
+        for line_start, line_end in self.iter_line_offsets(start, end):
+            yield self._decode(line_start, line_end)
+
+    def iter_line_offsets(self, start=0, end=None):
+        """
+        Itera gli offset (inizio, fine) di ogni riga, fine esclusa e senza terminatore.
+        """
+        if self._mm is None:
+            return
+
+        end = self.size if end is None else end
+        position = start
+        while position < end:
+            newline = self._mm.find(b"\n", position, end)
+            line_end = end if newline == -1 else newline
+            yield position, line_end
+            position = line_end + 1
+
+    def read_bytes(self):
+        """Restituisce il contenuto attuale del file (bytes vuoti se non esiste)"""
+        return self._mm_slice(0, self.size)
+
+    def read_lines(self):
+        """
+        Restituisce tutte le righe del file (senza terminatori di riga).
+
+        Returns:
+            list: Righe del file, lista vuota se il file non esiste
+        """
+        return list(self.iter_lines())
+
+    def has_meaningful_content(self):
+        """
+        Verifica se il file contiene almeno una riga che non sia vuota o un commento.
+        Si ferma alla prima riga significativa.
+        """
+        for line in self.iter_lines():
+            stripped = line.strip()
+            if stripped and not stripped.startswith("#"):
+                return True
+        return False
+
+    def find_section(self, start_pattern, end_pattern, frame_line=None):
+        """
+        Individua una sezione generata delimitata dai commenti start_pattern/end_pattern.
+
+        La sezione comprende anche la cornice (frame_line) sopra il commento di inizio,
+        l'eventuale riga vuota che la precede e la cornice sotto il commento di fine.
+
+        Returns:
+            FileSection: Sezione trovata (found=False se assente o non chiusa)
+        """
+        section = FileSection(self)
+        if self._mm is None:
+            return section
+
+        start_hit = self._mm.find(start_pattern.encode(self.encoding))
+        if start_hit == -1:
+            return section
+
+        end_hit = self._mm.find(end_pattern.encode(self.encoding), start_hit)
+        if end_hit == -1:
+            return section
+
+        start = self._line_start(start_hit)
+        end = self._line_end(end_hit)
+
+        if frame_line is not None:
+            # Include la cornice superiore e la riga vuota che la precede
+            previous = self._previous_line_start(start)
+            if previous is not None and self._decode(previous, start - 1).rstrip() == frame_line.rstrip():
+                start = previous
+                previous = self._previous_line_start(start)
+                if previous is not None and not self._decode(previous, start - 1).strip():
+                    start = previous
+
+            # Include la cornice inferiore
+            if end < self.size:
+                next_end = self._line_end(end)
+                if self._decode(end, next_end).rstrip("\r\n").rstrip() == frame_line.rstrip():
+                    end = next_end
+
+        section.found = True
+        section.start = start
+        section.end = end
+        return section
+
+    def line_number(self, offset):
+        """Numero di riga (da 0) che contiene l'offset indicato"""
+        if self._mm is None:
+            return 0
+        return self._mm[:offset].count(b"\n")
+
+    def find_line_end(self, predicate):
+        """
+        Restituisce l'offset subito dopo la prima riga che soddisfa predicate, oppure None.
+        La scansione si ferma alla prima corrispondenza.
+        """
+        for line_start, line_end in self.iter_line_offsets():
+            if predicate(self._decode(line_start, line_end)):
+                return min(line_end + 1, self.size)
+        return None
+
+    def splice(self, edits):
+        """
+        Applica le sostituzioni copiando i byte non modificati direttamente dal file sorgente.
+
+        Args:
+            edits: Lista di tuple (start, end, text): i byte [start, end) vengono sostituiti da text
+
+        Returns:
+            bool: True se il file è stato scritto, False se il contenuto era già identico
+        """
+        if self.read_only:
+            raise RuntimeError(f"{self.path} aperto in sola lettura")
+
+        edits = self._prepare_edits(edits)
+        if self.exists and all(self._mm_slice(start, end) == data for start, end, data in edits):
+            self._log(f"Contenuto invariato, nessuna scrittura su {self.path}")
+            return False
+
+        self._atomic_write(lambda tmp: self._write_spliced(tmp, edits))
+        return True
+
+    def render(self, edits):
+        """
+        Restituisce il contenuto (bytes) che splice scriverebbe, senza toccare il disco.
+
+        Args:
+            edits: Lista di tuple (start, end, text) come per splice
+        """
+        buffer = io.BytesIO()
+        self._write_spliced(buffer, self._prepare_edits(edits))
+        return buffer.getvalue()
+
+    def _prepare_edits(self, edits):
+        # Ordinamento stabile: a parità di posizione resta l'ordine dei contributi
+        return sorted(
+            ((start, end, text.encode(self.encoding)) for start, end, text in edits),
+            key=lambda edit: (edit[0], edit[1])
+        )
+
+    def _write_spliced(self, output, edits):
+        """Scrive su output il file sorgente con le sostituzioni applicate"""
+        position = 0
+        last_byte = b"\n"
+        with memoryview(self._mm if self._mm is not None else b"") as view:
+            for start, end, data in edits:
+                if start > position:
+                    output.write(view[position:start])
+                    last_byte = bytes(view[start - 1:start])
+                # Inserimento in coda a un file senza newline finale
+                if start == self.size and last_byte != b"\n" and data:
+                    output.write(b"\n")
+                if data:
+                    output.write(data)
+                    last_byte = data[-1:]
+                position = max(position, end)
+            if position < self.size:
+                output.write(view[position:])
+
+    def _mm_slice(self, start, end):
+        return self._mm[start:end] if self._mm is not None else b""
+
+    def _decode(self, start, end):
+        return self._mm[start:end].decode(self.encoding).rstrip("\r")
+
+    def _line_start(self, offset):
+        return self._mm.rfind(b"\n", 0, offset) + 1
+
+    def _line_end(self, offset):
+        """Offset subito dopo il terminatore della riga che contiene offset"""
+        newline = self._mm.find(b"\n", offset)
+        return self.size if newline == -1 else newline + 1
+
+    def _previous_line_start(self, line_start):
+        if line_start <= 0:
+            return None
+        return self._line_start(line_start - 1)
+
+    def write_lines(self, lines):
+        """
+        Riscrive l'intero file in modo atomico (usato per file nuovi o vuoti).
+
+        Args:
+            lines: Lista di righe (senza terminatori)
+
+        Returns:
+            bool: True se il file è stato scritto, False se il contenuto era già identico
+        """
+        if self.read_only:
+            raise RuntimeError(f"{self.path} aperto in sola lettura")
+
+        data = ("\n".join(lines).rstrip() + "\n").encode(self.encoding)
+
+        if self.exists and self._mm_slice(0, self.size) == data:
+            self._log(f"Contenuto invariato, nessuna scrittura su {self.path}")
+            return False
+
+        self._atomic_write(lambda tmp: tmp.write(data))
+        return True
+
+    def _atomic_write(self, write_content):
+        """
+        Scrive su un file temporaneo, esegue fsync e lo rinomina sul file di destinazione.
+
+        Args:
+            write_content: Funzione che riceve il file temporaneo (binario) e ne scrive il contenuto
+        """
+        directory = os.path.dirname(self.path) or "."
+        mode = os.stat(self.path).st_mode & 0o777 if os.path.exists(self.path) else 0o644
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(self.path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                write_content(tmp)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self._fsync_directory(directory)
+        self.written = True
+        self._log(f"Scrittura atomica completata su {self.path}")
+
+    def _fsync_directory(self, directory):
+        """Rende persistente la rinomina sincronizzando la directory"""
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+
+    def _log(self, message):
+        if self.hass is not None:
+            self.hass.log(message, level="DEBUG")
+
+
+class FileSection:
+    """
+    Posizione di una sezione generata all'interno di un file gestito da YamlFileUpdater.
+
+    Attributi:
+        found: True se la sezione è presente nel file
+        start, end: Offset in byte [start, end) della sezione, cornici incluse
+    """
+
+    def __init__(self, updater):
+        self.updater = updater
+        self.found = False
+        self.start = -1
+        self.end = -1
+
+    def iter_lines(self):
+        """Itera le righe della sezione senza caricare il resto del file"""
+        if not self.found:
+            return iter(())
+        return self.updater.iter_lines(self.start, self.end)
@@ -0,0 +1,235 @@
+"""
+YAML Round-Trip Module for AppDaemon
+Modalità strutturata per i generatori: albero YAML con commenti, in cache per file
+"""
+
+import hashlib
+import io
+import os
+import threading
+
+try:
+    from ruamel.yaml import YAML
+    ROUNDTRIP_AVAILABLE = True
+except ImportError:  # ruamel.yaml non installato: i generatori restano in modalità testo
+    YAML = None
+    ROUNDTRIP_AVAILABLE = False
+
+
+class RoundTripYaml:
+    """
+    Gestisce la lettura strutturata dei file YAML generati per AppDaemon.
+
+    Questa classe fornisce ai generatori un'alternativa alla scansione riga per riga che:
+    - Analizza il file una sola volta in un albero round-trip (ruamel.yaml) che conserva i commenti
+    - Mantiene l'albero in cache per tutta la sessione, con chiave (mtime_ns, dimensione) del file
+    - Riconosce le entità della sezione generata dalle chiavi dell'albero, indipendentemente
+      dalla formattazione del file
+    - Applica le modifiche come operazioni sull'albero (inserimento/rimozione di chiavi) e
+      aggiorna la chiave della cache dopo la scrittura: le rigenerazioni successive costano
+      solo la modifica, senza una nuova analisi del file
+
+    Uso:
+        roundtrip = RoundTripYaml(self)
+        with YamlFileUpdater(path, self) as updater:
+            blocks = roundtrip.section_blocks(updater, section, start_pattern)
+            ...
+            roundtrip.apply_edits(updater, start_pattern, new_blocks, removed_ids)
+    """
+
+    _cache = {}  # {percorso: {"key", "tree", "lines_valid", "sections", "mappings"}}
+    _cache_guard = threading.Lock()
+
+    def __init__(self, hass_instance=None, encoding="utf-8"):
+        """
+        Inizializza la modalità round-trip.
+
+        Args:
+            hass_instance: Istanza dell'app AppDaemon usata per il logging (opzionale)
+            encoding: Codifica dei file
+        """
+        if not ROUNDTRIP_AVAILABLE:
+            raise ImportError("ruamel.yaml non disponibile")
+
+        self.hass = hass_instance
+        self.encoding = encoding
+        self._local = threading.local()
+        self.parses = 0
+        self.cache_hits = 0
+
+    @property
+    def yaml(self):
+        """Istanza ruamel.yaml del thread corrente: la pipeline elabora i file in parallelo"""
+        instance = getattr(self._local, "yaml", None)
+        if instance is None:
+            instance = YAML()
+            instance.preserve_quotes = True
+            instance.width = 4096
+            instance.indent(mapping=2, sequence=4, offset=2)
+            self._local.yaml = instance
+        return instance
+
+    def _stat_key(self, path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _entry(self, updater):
+        """Restituisce la voce di cache del file, analizzandolo solo se è cambiato su disco"""
+        path = os.path.abspath(updater.path)
+        key = self._stat_key(updater.path)
+
+        with self._cache_guard:
+            entry = self._cache.get(path)
+            if entry is not None and entry["key"] == key:
+                self.cache_hits += 1
+                return entry
+
+        text = "".join(line + "\n" for line in updater.iter_lines())
+        tree = self.yaml.load(text)
+        self.parses += 1
+        self._log(f"Albero YAML analizzato per {updater.path}")
+
+        entry = {"key": key, "tree": tree, "lines_valid": True, "sections": {}, "mappings": {}}
+        with self._cache_guard:
+            self._cache[path] = entry
+        return entry
+
+    def section_blocks(self, updater, section, section_id):
+        """
+        Restituisce i blocchi della sezione generata: {entity_id: (testo, hash)} nell'ordine del file.
+
+        Args:
+            updater: YamlFileUpdater aperto sul file
+            section: FileSection trovata da updater.find_section
+            section_id: Identificativo della sezione (es. il pattern di inizio)
+        """
+        if not section.found:
+            return {}
+
+        entry = self._entry(updater)
+        if section_id in entry["sections"]:
+            return dict(entry["sections"][section_id])
+
+        if not entry["lines_valid"]:
+            # L'albero è stato modificato dopo l'ultima analisi: numeri di riga non più affidabili
+            with self._cache_guard:
+                self._cache.pop(os.path.abspath(updater.path), None)
+            entry = self._entry(updater)
+
+        first_line = updater.line_number(section.start)
+        last_line = updater.line_number(section.end)
+        mapping, keys = self._find_section_mapping(entry["tree"], first_line, last_line)
+
+        blocks = {}
+        for key in keys:
+            text = self.dump_entry(key, mapping[key])
+            blocks[key] = (text, self.block_hash(text))
+
+        entry["sections"][section_id] = blocks
+        entry["mappings"][section_id] = mapping
+        return dict(blocks)
+
+    def apply_edits(self, updater, section_id, new_blocks, removed_ids):
+        """
+        Applica all'albero in cache le modifiche appena scritte e aggiorna la chiave della cache.
+
+        Args:
+            updater: YamlFileUpdater ancora aperto (lock posseduto) dopo la scrittura
+            section_id: Identificativo della sezione
+            new_blocks: Blocchi finali della sezione {entity_id: testo} nell'ordine del file
+            removed_ids: ID rimossi dalla sezione
+        """
+        path = os.path.abspath(updater.path)
+        with self._cache_guard:
+            entry = self._cache.get(path)
+        if entry is None:
+            return
+
+        mapping = entry["mappings"].get(section_id)
+        if mapping is None:
+            # Sezione appena creata: l'albero non la contiene, verrà rianalizzato al prossimo uso
+            with self._cache_guard:
+                self._cache.pop(path, None)
+            return
+
+        cached = entry["sections"].get(section_id, {})
+        changed_ids = [
+            entity_id for entity_id, text in new_blocks.items()
+            if entity_id not in cached or cached[entity_id][0] != text
+        ]
+        for entity_id in list(removed_ids) + changed_ids:
+            mapping.pop(entity_id, None)
+
+        # Le chiavi invariate restano contigue: si reinseriscono le altre nella loro posizione
+        keys = list(mapping)
+        present = [keys.index(entity_id) for entity_id in new_blocks if entity_id in mapping]
+        base = min(present) if present else len(mapping)
+        for position, entity_id in enumerate(new_blocks):
+            if entity_id in changed_ids:
+                value = self.yaml.load(new_blocks[entity_id])[entity_id]
+                mapping.insert(base + position, entity_id, value)
+
+        entry["sections"][section_id] = {
+            entity_id: (text, self.block_hash(text)) for entity_id, text in new_blocks.items()
+        }
+        entry["lines_valid"] = False
+        entry["key"] = self._stat_key(updater.path)
+
+    def dump_entry(self, key, value):
+        """Serializza una singola entità (senza commenti) nello stesso formato dei generatori"""
+        stream = io.StringIO()
+        self.yaml.dump({key: self._plain(value)}, stream)
+        return stream.getvalue().rstrip()
+
+    def block_hash(self, text):
+        return hashlib.sha256(text.encode(self.encoding)).hexdigest()[:16]
+
+    def get_stats(self):
+        return {"parses": self.parses, "cache_hits": self.cache_hits, "cached_files": len(self._cache)}
+
+    def _find_section_mapping(self, node, first_line, last_line):
+        """Trova la mappa le cui chiavi cadono tra le righe della sezione (anche se annidata)"""
+        if isinstance(node, dict):
+            keys = [key for key in node if first_line <= node.lc.key(key)[0] < last_line]
+            if keys:
+                return node, keys
+            children = node.values()
+        elif isinstance(node, list):
+            children = node
+        else:
+            return None, []
+
+        for child in children:
+            mapping, keys = self._find_section_mapping(child, first_line, last_line)
+            if keys:
+                return mapping, keys
+        return None, []
+
+    def _plain(self, node):
+        """Copia senza commenti: evita di trascinare le cornici della sezione nei blocchi"""
+        if isinstance(node, dict):
+            return {key: self._plain(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [self._plain(value) for value in node]
+        return node
+
+    def _log(self, message):
+        if self.hass is not None:
+            self.hass.log(message, level="DEBUG")
+
+
+def create_roundtrip(hass_instance, yaml_mode):
+    """
+    Crea l'helper round-trip se richiesto (yaml_mode: roundtrip) e disponibile.
+
+    Returns:
+        RoundTripYaml oppure None (modalità testo)
+    """
+    if yaml_mode != "roundtrip":
+        return None
+
+    if not ROUNDTRIP_AVAILABLE:
+        hass_instance.log("⚠️ yaml_mode 'roundtrip' richiede ruamel.yaml: uso la modalità testo", level="WARNING")
+        return None
+
+    return RoundTripYaml(hass_instance)
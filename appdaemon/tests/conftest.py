@@ -0,0 +1,8 @@
+"""
+Configurazione dei test: i moduli delle app AppDaemon si importano da appdaemon/conf/apps
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "conf", "apps"))
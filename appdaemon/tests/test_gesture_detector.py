@@ -0,0 +1,82 @@
+"""
+Test di GestureDetector: sequenza, stato di enable_sensor e finestra dei gesti
+"""
+
+import pytest
+
+from gesture_detector import GestureDetector
+
+LIGHT = "light.test"
+
+
+def feed(detector, transitions, light=LIGHT):
+    """Registra le transizioni (istante, stato, enable_sensor) e restituisce l'ultimo risultato"""
+    result = None
+    for now, state, enable_sensor in transitions:
+        result = detector.record(light, state, enable_sensor, now=now)
+    return result
+
+
+def test_default_activate_within_window():
+    detector = GestureDetector()
+    assert detector.record(LIGHT, "on", "off", now=10.0) is None
+    assert detector.record(LIGHT, "off", "off", now=10.6) == ("activate", pytest.approx(0.6))
+
+
+def test_default_deactivate_requires_enabled_sensor():
+    detector = GestureDetector()
+    assert feed(detector, [(0.0, "off", "on"), (0.5, "on", "on")]) == ("deactivate", 0.5)
+    assert feed(detector, [(5.0, "off", "off"), (5.5, "on", "off")]) is None
+
+
+def test_window_edges():
+    detector = GestureDetector()
+    # Esattamente al limite della finestra: gesto riconosciuto
+    assert feed(detector, [(0.0, "on", "off"), (1.0, "off", "off")]) == ("activate", 1.0)
+    # Oltre la finestra: nessun gesto
+    assert feed(detector, [(5.0, "on", "off"), (6.01, "off", "off")]) is None
+
+
+def test_enable_sensor_must_match_on_every_transition():
+    detector = GestureDetector()
+    assert feed(detector, [(0.0, "on", "on"), (0.3, "off", "off")]) is None
+
+
+def test_buffer_is_cleared_after_a_match():
+    detector = GestureDetector()
+    assert feed(detector, [(0.0, "on", "off"), (0.2, "off", "off")])[0] == "activate"
+    # La transizione "off" appena consumata non può completare un nuovo gesto
+    assert detector.record(LIGHT, "on", "off", now=0.4) is None
+    assert detector.record(LIGHT, "off", "off", now=0.6)[0] == "activate"
+
+
+def test_longest_gesture_wins():
+    detector = GestureDetector({
+        "triple": {"sequence": ["on", "off", "on"], "enable_sensor": "off", "window": 2.0},
+        "double": {"sequence": ["off", "on"], "enable_sensor": "off", "window": 2.0},
+    })
+    assert feed(detector, [(0.0, "on", "off"), (0.4, "off", "off"), (0.8, "on", "off")])[0] == "triple"
+    # Senza il primo fronte la coda corrisponde solo al gesto doppio
+    assert feed(detector, [(5.0, "off", "off"), (5.4, "on", "off")])[0] == "double"
+
+
+def test_triple_gesture_window_spans_first_to_last_transition():
+    detector = GestureDetector({
+        "activate": {"sequence": ["on", "off", "on"], "enable_sensor": "off", "window": 1.0},
+    })
+    assert feed(detector, [(0.0, "on", "off"), (0.6, "off", "off"), (1.2, "on", "off")]) is None
+    assert feed(detector, [(5.0, "on", "off"), (5.4, "off", "off"), (5.8, "on", "off")])[0] == "activate"
+
+
+def test_buffer_size_covers_the_longest_gesture():
+    detector = GestureDetector({"long": {"sequence": ["on", "off"] * 3}}, buffer_size=2)
+    assert detector.buffer_size == 6
+
+
+def test_lights_are_independent_and_clear():
+    detector = GestureDetector()
+    detector.record(LIGHT, "on", "off", now=0.0)
+    assert detector.record("light.other", "off", "off", now=0.2) is None
+
+    detector.clear(LIGHT)
+    assert detector.record(LIGHT, "off", "off", now=0.3) is None
@@ -0,0 +1,144 @@
+"""
+Test di LightStateMachine: tabella compilata su tutte le coppie (stato, evento)
+confrontata con la logica a flag che sostituisce
+"""
+
+import itertools
+
+import pytest
+
+from light_state_machine import LightStateMachine
+
+LIGHT = "light.test"
+
+# Regione lux come coppia di flag (light_illuminance_lock_on, light_turned_off_by_illuminance)
+LUX_FLAGS = {
+    "free": (False, False),
+    "locked": (True, False),
+    "off_by_lux": (False, True),
+    "off_by_lux_locked": (True, True),
+}
+
+# Effetto di ogni evento sui flag nella logica originale (None = flag invariato)
+LUX_EVENTS = {
+    "light_on": (True, None),
+    "light_off": (False, None),
+    "lux_turned_off": (False, True),
+    "lux_unlocked": (False, None),
+    "offset_off": (None, False),
+}
+
+# Regione manual: transizioni ammesse, tutte le altre coppie vengono ignorate
+MANUAL_TRANSITIONS = {
+    ("idle", "gesture_activate"): ("blink", ("complete_activation",)),
+    ("idle", "gesture_deactivate"): ("blink", ("complete_deactivation",)),
+    ("blink", "blink_done"): ("cooldown", ("start_cooldown",)),
+    ("cooldown", "cooldown_end"): ("idle", ()),
+}
+
+ALL_STATES = list(itertools.product(*(LightStateMachine.REGIONS[r]["states"] for r in LightStateMachine.ORDER)))
+ALL_EVENTS = sorted(set(LUX_EVENTS) | {event for _, event in MANUAL_TRANSITIONS})
+
+
+def apply_flags(flags, event):
+    effect = LUX_EVENTS.get(event, (None, None))
+    return tuple(flag if change is None else change for flag, change in zip(flags, effect))
+
+
+def expected_transition(state, event):
+    """Stato successivo e azioni attese, calcolati dai flag e dalle transizioni manuali"""
+    lux, manual = state
+    flags = apply_flags(LUX_FLAGS[lux], event)
+    next_lux = next(name for name, value in LUX_FLAGS.items() if value == flags)
+    next_manual, actions = MANUAL_TRANSITIONS.get((manual, event), (manual, ()))
+    return (next_lux, next_manual), actions
+
+
+@pytest.fixture
+def machine():
+    return LightStateMachine(actions={
+        "complete_activation": lambda light, context: None,
+        "complete_deactivation": lambda light, context: None,
+        "start_cooldown": lambda light, context: None,
+    })
+
+
+@pytest.mark.parametrize("state,event", list(itertools.product(ALL_STATES, ALL_EVENTS)))
+def test_compiled_table_matches_flag_logic(state, event):
+    table = LightStateMachine.compile()
+    next_state, actions = table.get((state, event), (state, ()))
+    assert (next_state, actions) == expected_transition(state, event)
+
+
+def test_table_only_contains_known_states_and_events():
+    table = LightStateMachine.compile()
+    for (state, event), (next_state, actions) in table.items():
+        assert state in ALL_STATES
+        assert next_state in ALL_STATES
+        assert event in ALL_EVENTS
+        assert all(action in ("complete_activation", "complete_deactivation", "start_cooldown") for action in actions)
+
+
+def test_regions_are_orthogonal():
+    table = LightStateMachine.compile()
+    for (state, event), (next_state, _) in table.items():
+        if event in LUX_EVENTS:
+            assert next_state[1] == state[1]
+        else:
+            assert next_state[0] == state[0]
+
+
+def test_every_state_is_reachable_from_initial():
+    table = LightStateMachine.compile()
+    reached = {LightStateMachine.INITIAL}
+    frontier = [LightStateMachine.INITIAL]
+    while frontier:
+        state = frontier.pop()
+        for event in ALL_EVENTS:
+            next_state = table.get((state, event), (state,))[0]
+            if next_state not in reached:
+                reached.add(next_state)
+                frontier.append(next_state)
+    assert reached == set(ALL_STATES)
+
+
+def test_dispatch_runs_actions_and_counts_ignored_events():
+    calls = []
+    machine = LightStateMachine(actions={
+        "complete_activation": lambda light, context: calls.append(("activation", light, context)),
+        "complete_deactivation": lambda light, context: calls.append(("deactivation", light, context)),
+        "start_cooldown": lambda light, context: calls.append(("cooldown", light, context)),
+    })
+
+    assert machine.dispatch(LIGHT, "gesture_activate", duration=0.4)
+    assert calls == [("activation", LIGHT, {"duration": 0.4})]
+    assert machine.manual_busy(LIGHT)
+
+    # Gesto durante il blink: coppia assente, ignorata
+    assert not machine.dispatch(LIGHT, "gesture_deactivate")
+    assert machine.ignored == 1
+
+    machine.dispatch(LIGHT, "blink_done")
+    machine.dispatch(LIGHT, "cooldown_end")
+    assert calls[-1][0] == "cooldown"
+    assert not machine.manual_busy(LIGHT)
+
+
+def test_lux_views_and_reset(machine):
+    machine.dispatch(LIGHT, "light_on")
+    assert machine.illuminance_locked(LIGHT)
+    assert not machine.turned_off_by_illuminance(LIGHT)
+
+    machine.dispatch(LIGHT, "lux_turned_off")
+    assert machine.turned_off_by_illuminance(LIGHT)
+    assert not machine.illuminance_locked(LIGHT)
+    assert machine.time_in_state(LIGHT, "lux") is not None
+
+    machine.reset(LIGHT)
+    assert machine.state(LIGHT) == LightStateMachine.INITIAL
+    assert machine.time_in_state(LIGHT, "lux") is None
+
+
+def test_lights_are_independent(machine):
+    machine.dispatch(LIGHT, "light_on")
+    assert machine.state("light.other") == LightStateMachine.INITIAL
@@ -0,0 +1,119 @@
+"""
+Test di LuxHysteresis: bordi delle bande, isteresi, permanenza e scadenza di sblocco
+"""
+
+import random
+
+import pytest
+
+from lux_hysteresis import LuxHysteresis
+
+LIGHT = "light.test"
+MIN_LUX = 50
+MAX_LUX = 500
+
+
+def samples(engine, values, light=LIGHT, min_lux=MIN_LUX, max_lux=MAX_LUX):
+    """Registra i campioni (istante, lux) e restituisce le bande confermate"""
+    return [engine.sample(light, lux, min_lux, max_lux, now=now) for now, lux in values]
+
+
+def test_no_hysteresis_no_dwell_matches_direct_comparisons():
+    engine = LuxHysteresis()
+    rng = random.Random(42)
+    for step in range(2000):
+        min_lux = rng.choice([0, 10, 50, 200])
+        max_lux = min_lux + rng.choice([0, 1, 100, 450])
+        lux = rng.choice([min_lux - 1, min_lux, min_lux + 0.5, max_lux, max_lux + 1, rng.uniform(0, 1000)])
+        expected = "dark" if lux < min_lux else "bright" if lux > max_lux else "normal"
+        assert engine.sample(LIGHT, lux, min_lux, max_lux, now=float(step)) == expected
+        assert engine.pending(LIGHT, now=float(step)) is None
+
+
+@pytest.mark.parametrize("lux,band", [(49.9, "dark"), (50, "normal"), (500, "normal"), (500.1, "bright")])
+def test_thresholds_are_strict(lux, band):
+    assert LuxHysteresis().sample(LIGHT, lux, MIN_LUX, MAX_LUX, now=0.0) == band
+
+
+def test_first_sample_is_adopted_without_margin_or_dwell():
+    engine = LuxHysteresis(hysteresis=10, dwell=30)
+    assert engine.sample(LIGHT, 45, MIN_LUX, MAX_LUX, now=0.0) == "dark"
+    assert engine.pending(LIGHT, now=0.0) is None
+
+
+def test_hysteresis_band_edges():
+    engine = LuxHysteresis(hysteresis=5)
+    # Da "normal" si entra in "dark" solo sotto min_lux - margine
+    assert samples(engine, [(0, 100), (1, 46), (2, 45), (3, 44.9)]) == ["normal", "normal", "normal", "dark"]
+    # Da "dark" si esce solo a min_lux + margine
+    assert samples(engine, [(4, 52), (5, 54.9), (6, 55)]) == ["dark", "dark", "normal"]
+    # Stessi bordi verso "bright"
+    assert samples(engine, [(7, 505), (8, 505.1), (9, 495.1), (10, 495)]) == ["normal", "bright", "bright", "normal"]
+
+
+def test_jump_across_both_bands():
+    engine = LuxHysteresis(hysteresis=5)
+    assert samples(engine, [(0, 10), (1, 600), (2, 10)]) == ["dark", "bright", "dark"]
+
+
+def test_dwell_confirms_after_the_permanence_time():
+    engine = LuxHysteresis(dwell=2)
+    assert samples(engine, [(0, 100), (1, 40)]) == ["normal", "normal"]
+    assert engine.pending(LIGHT, now=1.5) == pytest.approx(1.5)
+    assert samples(engine, [(2.9, 40)]) == ["normal"]
+    assert samples(engine, [(3.0, 40)]) == ["dark"]
+    assert engine.pending(LIGHT, now=3.0) is None
+
+
+def test_dwell_reversal_cancels_the_pending_change():
+    engine = LuxHysteresis(dwell=2)
+    samples(engine, [(0, 100), (1, 40)])
+    assert samples(engine, [(2, 100)]) == ["normal"]
+    assert engine.pending(LIGHT, now=2) is None
+    # Il conteggio riparte dal nuovo attraversamento
+    assert samples(engine, [(3, 40), (4.5, 40), (5, 40)]) == ["normal", "normal", "dark"]
+
+
+def test_dwell_switching_candidate_restarts_the_timer():
+    engine = LuxHysteresis(dwell=2)
+    samples(engine, [(0, 100), (1, 40)])
+    assert samples(engine, [(2, 600), (3.5, 600), (4, 600)]) == ["normal", "normal", "bright"]
+
+
+def test_unlock_deadline_is_single_shot_and_holds_the_last_lux():
+    engine = LuxHysteresis()
+    engine.sample(LIGHT, 80, MIN_LUX, MAX_LUX, now=0.0)
+    engine.arm_unlock(LIGHT, 5, now=0.0)
+
+    assert engine.unlock_window(LIGHT, now=4.9)
+    assert engine.take_unlock(LIGHT, now=4.9) == (False, None)
+    assert not engine.unlock_window(LIGHT, now=5.0)
+    assert engine.take_unlock(LIGHT, now=5.0) == (True, 80)
+    assert engine.take_unlock(LIGHT, now=6.0) == (False, None)
+
+
+def test_disarm_and_clear():
+    engine = LuxHysteresis()
+    engine.arm_unlock(LIGHT, 5, now=0.0)
+    engine.disarm_unlock(LIGHT)
+    assert engine.take_unlock(LIGHT, now=10.0) == (False, None)
+
+    engine.sample(LIGHT, 80, MIN_LUX, MAX_LUX, now=0.0)
+    engine.clear(LIGHT)
+    assert engine.last_lux(LIGHT) is None
+    assert engine.take_unlock(LIGHT, now=10.0) == (False, None)
+
+
+def test_export_restore_keeps_band_pending_change_and_unlock_deadline():
+    engine = LuxHysteresis(dwell=2)
+    samples(engine, [(0, 100), (1, 40)])
+    engine.arm_unlock(LIGHT, 5, now=1.0)
+    exported = engine.export(now=1.5)
+
+    restored = LuxHysteresis(dwell=2)
+    restored.restore(LIGHT, exported[LIGHT], now=100.0)
+    assert restored.last_lux(LIGHT) == 40
+    assert restored.pending(LIGHT, now=100.0) == pytest.approx(1.5)
+    assert restored.unlock_window(LIGHT, now=104.4)
+    assert restored.take_unlock(LIGHT, now=104.5) == (True, 40)
+    assert samples(restored, [(101.5, 40)]) == ["dark"]